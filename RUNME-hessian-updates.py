@@ -0,0 +1,131 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy            as np
+import time
+
+from   state   import kalman
+from   para    import pmh
+from   models  import lgss_4parameters
+
+# Use the CPU time of the process if available
+cputime = getattr( time, 'process_time', getattr( time, 'clock', time.time ) );
+
+
+##############################################################################
+# Arrange the data structures
+##############################################################################
+km               = kalman.kalmanMethods();
+
+
+##############################################################################
+# Setup the system
+##############################################################################
+sys               = lgss_4parameters.ssm()
+sys.par           = np.zeros((sys.nPar,1))
+sys.par[0]        = 0.20;
+sys.par[1]        = 0.80;
+sys.par[2]        = 1.00;
+sys.par[3]        = 0.10;
+sys.T             = 250;
+sys.xo            = 0.0;
+
+
+##############################################################################
+# Load data
+##############################################################################
+sys.generateData(fileName="data/lgssT250_smallR.csv",order="xy");
+
+
+##############################################################################
+# Setup the parameters
+##############################################################################
+th               = lgss_4parameters.ssm()
+th.version       = "standard"
+th.nParInference = 3;
+th.copyData(sys);
+
+
+##############################################################################
+# Setup the Kalman filter algorithm
+##############################################################################
+
+# Use the Kalman filter to estimate the log-likelihood
+km.filter          = km.kf;
+
+# Use the RTS smoother to estimate the gradient
+km.smoother        = km.rts;
+
+
+########################################################################
+# Quasi-Newton PMH2 sampler with each of the update rules
+########################################################################
+
+rules   = ( "bfgs", "dampedBFGS", "sr1" );
+results = {};
+
+for rule in rules:
+
+    qpmh2                      = pmh.stPMH();
+    qpmh2.nIter                = 5000;
+    qpmh2.nBurnIn              = 1000;
+    qpmh2.initPar              = th.returnParameters();
+    qpmh2.stepSize             = 1.0;
+    qpmh2.epsilon              = 1000;
+    qpmh2.memoryLength         = 100;
+    qpmh2.PSDmethodhybridSamps = 500;
+
+    # Set the update rule for the Hessian estimate
+    qpmh2.hessianUpdate        = rule;
+
+    # Set seed to reproduce the results
+    np.random.seed( 87655678 );
+
+    # Run the sampler and record the CPU time
+    start = cputime();
+    qpmh2.runSampler(km, sys, th, "qPMH2");
+    cpu   = cputime() - start;
+
+    # Compute IACT
+    iact  = qpmh2.calcIACT();
+
+    results[rule] = ( cpu, iact, qpmh2.nCurvatureFixesSum, qpmh2.nHessianMirrored, qpmh2.nHessianReplaced );
+
+
+########################################################################
+# Compare the ESS per CPU-second of the parameter with the largest IACT,
+# i.e. ( nIter - nBurnIn ) / ( max IACT * CPU time )
+########################################################################
+
+print("################################################################################################ ");
+print("%-12s %10s %24s %14s %14s %16s %10s" % ( "rule", "CPU [s]", "IACT", "ESS / CPU-s", "max IACT*CPU", "curvature fixes", "mirr/repl" ));
+
+for rule in rules:
+    cpu, iact, nFixes, nMirrored, nReplaced = results[rule];
+
+    print("%-12s %10.1f %24s %14.2f %14.1f %16d %10s" % ( rule, cpu, str( np.round( iact, 1 ) ), ( qpmh2.nIter - qpmh2.nBurnIn ) / ( np.max( iact ) * cpu ),
+          np.max( iact ) * cpu, nFixes, str(nMirrored) + "/" + str(nReplaced) ));
+
+print("################################################################################################ ");
+
+########################################################################
+# End of file
+########################################################################
@@ -0,0 +1,127 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy            as np
+
+from   state   import kalman
+from   para    import pmh
+from   para    import pmh_map
+from   models  import lgss_4parameters
+
+
+##############################################################################
+# Arrange the data structures
+##############################################################################
+km               = kalman.kalmanMethods();
+
+
+##############################################################################
+# Setup the system
+##############################################################################
+sys               = lgss_4parameters.ssm()
+sys.par           = np.zeros((sys.nPar,1))
+sys.par[0]        = 0.20;
+sys.par[1]        = 0.80;
+sys.par[2]        = 1.00;
+sys.par[3]        = 0.10;
+sys.T             = 250;
+sys.xo            = 0.0;
+
+
+##############################################################################
+# Load data
+##############################################################################
+sys.generateData(fileName="data/lgssT250_smallR.csv",order="xy");
+
+
+##############################################################################
+# Setup the parameters
+##############################################################################
+th               = lgss_4parameters.ssm()
+th.version       = "standard"
+th.nParInference = 3;
+th.copyData(sys);
+
+
+##############################################################################
+# Setup the Kalman filter algorithm
+##############################################################################
+
+# Use the Kalman filter to estimate the log-likelihood
+km.filter          = km.kf;
+
+# Use the RTS smoother to estimate the gradient
+km.smoother        = km.rts;
+
+
+##############################################################################
+# Estimate the posterior mode and the curvature at the mode, starting from
+# parameters far from the true parameters (replaces the pilot run)
+##############################################################################
+mode             = pmh_map.posteriorMode();
+mode.method      = "newton";
+mode.findMode(km, sys, th, np.array( ( 0.5, 0.5, 0.5 ) ));
+
+
+########################################################################
+# Run the pPMH1 and qPMH2 samplers from the mode with a short burn-in
+########################################################################
+
+ppmh1                      = pmh.stPMH();
+ppmh1.nIter                = 3000;
+ppmh1.nBurnIn              = 200;
+ppmh1.stepSize             = 1.125 * np.sqrt( th.nParInference**(-1/3.0) );
+mode.configure( ppmh1 );
+
+np.random.seed( 87655678 );
+ppmh1.runSampler(km, sys, th, "pPMH1");
+iactPPMH1 = ppmh1.calcIACT();
+
+qpmh2                      = pmh.stPMH();
+qpmh2.nIter                = 3000;
+qpmh2.nBurnIn              = 200;
+qpmh2.stepSize             = 1.0;
+qpmh2.memoryLength         = 100;
+qpmh2.PSDmethodhybridSamps = 100;
+mode.configure( qpmh2 );
+
+np.random.seed( 87655678 );
+qpmh2.runSampler(km, sys, th, "qPMH2");
+iactQPMH2 = qpmh2.calcIACT();
+
+
+########################################################################
+# Compare the mode and the curvature with the posterior estimates
+########################################################################
+
+print("################################################################################################ ");
+print("%-12s %32s %32s" % ( "", "mean", "std" ));
+print("%-12s %32s %32s" % ( "mode", str( np.round( mode.thModeOriginal, 3 ) ), str( np.round( np.sqrt( np.diag( mode.invHessian ) ), 3 ) ) ));
+
+for name, sampler, iact in ( ( "pPMH1", ppmh1, iactPPMH1 ), ( "qPMH2", qpmh2, iactQPMH2 ) ):
+    print("%-12s %32s %32s   IACT: %s" % ( name, str( np.round( np.mean( sampler.tho[sampler.nBurnIn:,:], axis=0 ), 3 ) ),
+          str( np.round( np.std( sampler.tho[sampler.nBurnIn:,:], axis=0 ), 3 ) ), str( np.round( iact, 1 ) ) ));
+
+print("################################################################################################ ");
+
+########################################################################
+# End of file
+########################################################################
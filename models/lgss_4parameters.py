@@ -176,6 +176,53 @@ class ssm(object):
         else:
             return 0.0;
 
+    #=========================================================================
+    # Define transformations of the parameters
+    #=========================================================================
+    # The version "logitlog" samples the parameters (mu, logit((phi+1)/2),
+    # log(sigmav), log(sigmae)) on an unconstrained space. storeParameters
+    # stores the transformed parameters and transform maps them back to the
+    # original parameters (in par), invTransform does the opposite.
+    def transform(self):
+        if ( self.version == "logitlog" ):
+            if ( self.nParInference > 1 ):
+                self.par[1] = np.tanh( 0.5 * self.par[1] );
+            for kk in range(2,self.nParInference):
+                self.par[kk] = np.exp( self.par[kk] );
+
+    def invTransform(self):
+        if ( self.version == "logitlog" ):
+            if ( self.nParInference > 1 ):
+                self.par[1] = 2.0 * np.arctanh( self.par[1] );
+            for kk in range(2,self.nParInference):
+                self.par[kk] = np.log( self.par[kk] );
+
+    # Log-Jacobian of the transformation from the transformed parameters
+    def Jacobian(self):
+        out = 0.0;
+
+        if ( self.version == "logitlog" ):
+            if ( self.nParInference > 1 ):
+                out += np.log( 0.5 * ( 1.0 - self.par[1]**2 ) );
+            for kk in range(2,self.nParInference):
+                out += np.log( self.par[kk] );
+
+        return( out );
+
+    # Gradient with respect to the transformed parameters (chain rule) of the
+    # log-posterior including the log-Jacobian, from the gradient with
+    # respect to the original parameters
+    def transformGradient(self, gradient):
+        out = np.array( gradient, dtype=float, copy=True );
+
+        if ( self.version == "logitlog" ):
+            if ( self.nParInference > 1 ):
+                out[1] = out[1] * 0.5 * ( 1.0 - self.par[1]**2 ) - self.par[1];
+            for kk in range(2,self.nParInference):
+                out[kk] = out[kk] * self.par[kk] + 1.0;
+
+        return( out );
+
     #=========================================================================
     # Define standard methods for the model struct
     #=========================================================================
@@ -188,11 +235,6 @@ class ssm(object):
     # Standard data generation for this model
     generateData            = template_generateData;
 
-    # No tranformations available
-    transform               = empty_transform;
-    invTransform            = empty_invTransform;
-    Jacobian                = empty_Jacobian;
-
     # No EM algorithm available for this model
     Qfunc                   = empty_Qfunc;
     Mstep                   = empty_Mstep;
@@ -19,9 +19,24 @@
 ##############################################################################
 ##############################################################################
 
-import numpy       as     np
-from   pmh_helpers import *
+import numpy        as     np
+from   pmh_helpers  import *
+from   pmh_lbfgs    import *
+from   pmh_parallel import packEstimator, unpackEstimator, restoreEstimator
+from   pmh_metrics  import runningStatistics, runningCovariance
+from   pmh_output   import chainWriter, writeChain
+from   collections  import deque
 import pandas
+import os
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Use the CPU time of the process if available
+cputime = getattr( time, 'process_time', getattr( time, 'clock', time.time ) );
 
 ##########################################################################
 # Main class
@@ -32,6 +47,104 @@ class stPMH(object):
     # Initalise some variables
     memoryLength      = None;
     empHessian        = None;
+    fileOutName       = None;
+
+    # Update rule for the Hessian estimate in qPMH2: "bfgs" (compact L-BFGS),
+    # "dampedBFGS" (Powell damping with dampingThreshold) or "sr1" (pairs
+    # with a denominator below sr1Threshold are skipped)
+    hessianUpdate     = "bfgs";
+    dampingThreshold  = 0.2;
+    sr1Threshold      = 1e-8;
+
+    # Hessian estimates that are not PD are shifted during the burn-in so
+    # that the smallest eigenvalue is this fraction of the largest one
+    hessianShiftTolerance = 1e-3;
+
+    # Estimate of the negative inverse Hessian used by qPMH2 in the first
+    # memoryLength iterations and when there are too few curvature pairs
+    # (eye / epsilon if None)
+    initialHessian    = None;
+
+    # Surrogate filter for delayed acceptance (not used if None), its
+    # method update(pmh,thSys) is called after each iteration if it exists
+    surrogate         = None;
+
+    # Adapt the step size during the burn-in using dual averaging towards
+    # the target acceptance rate (for exact likelihoods, lower the targets
+    # when using particle filters). The step size is kept within a factor
+    # adaptRange of the initial step size, as the acceptance rate of qPMH2
+    # also depends on the changes in the Hessian estimate
+    adaptStepSize     = False;
+    targetAcceptance  = { "pPMH0": 0.234, "pPMH1": 0.574, "qPMH2": 0.574 };
+    adaptGamma        = 0.05;
+    adaptT0           = 10.0;
+    adaptKappa        = 0.75;
+    adaptRange        = 10.0;
+
+    # Adaptive Metropolis for pPMH0 and pPMH1: during the burn-in, invHessian
+    # is replaced every adaptInterval iterations by the covariance of the
+    # states from iteration adaptStart (plus adaptEpsilon on the diagonal).
+    # If invHessian is not given, adaptInitVariance * I is used initially.
+    adaptProposal     = False;
+    adaptStart        = 100;
+    adaptInterval     = 100;
+    adaptEpsilon      = 1e-6;
+    adaptInitVariance = 0.01;
+
+    # Write the complete state of the sampler to checkpointFile every
+    # checkpointInterval iterations (not used if None), the attributes in
+    # checkpointExclude are set up again when resuming
+    checkpointFile     = None;
+    checkpointInterval = 1000;
+    checkpointExclude  = ( "pool", "pending", "sys", "surrogate", "resumeState", "metrics", "profiler", "outputWriter",
+                           "fidelitySchedule", "fidelityEstimators" );
+    resumeState        = None;
+
+    # Sink for the progress metrics of the chain, e.g. a metricsSink
+    # object from pmh_metrics (not used if None)
+    metrics            = None;
+
+    # Profiler for the hooks of the sampler, e.g. a profiler object from
+    # pmh_profile (not used if None)
+    profiler           = None;
+
+    # Write the chain to the binary file outputFile (see pmh_output) in
+    # chunks of outputChunkSize iterations from a background thread during
+    # the run (not used if None)
+    outputFile         = None;
+    outputChunkSize    = 1000;
+    outputWriter       = None;
+
+    # Run until the ESS (batch means, after the burn-in) of all parameters
+    # is at least targetESS, checked every essCheckInterval iterations. The
+    # arrays are grown in chunks of growSize iterations and nIter is the
+    # maximum number of iterations (set to the number of iterations run
+    # when the sampler stops). Not used if None.
+    targetESS          = None;
+    essCheckInterval   = 100;
+    growSize           = 10000;
+
+    # Print a progress report every progressInterval iterations (and at the
+    # end of the run), not used if None
+    progressInterval   = 100;
+
+    # Multi-fidelity burn-in: a list of ( stop, estimator ) where estimator
+    # (a filter/smoother object, or a dict of settings applied to a copy of
+    # the filter/smoother passed to runSampler, e.g. { 'nPart': 50 }) is used
+    # for the iterations before stop. The filter/smoother passed to
+    # runSampler is used after the last stop (at most nBurnIn). When
+    # switching, the log-likelihoods of the states that the chain can return
+    # to are estimated again (rows already written to outputFile keep the
+    # earlier estimates). The CPU time and number of filter/smoother runs
+    # of each phase are recorded in fidelityCost. Not used if None, and not
+    # supported by mtmPMH, speculativePMH and lockstepPMH.
+    fidelitySchedule   = None;
+
+    # Arrays (and lists) with one row for each iteration
+    iterationArrays    = ( "ll", "llp", "th", "tho", "thp", "thpo", "aprob", "accept", "gradient", "gradientp", "hessian", "hessianp",
+                           "ngradient", "ngradientp", "proposal", "proposalp", "prior", "priorp", "J", "Jp", "proposalProb",
+                           "proposalProbP", "llDiff", "llSurrogate", "llSurrogatep", "screened", "stepSizeHistory", "nHessianSamples",
+                           "nCurvatureFixes", "hessianFallback" );
 
     ##########################################################################
     # Main sampling routine
@@ -39,9 +152,176 @@ class stPMH(object):
 
     def runSampler(self,sm,sys,thSys,PMHtype):
 
+        if ( self.profiler != None ):
+            # Attach the profiler to the hooks during the run
+            self.profiler.attach( self, sm, thSys );
+            try:
+                self.runMCMC( sm, sys, thSys, PMHtype );
+            finally:
+                self.profiler.detach();
+
+            self.profiler.printSummary();
+        else:
+            self.runMCMC( sm, sys, thSys, PMHtype );
+
+    def runMCMC(self,sm,sys,thSys,PMHtype):
+
+        # The filter/smoother of the current phase of the fidelity schedule
+        # (the checkpoints always store sm)
+        smk = sm;
+
+        if ( self.fidelitySchedule != None ):
+            resumed = ( self.resumeState != None );
+            smk     = self.startFidelity( sm );
+
+            self.startSampler( ( sm if resumed else smk ), sys, thSys, PMHtype );
+
+            if ( resumed ):
+                smk = self.fidelityEstimator( sm, self.fidelityPhase );
+                self.fidelityClock = ( time.time(), cputime(), self.nEstimatorCalls );
+        else:
+            self.startSampler( sm, sys, thSys, PMHtype );
+
         #=====================================================================
-        # Initalisation
+        # Main MCMC-loop
         #=====================================================================
+        while ( self.iter + 1 < self.nIter ):
+
+            # Switch to the next phase of the fidelity schedule
+            if ( self.fidelitySchedule != None ):
+                smk = self.updateFidelity( sm, sys, thSys );
+
+            # Propose parameters
+            self.proposeStep( sys, thSys );
+
+            # Calculate acceptance probability
+            self.calculateAcceptanceProbability( smk, thSys );
+
+            # Accept/reject and update the state of the sampler
+            if ( self.completeStep( sm, thSys ) ):
+                break;
+
+        if ( self.fidelitySchedule != None ):
+            self.finishFidelity();
+
+        self.finishSampler();
+
+    ##########################################################################
+    # Initalisation or restore the state from a checkpoint
+    ##########################################################################
+    def startSampler(self,sm,sys,thSys,PMHtype):
+
+        resumed = ( self.resumeState != None );
+
+        if ( resumed ):
+            self.restoreCheckpoint(sm,sys,thSys);
+        else:
+            self.initialiseSampler(sm,sys,thSys,PMHtype);
+
+        # Start the writer for the output
+        if ( self.outputFile != None ):
+            if ( ( not resumed ) or ( not hasattr( self, 'outputRow' ) ) ):
+                self.outputRow = 0;
+            self.outputWriter = chainWriter( self.outputFile, self.outputLabels(), resume=resumed );
+
+    ##########################################################################
+    # Start the next iteration by proposing parameters (stored in thSys)
+    ##########################################################################
+    def proposeStep(self,sys,thSys):
+
+        kk        = self.iter + 1;
+        self.iter = kk;
+        self.stepSizeHistory[kk] = self.stepSize;
+
+        self.sampleProposal();
+        thSys.storeParameters( self.thp[kk,:], sys );
+        thSys.transform();
+
+    ##########################################################################
+    # Complete the iteration after the acceptance probability is computed,
+    # returns True if the sampler should stop
+    ##########################################################################
+    def completeStep(self,sm,thSys):
+
+        kk = self.iter;
+
+        # Accept/reject step
+        if ( np.random.random(1) < self.aprob[kk] ):
+            self.acceptParameters( thSys );
+        else:
+            self.rejectParameters( thSys );
+
+        # Adapt the step size during the burn-in
+        if ( ( self.adaptStepSize ) & ( kk <= self.nBurnIn ) ):
+            self.updateStepSize();
+
+        # Update the surrogate (e.g. refit an emulator)
+        if ( ( self.surrogate != None ) and ( hasattr( self.surrogate, 'update' ) ) ):
+            self.surrogate.update( self, thSys );
+
+        # Update the running statistics and write out progress report
+        self.updateRunningStatistics();
+        self.updateCovariance();
+
+        if ( ( self.progressInterval != None ) and ( np.remainder( kk, self.progressInterval ) == 0 ) ):
+            progressPrint( self );
+
+        if ( self.metrics != None ):
+            self.metrics.update( self );
+
+        # Write out the output
+        if ( ( self.outputWriter != None ) and ( kk + 1 - self.outputRow >= self.outputChunkSize ) ):
+            self.writeOutputChunk();
+
+        # Stop if the target ESS is reached, otherwise grow the arrays (before
+        # the checkpoint, so that it includes the current state)
+        stop = ( ( self.targetESS != None ) and ( self.checkTargetESS() ) );
+
+        # Write out checkpoint
+        if ( ( self.checkpointFile != None ) and ( not stop ) and ( np.remainder( kk, self.checkpointInterval ) == 0 ) ):
+            self.saveCheckpoint( sm );
+
+        return stop;
+
+    ##########################################################################
+    # Finish the run after the last iteration
+    ##########################################################################
+    def finishSampler(self):
+
+        # Remove the iterations that were not run
+        if ( self.iter + 1 < self.nIter ):
+            self.resizeArrays( self.iter + 1 );
+
+        if ( self.progressInterval != None ):
+            progressPrint(self);
+
+        if ( self.metrics != None ):
+            self.metrics.update( self, force=True );
+
+        if ( self.outputWriter != None ):
+            self.writeOutputChunk();
+            self.outputWriter.close();
+            self.outputWriter = None;
+            print("runSampler: wrote the chain to file: " + self.outputFile);
+
+    ##########################################################################
+    # Resume the sampler from a checkpoint written by saveCheckpoint, the
+    # chain continues exactly as if it had not been interrupted
+    ##########################################################################
+    def resume(self,sm,sys,thSys,fileName):
+
+        f = open( fileName, 'rb' );
+        try:
+            self.resumeState = pickle.load( f );
+        finally:
+            f.close();
+
+        self.runSampler( sm, sys, thSys, self.resumeState['sampler']['PMHtype'] );
+
+    ##########################################################################
+    # Initialise the sampler and run the filter/smoother at initPar
+    ##########################################################################
+    def initialiseSampler(self,sm,sys,thSys,PMHtype):
 
         # Set file prefix from model
         self.filePrefix = thSys.filePrefix;
@@ -49,18 +329,31 @@ class stPMH(object):
         self.PMHtype    = PMHtype;
         self.nPars      = thSys.nParInference;
 
+        # Allocate the first chunk of iterations when running until the
+        # target ESS is reached
+        self.maxIter    = self.nIter;
+
+        if ( self.targetESS != None ):
+            self.nIter    = int( np.min( ( self.maxIter, self.nBurnIn + self.growSize ) ) );
+            self.essStats = runningStatistics( self.nPars );
+
         # Allocate vectors
         self.ll             = np.zeros((self.nIter,1))
         self.llp            = np.zeros((self.nIter,1))
         self.th             = np.zeros((self.nIter,self.nPars))
         self.tho            = np.zeros((self.nIter,self.nPars))
         self.thp            = np.zeros((self.nIter,self.nPars))
+        self.thpo           = np.zeros((self.nIter,self.nPars))
         self.aprob          = np.zeros((self.nIter,1))
         self.accept         = np.zeros((self.nIter,1))
         self.gradient       = np.zeros((self.nIter,self.nPars))
         self.gradientp      = np.zeros((self.nIter,self.nPars))
         self.hessian        = np.zeros((self.nIter,self.nPars,self.nPars))
         self.hessianp       = np.zeros((self.nIter,self.nPars,self.nPars))
+        self.ngradient      = np.zeros((self.nIter,self.nPars))
+        self.ngradientp     = np.zeros((self.nIter,self.nPars))
+        self.proposal       = [None] * self.nIter
+        self.proposalp      = [None] * self.nIter
         self.prior          = np.zeros((self.nIter,1))
         self.priorp         = np.zeros((self.nIter,1))
         self.J              = np.zeros((self.nIter,1))
@@ -68,77 +361,413 @@ class stPMH(object):
         self.proposalProb   = np.zeros((self.nIter,1))
         self.proposalProbP  = np.zeros((self.nIter,1))
         self.llDiff         = np.zeros((self.nIter,1))
+        self.llSurrogate    = np.zeros((self.nIter,1))
+        self.llSurrogatep   = np.zeros((self.nIter,1))
+        self.screened       = np.zeros((self.nIter,1))
+        self.stepSizeHistory = np.zeros((self.nIter,1))
+
+        # Running statistics for the progress reports
+        self.runningStats       = runningStatistics( self.nPars );
+        self.nAccepted          = 0.0;
+        self.nScreened          = 0.0;
+        self.nHessianSamplesSum = 0.0;
+        self.nHessianMirrored   = 0;
+        self.nHessianReplaced   = 0;
+        self.nCurvatureFixesSum = 0.0;
+        self.nOutOfSupport      = 0.0;
+        self.nEstimatorCalls    = 0;
+
+        # Initialise the step size adaptation
+        if ( self.adaptStepSize ):
+            self.adaptMu          = np.log( self.stepSize );
+            self.adaptHbar        = 0.0;
+            self.adaptLogStepSize = np.log( self.stepSize );
+
+        # Running covariance of the states, used for adaptive Metropolis and
+        # for replacing Hessian estimates that are not PSD in qPMH2 (starting
+        # from the last PSDmethodhybridSamps iterations of the burn-in)
+        self.runningCov      = runningCovariance( self.nPars );
+        self.covStart        = self.adaptStart;
+        self.empHessian      = None;
+
+        if ( PMHtype == "qPMH2" ):
+            self.covStart    = self.nBurnIn - self.PSDmethodhybridSamps;
+
+        if ( ( self.adaptProposal ) and ( not hasattr( self, 'invHessian' ) ) ):
+            self.invHessian  = np.eye( self.nPars ) * self.adaptInitVariance;
 
         # Get the order of the PMH sampler
         if   ( PMHtype == "pPMH0" ):
             self.PMHtypeN        = 0;
+            self.proposalFixed   = gaussianProposal( self.invHessian );
         elif ( PMHtype == "pPMH1" ):
             self.PMHtypeN        = 1;
+            self.proposalFixed   = gaussianProposal( self.invHessian );
         elif ( PMHtype == "qPMH2" ):
             self.PMHtypeN        = 2;
             self.nHessianSamples = np.zeros((self.nIter,1))
 
-        # Initialise the parameters in the proposal
+            # Number of curvature pairs that were damped/skipped (or violate
+            # the curvature condition for bfgs) in the Hessian estimate and if
+            # the estimate was mirrored (1) or replaced (2) by checkHessian
+            self.nCurvatureFixes = np.zeros((self.nIter,1))
+            self.hessianFallback = np.zeros((self.nIter,1))
+
+            # Indices of the unique states inside the memory length and the
+            # log-likelihood values that have been visited by the chain
+            self.uniqueIdx       = deque();
+            self.uniqueLL        = set();
+
+            # Compact representation of the quasi-Newton Hessian estimate
+            self.lbfgs           = lbfgsMemory( self.nPars, self.memoryLength );
+
+        # Initialise the parameters in the proposal (initPar is given for
+        # the original parameters, the sampler uses the transformed ones)
         thSys.storeParameters(self.initPar,sys);
+        thSys.invTransform();
+        self.thp[0,:]  = thSys.returnParameters();
+        thSys.transform();
+        self.thpo[0,:] = thSys.returnParameters();
+        self.priorp[0] = thSys.prior();
+        self.Jp[0]     = thSys.Jacobian();
 
         # Run the initial filter/smoother
         self.estimateLikelihoodGradients(sm,thSys);
+
+        if ( self.surrogate != None ):
+            self.estimateSurrogateLikelihood(thSys);
+
         self.acceptParameters(thSys);
 
-        # Save the current parameters
-        self.th[0,:]  = thSys.returnParameters();
+        self.updateRunningStatistics();
+        self.updateCovariance();
 
-        #=====================================================================
-        # Main MCMC-loop
-        #=====================================================================
-        for kk in range(1,self.nIter):
+    ##########################################################################
+    # Multi-fidelity burn-in: set up the estimators of the phases and the
+    # records of their cost, returns the estimator of the first phase
+    ##########################################################################
+    def startFidelity(self,sm):
 
-            self.iter = kk;
+        stops = [ stop for ( stop, estimator ) in self.fidelitySchedule ];
 
-            # Propose parameters
-            self.sampleProposal();
-            thSys.storeParameters( self.thp[kk,:], sys );
+        if ( ( np.any( np.diff( stops ) <= 0 ) ) or ( stops[-1] > self.nBurnIn ) ):
+            raise NameError("startFidelity: the switch points in fidelitySchedule must be increasing and at most nBurnIn.");
 
-            # Calculate acceptance probability
-            self.calculateAcceptanceProbability( sm, thSys );
+        self.fidelityEstimators = [];
+        self.fidelityCost       = [];
+
+        for kk, ( stop, estimator ) in enumerate( self.fidelitySchedule ):
+
+            # Apply the settings to a copy of sm
+            if ( isinstance( estimator, dict ) ):
+                settings  = estimator;
+                label     = str( settings );
+                estimator = unpackEstimator( packEstimator( sm ) );
 
-            # Accept/reject step
-            if ( np.random.random(1) < self.aprob[kk] ):
-                self.acceptParameters( thSys );
+                for key, value in settings.items():
+                    setattr( estimator, key, value );
             else:
-                self.rejectParameters( thSys );
+                label     = estimator.__class__.__name__ + "." + estimator.filter.__name__;
+
+            self.fidelityEstimators.append( estimator );
+            self.fidelityCost.append( { 'label': label, 'start': ( 0 if kk == 0 else stops[kk-1] ), 'stop': stop, 'cpuTime': 0.0, 'wallTime': 0.0, 'nRuns': 0 } );
+
+        self.fidelityCost.append( { 'label': sm.__class__.__name__ + "." + sm.filter.__name__, 'start': stops[-1], 'stop': self.nIter, 'cpuTime': 0.0, 'wallTime': 0.0, 'nRuns': 0 } );
+
+        self.fidelityPhase = 0;
+        self.fidelityClock = ( time.time(), cputime(), 0 );
+
+        return self.fidelityEstimators[0];
+
+    # Helper: the estimator of phase kk
+    def fidelityEstimator(self,sm,kk):
+
+        if ( kk < len( self.fidelityEstimators ) ):
+            return self.fidelityEstimators[kk];
+
+        return sm;
+
+    # Switch phase if the next iteration is at a switch point, returns the
+    # estimator to use in the next iteration
+    def updateFidelity(self,sm,sys,thSys):
+
+        kk = self.fidelityPhase;
+
+        while ( ( kk < len( self.fidelitySchedule ) ) and ( self.iter + 1 >= self.fidelitySchedule[kk][0] ) ):
+            kk += 1;
+
+        smk = self.fidelityEstimator( sm, kk );
+
+        if ( kk != self.fidelityPhase ):
+            self.accumulateFidelityCost();
+            self.fidelityPhase = kk;
+
+            # Estimate the log-likelihoods of the states that the chain can
+            # return to (the last memoryLength states for qPMH2) again using
+            # the new estimator
+            if ( self.PMHtypeN == 2 ):
+                idx = range( np.max( ( 0, self.iter - self.memoryLength ) ), self.iter + 1 );
+            else:
+                idx = [ self.iter ];
+
+            lls = {};
+            for ii in idx:
+                key = tuple( self.th[ii,:] );
 
-            # Write out progress report
-            if np.remainder( kk, 100 ) == 0:
-                progressPrint( self );
+                if ( key not in lls ):
+                    thSys.storeParameters( self.th[ii,:], sys );
+                    thSys.transform();
+                    smk.filter( thSys );
+                    self.nEstimatorCalls += 1;
+                    lls[key] = smk.ll;
 
-        progressPrint(self);
+                    if ( self.PMHtypeN == 2 ):
+                        self.uniqueLL.add( float( smk.ll ) );
+
+                self.ll[ii] = lls[key];
+
+        return smk;
+
+    # Add the cost since the last call to the current phase
+    def accumulateFidelityCost(self):
+
+        wallTime, cpuTime, nRuns = self.fidelityClock;
+        cost = self.fidelityCost[ self.fidelityPhase ];
+
+        cost['wallTime'] += time.time() - wallTime;
+        cost['cpuTime']  += cputime() - cpuTime;
+        cost['nRuns']    += self.nEstimatorCalls - nRuns;
+
+        self.fidelityClock = ( time.time(), cputime(), self.nEstimatorCalls );
+
+    def finishFidelity(self):
+
+        self.accumulateFidelityCost();
+        self.fidelityCost[-1]['stop'] = self.iter + 1;
+
+        if ( self.progressInterval != None ):
+            print("runSampler: cost of the phases of the fidelity schedule");
+            print("%-40s %16s %12s %12s %14s" % ( "estimator", "iterations", "runs", "CPU [s]", "CPU [ms]/run" ));
+
+            for cost in self.fidelityCost:
+                print("%-40s %16s %12d %12.2f %14.3f" % ( cost['label'][0:40], str(cost['start']) + "-" + str(cost['stop']), cost['nRuns'], cost['cpuTime'],
+                      1000.0 * cost['cpuTime'] / np.max( ( cost['nRuns'], 1 ) ) ));
+
+    ##########################################################################
+    # Update the running statistics with the current iteration
+    ##########################################################################
+    def updateRunningStatistics(self):
+
+        self.runningStats.push( self.tho[self.iter,:] );
+        self.nAccepted += self.accept[self.iter,0];
+        self.nScreened += self.screened[self.iter,0];
+
+        if ( ( self.PMHtypeN == 2 ) and ( self.iter > self.memoryLength ) ):
+            self.nHessianSamplesSum += self.nHessianSamples[self.iter,0];
+            self.nCurvatureFixesSum += self.nCurvatureFixes[self.iter,0];
+
+    ##########################################################################
+    # Write the state of the sampler, the filter/smoother (and surrogate)
+    # and the random number generator to checkpointFile
+    ##########################################################################
+    def saveCheckpoint(self,sm):
+
+        if ( self.fidelitySchedule != None ):
+            self.accumulateFidelityCost();
+
+        state = dict( ( key, value ) for ( key, value ) in self.__dict__.items() if ( key not in self.checkpointExclude ) and ( not callable( value ) ) );
+        out   = { 'sampler': state, 'estimator': packEstimator(sm), 'surrogate': None, 'random': np.random.get_state() };
+
+        if ( self.surrogate != None ):
+            out['surrogate'] = packEstimator( self.surrogate );
+
+        # Write to a temporary file first to not leave a broken checkpoint
+        # if the job is stopped while writing
+        ensure_dir( self.checkpointFile );
+        fileTemp = self.checkpointFile + ".tmp";
+
+        f = open( fileTemp, 'wb' );
+        try:
+            pickle.dump( out, f, pickle.HIGHEST_PROTOCOL );
+        finally:
+            f.close();
+
+        os.rename( fileTemp, self.checkpointFile );
+
+    ##########################################################################
+    # Restore the state loaded by resume
+    ##########################################################################
+    def restoreCheckpoint(self,sm,sys,thSys):
+
+        state            = self.resumeState;
+        self.resumeState = None;
+
+        self.__dict__.update( state['sampler'] );
+        restoreEstimator( sm, state['estimator'] );
+
+        if ( state['surrogate'] != None ):
+            self.surrogate = unpackEstimator( state['surrogate'] );
+
+        np.random.set_state( state['random'] );
+        thSys.storeParameters( self.th[self.iter,:], sys );
+
+        print("resume: restored the sampler at iteration " + str(self.iter) + " of " + str(self.nIter) + ".");
+
+    ##########################################################################
+    # Update the running covariance and the adaptive Metropolis proposal
+    ##########################################################################
+    def updateCovariance(self):
+
+        if ( self.iter >= self.covStart ):
+            self.runningCov.push( self.th[self.iter,:] );
+
+        if ( ( self.adaptProposal ) and ( self.PMHtypeN != 2 ) and ( self.iter <= self.nBurnIn ) and ( np.remainder( self.iter, self.adaptInterval ) == 0 ) and ( self.runningCov.n > 2 * self.nPars ) ):
+            self.invHessian    = self.runningCov.cov() + self.adaptEpsilon * np.eye( self.nPars );
+            self.proposalFixed = gaussianProposal( self.invHessian );
+
+            # The drift at the current state using the new proposal
+            if ( self.PMHtypeN == 1 ):
+                self.ngradient[ self.iter,: ] = np.dot( self.invHessian, self.gradient[ self.iter,: ] );
+
+    ##########################################################################
+    # Check if the target ESS is reached and grow the arrays if needed
+    ##########################################################################
+    def checkTargetESS(self):
+
+        if ( self.iter > self.nBurnIn ):
+            self.essStats.push( self.th[self.iter,:] );
+
+            if ( np.remainder( self.iter, self.essCheckInterval ) == 0 ):
+                ess = self.essStats.ess();
+
+                if ( np.all( ess >= self.targetESS ) ):
+                    print("checkTargetESS: reached the target ESS after " + str(self.iter+1) + " iterations, ESS: " + str( ["%.1f" % v for v in ess] ) );
+                    return True;
+
+        if ( ( self.iter + 1 == self.nIter ) and ( self.nIter < self.maxIter ) ):
+            self.resizeArrays( int( np.min( ( self.maxIter, self.nIter + self.growSize ) ) ) );
+
+        return False;
+
+    ##########################################################################
+    # Resize the arrays with one row for each iteration to n rows
+    ##########################################################################
+    def resizeArrays(self,n):
+
+        for name in self.iterationArrays:
+            if ( name not in self.__dict__ ):
+                continue;
+
+            old = getattr( self, name );
+
+            if ( isinstance( old, list ) ):
+                new = old[0:n] + [None] * ( n - len( old ) );
+            else:
+                new = np.zeros( ( n, ) + old.shape[1:] );
+                new[0:np.min( ( n, old.shape[0] ) )] = old[0:n];
+
+            setattr( self, name, new );
+
+        self.nIter = n;
+
+    ##########################################################################
+    # Adapt the step size using dual averaging (Hoffman and Gelman, 2014)
+    ##########################################################################
+    def updateStepSize(self):
+
+        tt    = float( self.iter );
+        alpha = np.min( ( 1.0, self.aprob[self.iter,0] ) );
+
+        if ( np.isnan( alpha ) ):
+            alpha = 0.0;
+
+        # Update the running average of the difference to the target
+        eta             = 1.0 / ( tt + self.adaptT0 );
+        self.adaptHbar  = ( 1.0 - eta ) * self.adaptHbar + eta * ( self.targetAcceptance[self.PMHtype] - alpha );
+
+        # Compute the new step size and its weighted average
+        logStepSize           = self.adaptMu - np.sqrt( tt ) / self.adaptGamma * self.adaptHbar;
+        logStepSize           = np.clip( logStepSize, self.adaptMu - np.log( self.adaptRange ), self.adaptMu + np.log( self.adaptRange ) );
+        weight                = tt**( -self.adaptKappa );
+        self.adaptLogStepSize = weight * logStepSize + ( 1.0 - weight ) * self.adaptLogStepSize;
+
+        # Use the averaged step size after the burn-in
+        if ( self.iter < self.nBurnIn ):
+            self.stepSize = np.exp( logStepSize );
+        else:
+            self.stepSize = np.exp( self.adaptLogStepSize );
+            print("updateStepSize: fixed the step size to " + str( self.stepSize ) + " after the burn-in.");
 
     ##########################################################################
     # Sample the proposal
     ##########################################################################
     def sampleProposal(self,):
+        self.thp[self.iter,:] = self.drawProposal( self.iter, self.proposalIndex( self.iter ) );
+
+    ##########################################################################
+    # Helper: index of the state that the proposal at iteration ii is
+    # centred around (also the state that is kept if it is rejected)
+    ##########################################################################
+    def proposalIndex(self,ii):
+
+        if ( ( self.PMHtype == "qPMH2" ) & ( ii > self.memoryLength ) ):
+            return ii - 1 - self.memoryLength;
+        else:
+            return ii - 1;
+
+    ##########################################################################
+    # Helper: draw the proposal at iteration ii from the state at jj
+    ##########################################################################
+    def drawProposal(self,ii,jj):
 
         if ( self.PMHtype == "pPMH0" ):
             # Sample the preconditioned PMH0 proposal
-            self.thp[self.iter,:] = self.th[self.iter-1,:] + np.random.multivariate_normal(np.zeros(self.nPars), self.stepSize**2 * self.invHessian );
+            return self.proposalFixed.sample( self.th[jj,:], self.stepSize );
 
         if( self.PMHtype == "pPMH1" ):
             # Sample the preconditioned PMH1 proposal
-            self.thp[self.iter,:] = self.th[self.iter-1,:] + 0.5 * self.stepSize**2 * np.dot(self.invHessian,self.gradient[self.iter-1,:]) + np.random.multivariate_normal(np.zeros(self.nPars), self.stepSize**2 * self.invHessian );
+            return self.proposalFixed.sample( self.th[jj,:] + 0.5 * self.stepSize**2 * self.ngradient[jj,:], self.stepSize );
 
         if ( self.PMHtype == "qPMH2" ):
             # Using PMH0 in initial phase and then quasi-Newton proposal
-            if ( self.iter > self.memoryLength ):
-                self.thp[self.iter,:] = self.th[self.iter-1-self.memoryLength,:] + 0.5 * self.stepSize**2 * np.dot( self.gradient[self.iter-1-self.memoryLength,:], self.hessian[self.iter-1-self.memoryLength,:,:] ) + np.random.multivariate_normal(np.zeros(self.nPars), self.stepSize**2 * self.hessian[self.iter-1-self.memoryLength,:,:] );
+            if ( ii > self.memoryLength ):
+                return self.proposal[jj].sample( self.th[jj,:] + 0.5 * self.stepSize**2 * self.ngradient[jj,:], self.stepSize );
             else:
-                self.thp[self.iter,:] = self.th[self.iter-1,:] + np.random.multivariate_normal( np.zeros(self.nPars), self.stepSize**2 * self.hessian[self.iter-1,:,:] );
+                return self.proposal[jj].sample( self.th[jj,:], self.stepSize );
 
     ##########################################################################
     # Calculate Acceptance Probability
     ##########################################################################
     def calculateAcceptanceProbability(self, sm,  thSys, ):
 
+        # The original parameters of the proposal
+        self.thpo[ self.iter,: ] = thSys.returnParameters();
+
+        # Reject the proposal if it is outside the support of the prior,
+        # without running the filter/smoother
+        if ( thSys.priorUniform() == 0.0 ):
+            self.aprob[ self.iter ] = 0.0;
+            self.llp[ self.iter ]   = -np.inf;
+            self.nOutOfSupport     += 1;
+            return None;
+
+        # Compute the log-prior and the log-Jacobian of the transformation
+        self.priorp[ self.iter ]    = thSys.prior();
+        self.Jp[ self.iter ]        = thSys.Jacobian();
+
+        # Delayed acceptance: screen the proposal using the surrogate
+        logR1 = 0.0;
+
+        if ( self.surrogate != None ):
+            self.estimateSurrogateLikelihood(thSys);
+            logR1 = self.llSurrogatep[ self.iter, 0 ] - self.llSurrogate[ self.iter-1, 0 ] + self.priorp[ self.iter, 0 ] - self.prior[ self.iter-1, 0 ] + self.Jp[ self.iter, 0 ] - self.J[ self.iter-1, 0 ];
+
+            if ( np.random.random(1) > np.exp( logR1 ) ):
+                # Rejected in the first stage, do not run the filter/smoother
+                self.aprob[ self.iter ]    = 0.0;
+                self.screened[ self.iter ] = 1.0;
+                return None;
+
         # Run the smoother to get estimates of the log-likelihood and gradiets
         self.estimateLikelihoodGradients(sm,thSys);
 
@@ -148,24 +777,22 @@ class stPMH(object):
             proposal0 = 0;
 
         if ( self.PMHtype == "pPMH1" ):
-            proposalP = lognormpdf( self.thp[self.iter,:], self.th[self.iter-1,:]  + 0.5 * self.stepSize**2 * np.dot( self.invHessian,self.gradient[self.iter-1,:]),  self.stepSize**2 * self.invHessian  );
-            proposal0 = lognormpdf( self.th[self.iter-1,:],self.thp[self.iter,:]   + 0.5 * self.stepSize**2 * np.dot( self.invHessian,self.gradientp[self.iter,:]) ,  self.stepSize**2 * self.invHessian  );
+            proposalP = self.proposalFixed.logpdf( self.thp[self.iter,:], self.th[self.iter-1,:]  + 0.5 * self.stepSize**2 * self.ngradient[self.iter-1,:],  self.stepSize );
+            proposal0 = self.proposalFixed.logpdf( self.th[self.iter-1,:],self.thp[self.iter,:]   + 0.5 * self.stepSize**2 * self.ngradientp[self.iter,:] ,  self.stepSize );
 
         if ( self.PMHtype == "qPMH2" ):
 
             if ( self.iter > self.memoryLength ):
-                proposalP = lognormpdf( self.thp[self.iter,:],                     self.th[self.iter-1-self.memoryLength,:]  + 0.5 * self.stepSize**2 * np.dot( self.gradient[self.iter-1-self.memoryLength,:],  self.hessian[self.iter-1-self.memoryLength,:,:])  , self.stepSize**2 * self.hessian[self.iter-1-self.memoryLength,:,:]  );
-                proposal0 = lognormpdf( self.th[self.iter-1-self.memoryLength,:],  self.thp[self.iter,:]                     + 0.5 * self.stepSize**2 * np.dot( self.gradientp[self.iter,:],                     self.hessianp[self.iter,:,:]) ,                     self.stepSize**2 * self.hessianp[self.iter,:,:] );
+                proposalP = self.proposal[self.iter-1-self.memoryLength].logpdf( self.thp[self.iter,:],                     self.th[self.iter-1-self.memoryLength,:]  + 0.5 * self.stepSize**2 * self.ngradient[self.iter-1-self.memoryLength,:]  , self.stepSize );
+                proposal0 = self.proposalp[self.iter].logpdf(                    self.th[self.iter-1-self.memoryLength,:],  self.thp[self.iter,:]                     + 0.5 * self.stepSize**2 * self.ngradientp[self.iter,:] ,                     self.stepSize );
             else:
                 # Initial phase, use pPMH0
-                proposalP = lognormpdf( self.thp[self.iter,:],   self.th[self.iter-1,:]   , self.stepSize**2 * self.hessian[self.iter-1,:,:] );
-                proposal0 = lognormpdf( self.th[self.iter-1,:],  self.thp[self.iter,:]    , self.stepSize**2 * self.hessianp[self.iter,:,:]  );
-
-        # Compute the log-prior
-        self.priorp[ self.iter ]    = thSys.prior();
+                proposalP = self.proposal[self.iter-1].logpdf( self.thp[self.iter,:],   self.th[self.iter-1,:]   , self.stepSize );
+                proposal0 = self.proposalp[self.iter].logpdf(  self.th[self.iter-1,:],  self.thp[self.iter,:]    , self.stepSize );
 
-        # Compute the acceptance probability
-        self.aprob[ self.iter ] = self.flag * np.exp( self.llp[ self.iter, :] - self.ll[ self.iter-1, :] + proposal0 - proposalP + self.priorp[ self.iter, :] - self.prior[ self.iter-1, :] );
+        # Compute the acceptance probability (corrected for the first stage
+        # if delayed acceptance is used)
+        self.aprob[ self.iter ] = self.flag * np.exp( self.llp[ self.iter, :] - self.ll[ self.iter-1, :] + proposal0 - proposalP + self.priorp[ self.iter, :] - self.prior[ self.iter-1, :] + self.Jp[ self.iter, :] - self.J[ self.iter-1, :] - logR1 );
 
         # Store the proposal calculations
         self.proposalProb[ self.iter ]  = proposal0;
@@ -179,6 +806,7 @@ class stPMH(object):
 
         # Flag if the Hessian is PSD or not.
         self.flag  = 1.0
+        self.nEstimatorCalls += 1;
 
         # PMH0, only run the filter and extract the likelihood estimate
         if ( self.PMHtypeN == 0 ):
@@ -187,15 +815,17 @@ class stPMH(object):
         # PMH1, only run the smoother and extract the likelihood estimate and gradient
         if ( self.PMHtypeN == 1 ):
             sm.smoother(thSys);
-            self.gradientp[ self.iter,: ]   = sm.gradient;
+            self.gradientp[ self.iter,: ]   = transformGradient( thSys, sm.gradient );
+            self.ngradientp[ self.iter,: ]  = np.dot( self.invHessian, self.gradientp[ self.iter,: ] );
 
         # PMH2, only run the smoother and extract the likelihood estimate and gradient
         if ( self.PMHtypeN == 2 ):
             sm.smoother(thSys);
-            self.gradientp[ self.iter,: ]   = sm.gradient;
+            self.gradientp[ self.iter,: ]   = transformGradient( thSys, sm.gradient );
 
             # Note that this is the inverse Hessian
             self.hessianp [ self.iter,:,: ] = self.lbfgs_hessian_update( );
+            self.ngradientp[ self.iter,: ]  = self.lbfgs_natural_gradient( );
 
             # Extract the diagonal if needed and regularise if not PSD
             self.checkHessian();
@@ -205,38 +835,83 @@ class stPMH(object):
 
         return None;
 
+    ##########################################################################
+    # Run the surrogate filter (delayed acceptance)
+    ##########################################################################
+    def estimateSurrogateLikelihood(self,thSys,):
+
+        self.surrogate.filter(thSys);
+        self.llSurrogatep[ self.iter ] = self.surrogate.ll;
+
+        return None;
+
     ##########################################################################
     # Extract the diagonal if needed and regularise if not PSD
     ##########################################################################
     def checkHessian(self):
 
-        # Pre-calculate posterior covariance estimate
-        if ( ( self.iter >= self.nBurnIn ) & ( self.empHessian == None ) ) :
-            self.empHessian = np.cov( self.th[range( self.nBurnIn - self.PSDmethodhybridSamps, self.nBurnIn ),].transpose() );
+        # Factorise the Hessian, which also checks if it is PSD
+        self.proposalp[ self.iter ]       = gaussianProposal( self.hessianp [ self.iter,:,: ] );
+        self.hessianFallback[ self.iter ] = 0.0;
+
+        if ( not self.proposalp[ self.iter ].positiveDefinite ):
+
+            # Shift the eigenvalues during burnin so that the smallest is a
+            # fraction hessianShiftTolerance of the largest one
+            if ( ( self.iter <= self.nBurnIn ) and ( np.all( np.isfinite( self.hessianp [ self.iter,:,: ] ) ) ) ):
+                eigens   = np.linalg.eigvalsh(self.hessianp [ self.iter,:,: ]);
+                shift    = np.max( ( -np.min( eigens ), 0.0 ) ) + self.hessianShiftTolerance * np.max( np.abs( eigens ) );
+                shifted  = self.hessianp [ self.iter,:,: ] + shift * np.eye( self.nPars );
+                proposal = gaussianProposal( shifted );
+
+                if ( proposal.positiveDefinite ):
+                    self.hessianp [ self.iter,:,: ] = shifted;
+                    self.proposalp[ self.iter ]     = proposal;
+                    self.nHessianMirrored          += 1;
+                    self.hessianFallback[ self.iter ] = 1.0;
+
+            # Replace the Hessian with the posterior covariance matrix after
+            # burnin (or if the shift failed), or with eye / epsilon if
+            # there are too few states to estimate it
+            if ( not self.proposalp[ self.iter ].positiveDefinite ):
+                if ( self.runningCov.n > self.nPars ):
+                    self.updateEmpiricalHessian();
+
+                if ( ( self.empHessian is not None ) and ( self.empProposal.positiveDefinite ) ):
+                    self.hessianp [ self.iter,:,: ] = self.empHessian;
+                    self.proposalp[ self.iter ]     = self.empProposal;
+                else:
+                    self.hessianp [ self.iter,:,: ] = np.eye( self.nPars ) / self.epsilon;
+                    self.proposalp[ self.iter ]     = gaussianProposal( self.hessianp [ self.iter,:,: ] );
 
-        # Check if it is PSD
-        if ( ~isPSD( self.hessianp [ self.iter,:,: ] ) ):
+                self.nHessianReplaced          += 1;
+                self.hessianFallback[ self.iter ] = 2.0;
 
-            eigens = np.linalg.eig(self.hessianp [ self.iter,:,: ])[0];
+            # Recompute the natural gradient using the regularised Hessian
+            self.ngradientp[ self.iter,: ] = np.dot( self.gradientp[ self.iter,: ], self.hessianp[ self.iter,:,: ] );
 
-            # Add a diagonal matrix proportional to the largest negative eigv during burnin
-            if ( self.iter <= self.nBurnIn ):
-                mineigv = np.min( np.linalg.eig( self.hessianp [ self.iter,:,: ] )[0] )
-                self.hessianp [ self.iter,:,: ] = self.hessianp [ self.iter,:,: ] - 2.0 * mineigv * np.eye( self.nPars )
-                print("Iteration: " + str(self.iter) + " has eigenvalues: " + str( eigens ) + " mirroring by adding " +  str( - 2.0 * mineigv ) );
+    ##########################################################################
+    # Helper: current estimate of the posterior covariance (only refactorised
+    # if states have been added since the last time)
+    ##########################################################################
+    def updateEmpiricalHessian(self):
 
-            # Replace the Hessian with the posterior covariance matrix after burin
-            if ( self.iter > self.nBurnIn ):
-                self.hessianp [ self.iter,:,: ] = self.empHessian;
-                print("Iteration: " + str(self.iter) + " has eigenvalues: " + str( eigens ) + " replaced Hessian with pre-computed estimated." );
+        if ( ( self.empHessian is None ) or ( self.empHessianN != self.runningCov.n ) ):
+            self.empHessian  = self.runningCov.cov();
+            self.empProposal = gaussianProposal( self.empHessian );
+            self.empHessianN = self.runningCov.n;
 
     ##########################################################################
     # Quasi-Netwon proposal
     ##########################################################################
     def lbfgs_hessian_update(self):
 
-        I  = np.eye(self.nPars, dtype=int);
-        Hk = np.eye(self.nPars) / self.epsilon;
+        if ( self.initialHessian is None ):
+            Hk = np.eye(self.nPars) / self.epsilon;
+        else:
+            Hk = np.array( self.initialHessian, copy=True );
+
+        self.lbfgsActive = False;
 
         # BFGS update for Hessian estimate
         if ( self.iter > self.memoryLength ):
@@ -246,85 +921,134 @@ class stPMH(object):
             self.extractUniqueElements();
 
             if ( self.nHessianSamples[ self.iter ] > 2 ):
+                gamma = 1.0 / self.epsilon;
+
                 # Extract the last unique parameters and their gradients
-                idx = np.sort( np.unique(self.ll,return_index=True)[1] )[-2:];
+                idx = np.array( ( self.uniqueIdx[-1], self.iter ) );
 
                 if ( np.max( self.iter - idx ) < self.memoryLength ):
 
                     # The last accepted step is inside of the memory length
-                    skk = self.th[ idx[1] , : ]       - self.th[ idx[0], : ];
-                    ykk = self.gradient[ idx[1] , : ] - self.gradient[ idx[0], : ];
-                    foo = np.dot( skk, ykk) / np.dot( ykk, ykk);
-                    Hk  = np.eye(self.nPars) * foo;
+                    skk   = self.th[ idx[1] , : ]       - self.th[ idx[0], : ];
+                    ykk   = self.gradient[ idx[1] , : ] - self.gradient[ idx[0], : ];
+                    gamma = np.dot( skk, ykk) / np.dot( ykk, ykk);
 
-                # Add the contribution from the last memoryLength samples
-                for ii in range( (self.thU).shape[0] ):
+                # Add and evict the pairs from the last memoryLength samples,
+                # the pair between the first and last samples is applied first
+                self.lbfgs.update( self.idxU, self.th, self.gradient );
+                self.lbfgs.prepare( gamma, self.thU[0,:] - self.thU[-1,:], self.gradientU[0,:] - self.gradientU[-1,:] );
 
-                    # Calculate difference in gradient (ykk) and theta (skk)
-                    ykk = self.gradientU[ii,:] - self.gradientU[ii-1,:];
-                    skk = self.thU[ii,:]       - self.thU[ii-1,:];
+                if ( self.hessianUpdate == "bfgs" ):
+                    self.lbfgsActive = True;
 
-                    # Check if we have moved, otherwise to not add contribution to Hessian
-                    if ( np.sum( skk ) != 0.0 ):
+                    # Return the negative Hessian estimate
+                    Hk = -self.lbfgs.dense();
+                    self.nCurvatureFixes[ self.iter ] = np.sum( np.diag( self.lbfgs.StYk ) >= 0.0 );
 
-                        # Compute rho
-                        rhok = 1.0 / ( np.dot( ykk, skk) );
+                elif ( self.hessianUpdate == "dampedBFGS" ):
+                    Hk, self.nCurvatureFixes[ self.iter ] = self.lbfgs.denseDamped( np.abs( gamma ), self.dampingThreshold );
 
-                        # Update Hessian estimate
-                        A1   = I - skk[:, np.newaxis] * ykk[np.newaxis, :] * rhok
-                        A2   = I - ykk[:, np.newaxis] * skk[np.newaxis, :] * rhok
-                        Hk   = np.dot(A1, np.dot(Hk, A2)) + ( rhok * skk[:, np.newaxis] * skk[np.newaxis, :] )
+                elif ( self.hessianUpdate == "sr1" ):
+                    Hk, self.nCurvatureFixes[ self.iter ] = self.lbfgs.denseSR1( np.abs( gamma ), self.sr1Threshold );
 
-                # Return the negative Hessian estimate
-                Hk = -Hk;
+                else:
+                    raise NameError("lbfgs_hessian_update: unknown hessianUpdate " + str( self.hessianUpdate ) + ".");
 
         return Hk;
 
     ##########################################################################
     # Helper to Quasi-Netwon proposal:
-    # Extract the last n unique parameters and their gradients
+    # Compute the natural gradient (the drift in the proposal)
     ##########################################################################
+    def lbfgs_natural_gradient(self):
 
-    def extractUniqueElements(self):
-
-        # Find the unique elements
-        idx            = np.sort( np.unique(self.ll[0:(self.iter-1)],return_index=True)[1] );
+        if ( self.lbfgsActive ):
+            # Use the two-loop recursion with the compact representation
+            return -self.lbfgs.multiply( self.gradientp[ self.iter,: ] );
+        else:
+            return np.dot( self.gradientp[ self.iter,: ], self.hessianp[ self.iter,:,: ] );
 
-        # Extract the ones inside the memory length
-        idx            = [ii for ii in idx if ii >= (self.iter - self.memoryLength) ]
+    ##########################################################################
+    # Helper to Quasi-Netwon proposal:
+    # Extract the last n unique parameters and their gradients
+    ##########################################################################
 
-        # Sort the indicies according to the log-likelihood
-        idx2           = np.argsort( self.ll[idx], axis=0 )[:,0]
+    def extractUniqueElements(self):
 
-        # Get the new indicies
-        idx3 = np.zeros( len(idx), dtype=int )
-        for ii in idx2:
-            idx3[ii] = idx[ii]
+        # The unique elements inside the memory length (in the order that
+        # they were visited), excluding the last state of the chain
+        idx = [ii for ii in self.uniqueIdx if ii < (self.iter-1) ]
 
         # Extract and export the parameters and their gradients
-        self.thU       = self.th[idx3,:];
-        self.gradientU = self.gradient[idx3,:];
+        self.idxU      = idx;
+        self.thU       = self.th[idx,:];
+        self.gradientU = self.gradient[idx,:];
 
         # Save the number of indicies
         self.nHessianSamples[ self.iter ] = np.max((0,(self.thU).shape[0] - 1));
 
+    ##########################################################################
+    # Helper to Quasi-Netwon proposal:
+    # Update the index of unique elements with the current state
+    ##########################################################################
+
+    def updateUniqueElements(self):
+
+        # Add the state if its log-likelihood has not been visited before
+        llCurrent = float( self.ll[self.iter] );
+
+        if ( llCurrent not in self.uniqueLL ):
+            self.uniqueLL.add( llCurrent );
+            self.uniqueIdx.append( self.iter );
+
+        # Remove the states that fall outside the memory length in the next iteration
+        while ( ( len(self.uniqueIdx) > 0 ) and ( self.uniqueIdx[0] < (self.iter + 1 - self.memoryLength) ) ):
+            self.uniqueIdx.popleft();
+
     ##########################################################################
     # Compute the IACT
     ##########################################################################
 
-    def calcIACT( self, nSamples=None ):
-        IACT = np.zeros( self.nPars );
+    def calcIACT( self, nSamples=None, method="cutoff" ):
 
-        for ii in range( self.nPars ):
-            if ( nSamples == None ):
-                IACT[ii] = proto_IACT( self.th[self.nBurnIn:self.nIter,ii] )
-            else:
-                if ((  self.nIter-nSamples ) > 0 ):
-                    IACT[ii] = proto_IACT( self.th[(self.nIter-nSamples):self.nIter,ii] )
-                else:
-                    raise NameError("More samples to compute IACT than iterations of the PMH algorithm.")
+        if ( nSamples == None ):
+            return calcIACTs( self.th[self.nBurnIn:self.nIter,:], method );
 
-        return IACT
+        if ((  self.nIter-nSamples ) > 0 ):
+            return calcIACTs( self.th[(self.nIter-nSamples):self.nIter,:], method );
+        else:
+            raise NameError("More samples to compute IACT than iterations of the PMH algorithm.")
+
+    ##########################################################################
+    # Posterior mean and variance of the original parameters from the
+    # iterations after the burn-in (or the last nSamples). The method
+    # "recycled" also uses the rejected proposals (waste recycling, see
+    # recycledMoments), "standard" only uses the states of the chain.
+    ##########################################################################
+    def calcPosteriorMoments( self, nSamples=None, method="recycled" ):
+
+        if ( nSamples == None ):
+            start = np.max( ( self.nBurnIn, 1 ) );
+        elif ( ( self.nIter-nSamples ) > 0 ):
+            start = self.nIter - nSamples;
+        else:
+            raise NameError("More samples to compute the posterior moments than iterations of the PMH algorithm.")
+
+        if ( method == "standard" ):
+            return np.mean( self.tho[start:self.nIter,:], axis=0 ), np.var( self.tho[start:self.nIter,:], axis=0, ddof=1 );
+
+        if ( method != "recycled" ):
+            raise NameError("calcPosteriorMoments: unknown method " + str( method ) + ".");
+
+        # The acceptance probability of the proposals screened by the
+        # surrogate is not known
+        if ( self.surrogate != None ):
+            raise NameError("calcPosteriorMoments: waste recycling cannot be used together with delayed acceptance.");
+
+        # The states that the proposals were made from
+        idx = [ self.proposalIndex( ii ) for ii in range( start, self.nIter ) ];
+
+        return recycledMoments( self.tho[idx,:], self.thpo[start:self.nIter,:], self.aprob[start:self.nIter,:] );
 
     ##########################################################################
     # Helper if parameters are accepted
@@ -335,9 +1059,15 @@ class stPMH(object):
         self.ll[self.iter]          = self.llp[self.iter];
         self.gradient[self.iter,:]  = self.gradientp[self.iter,:];
         self.hessian[self.iter,:,:] = self.hessianp[self.iter,:];
+        self.ngradient[self.iter,:] = self.ngradientp[self.iter,:];
+        self.proposal[self.iter]    = self.proposalp[self.iter];
         self.accept[self.iter]      = 1.0;
         self.prior[self.iter,:]     = self.priorp[self.iter,:];
         self.J[self.iter,:]         = self.Jp[self.iter,:];
+        self.llSurrogate[self.iter] = self.llSurrogatep[self.iter];
+
+        if ( self.PMHtypeN == 2 ):
+            self.updateUniqueElements();
 
     ##########################################################################
     # Helper if parameters are rejected
@@ -350,7 +1080,10 @@ class stPMH(object):
             self.prior[self.iter,:]     = self.prior[self.iter-1-self.memoryLength,:]
             self.gradient[self.iter,:]  = self.gradient[self.iter-1-self.memoryLength,:];
             self.hessian[self.iter,:,:] = self.hessian[self.iter-1-self.memoryLength,:,:];
+            self.ngradient[self.iter,:] = self.ngradient[self.iter-1-self.memoryLength,:];
+            self.proposal[self.iter]    = self.proposal[self.iter-1-self.memoryLength];
             self.J[self.iter,:]         = self.J[self.iter-1-self.memoryLength,:];
+            self.llSurrogate[self.iter] = self.llSurrogate[self.iter-1-self.memoryLength];
         else:
             self.th[self.iter,:]        = self.th[self.iter-1,:];
             self.tho[self.iter,:]       = self.tho[self.iter-1,:];
@@ -358,10 +1091,27 @@ class stPMH(object):
             self.prior[self.iter,:]     = self.prior[self.iter-1,:]
             self.gradient[self.iter,:]  = self.gradient[self.iter-1,:];
             self.hessian[self.iter,:,:] = self.hessian[self.iter-1,:,:];
+            self.ngradient[self.iter,:] = self.ngradient[self.iter-1,:];
+            self.proposal[self.iter]    = self.proposal[self.iter-1];
             self.J[self.iter,:]         = self.J[self.iter-1,:];
+            self.llSurrogate[self.iter] = self.llSurrogate[self.iter-1];
+
+        if ( self.PMHtypeN == 2 ):
+            self.updateUniqueElements();
 
     ##########################################################################
-    # Helper: compile the results and write to file
+    # Helper: submit the iterations since the last chunk to the writer
+    ##########################################################################
+    def writeOutputChunk(self):
+
+        if ( self.iter + 1 > self.outputRow ):
+            self.outputWriter.write( self.outputRow, self.outputColumns( self.outputRow, self.iter + 1 ) );
+            self.outputRow = self.iter + 1;
+
+    ##########################################################################
+    # Helper: compile the results and write to file, the results are written
+    # to a binary file (see pmh_output) if the file name ends with .chain and
+    # as CSV otherwise
     ##########################################################################
     def writeToFile(self,sm=None,fileOutName=None):
 
@@ -369,12 +1119,25 @@ class stPMH(object):
         if ( ( self.fileOutName != None ) & (fileOutName == None) ):
             fileOutName = self.fileOutName;
 
-        # Calculate the natural gradient
-        ngrad = np.zeros((self.nIter,self.nPars));
+        # Compile the results for output
+        columnlabels = self.outputLabels();
+        out          = self.outputColumns( 0, self.nIter );
 
-        if ( self.PMHtype == "pPMH1" ):
-            for kk in range(0,self.nIter):
-                ngrad[kk,:] = np.dot( self.gradient[kk,:], self.invHessian );
+        # Write out the results to file
+        ensure_dir(fileOutName);
+
+        if ( fileOutName.endswith(".chain") ):
+            writeChain(fileOutName,columnlabels,out);
+        else:
+            fileOut = pandas.DataFrame(out,columns=columnlabels);
+            fileOut.to_csv(fileOutName);
+
+        print("writeToFile: wrote results to file: " + fileOutName)
+
+    ##########################################################################
+    # Helper: labels of the columns in the output
+    ##########################################################################
+    def outputLabels(self):
 
         # Construct the columns labels
         columnlabels = [None]*(3*self.nPars+3);
@@ -389,16 +1152,20 @@ class stPMH(object):
         columnlabels[3*self.nPars+1] = "loglikelihood";
         columnlabels[3*self.nPars+2] = "acceptflag";
 
-        # Compile the results for output
-        out = np.hstack((self.th,self.thp,ngrad,self.aprob,self.ll,self.accept));
+        return columnlabels;
 
-        # Write out the results to file
-        fileOut = pandas.DataFrame(out,columns=columnlabels);
+    ##########################################################################
+    # Helper: the output for the iterations start to stop-1
+    ##########################################################################
+    def outputColumns(self,start,stop):
 
-        ensure_dir(fileOutName);
-        fileOut.to_csv(fileOutName);
+        # Calculate the natural gradient
+        ngrad = np.zeros((stop-start,self.nPars));
 
-        print("writeToFile: wrote results to file: " + fileOutName)
+        if ( self.PMHtype == "pPMH1" ):
+            ngrad = np.dot( self.gradient[start:stop,:], self.invHessian );
+
+        return np.hstack((self.th[start:stop,:],self.thp[start:stop,:],ngrad,self.aprob[start:stop,:],self.ll[start:stop,:],self.accept[start:stop,:]));
 
 ##############################################################################
 ##############################################################################
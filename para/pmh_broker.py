@@ -0,0 +1,337 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy                      as     np
+import multiprocessing
+import threading
+import time
+from   multiprocessing.connection import Listener, Client
+from   pmh_parallel               import packEstimator, initialiseWorker, workerState
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+##############################################################################
+# Broker for the log-likelihood (and gradient) estimates of many samplers on
+# the same host. The requests from the samplers are collected for at most
+# maxWait seconds (or until maxBatch requests are pending) and evaluated
+# together: in one call of the batched filter/smoother of sm (filterBatch
+# and smootherBatch, e.g. kfBatch and rtsBatch of kalmanMethods) or using
+# the filter/smoother for each request otherwise. With nProcesses > 1, the
+# batch is split over a pool of processes that keep warm copies of the
+# filter/smoother, the model and the data (sent once when the pool starts).
+#
+# The broker is used in-process by calling evaluate (or submit), or from
+# other processes by calling serve and connecting with brokerClient. The
+# requests are the original parameters (thSys.par), so the estimates are
+# the same as from sm.filter/sm.smoother (with the log-prior gradient).
+#
+# Without a batched filter/smoother and with nProcesses = 1, the requests
+# are evaluated in the broker thread using the global random number
+# generator of numpy (seeded for each request and then restored). This is
+# only safe for a single sampler in the same process, as other sampler
+# threads drawing random numbers at the same time would see their draws
+# rolled back. Use nProcesses > 1 (the workers have their own generators),
+# a batched filter/smoother or samplers in other processes (brokerClient)
+# when several samplers share the broker.
+##############################################################################
+
+class likelihoodBroker(object):
+
+    def __init__(self, sm, sys, thSys, nProcesses=1, maxBatch=64, maxWait=0.005, seed=None):
+        self.sm         = sm;
+        self.sys        = sys;
+        self.thSys      = thSys;
+        self.nProcesses = nProcesses;
+        self.maxBatch   = maxBatch;
+        self.maxWait    = maxWait;
+        self.rng        = np.random.RandomState( seed );
+        self.nPar       = np.size( thSys.par );
+
+        self.nRequests  = 0;
+        self.nBatches   = 0;
+        self.pool       = None;
+        self.listener   = None;
+        self.pending    = queue.Queue();
+
+        if ( self.nProcesses is None ):
+            self.nProcesses = multiprocessing.cpu_count();
+
+        if ( self.nProcesses > 1 ):
+            self.pool = multiprocessing.Pool( processes=self.nProcesses, initializer=initialiseWorker, initargs=( packEstimator(sm), sys, thSys ) );
+
+        # The requests are batched and evaluated by a background thread
+        self.thread        = threading.Thread( target=self.run );
+        self.thread.daemon = True;
+        self.thread.start();
+
+    ##########################################################################
+    # Submit a request and return an object to wait for the result with
+    ##########################################################################
+    def submit(self, par, smooth, seed=None):
+        if ( seed is None ):
+            seed = self.rng.randint( 0, 2**31 - 1 );
+
+        par = np.array( par, dtype=float, copy=True ).ravel();
+
+        if ( len( par ) != self.nPar ):
+            raise NameError("likelihoodBroker: the request has " + str(len( par )) + " parameters, the model has " + str(self.nPar) + ".");
+
+        request = brokerRequest( par, smooth, seed );
+        self.pending.put( request );
+        return request;
+
+    # Returns ( ll, gradient ) with gradient None if smooth is False
+    def evaluate(self, par, smooth, seed=None):
+        return self.submit( par, smooth, seed ).get();
+
+    ##########################################################################
+    # Stop the broker (the requests that are pending are completed first)
+    ##########################################################################
+    def close(self):
+        if ( self.listener != None ):
+            self.listener.close();
+            self.listener = None;
+
+        self.pending.put( None );
+        self.thread.join();
+
+        if ( self.pool != None ):
+            self.pool.close();
+            self.pool.join();
+            self.pool = None;
+
+    ##########################################################################
+    # Background thread: collect and evaluate batches of requests
+    ##########################################################################
+    def run(self):
+        stop = False;
+
+        while ( not stop ):
+            request = self.pending.get();
+
+            if ( request is None ):
+                break;
+
+            batch    = [ request ];
+            deadline = time.time() + self.maxWait;
+
+            while ( len( batch ) < self.maxBatch ):
+                try:
+                    request = self.pending.get( timeout=np.max( ( deadline - time.time(), 0.0 ) ) );
+                except queue.Empty:
+                    break;
+
+                if ( request is None ):
+                    stop = True;
+                    break;
+
+                batch.append( request );
+
+            # The filter and smoother requests are evaluated separately
+            for smooth in ( False, True ):
+                requests = [ request for request in batch if ( request.smooth == smooth ) ];
+
+                if ( len( requests ) > 0 ):
+                    self.evaluateRequests( requests, smooth );
+
+    def evaluateRequests(self, requests, smooth):
+        pars  = np.array( [ request.par  for request in requests ] );
+        seeds = [ request.seed for request in requests ];
+
+        try:
+            if ( self.pool != None ):
+                # Split the batch over the processes
+                chunks  = [ ( pars[ii::self.nProcesses,:], seeds[ii::self.nProcesses], smooth ) for ii in range( np.min( ( self.nProcesses, len( requests ) ) ) ) ];
+                results = self.pool.map( evaluateBatchWorker, chunks );
+
+                out = [None] * len( requests );
+                for ii in range( len( chunks ) ):
+                    out[ii::self.nProcesses] = results[ii];
+            else:
+                out = evaluateBatch( self.sm, self.thSys, pars, seeds, smooth );
+
+            for request, result in zip( requests, out ):
+                request.complete( result, None );
+
+        except Exception as e:
+            for request in requests:
+                request.complete( None, e );
+
+        self.nRequests += len( requests );
+        self.nBatches  += 1;
+
+    ##########################################################################
+    # Serve the broker over a local socket (address is e.g. ('localhost',
+    # port) or the name of a Unix socket), each client gets its own thread
+    ##########################################################################
+    def serve(self, address=('localhost',0), authkey=b'pmh-broker'):
+        self.listener = Listener( address, authkey=authkey );
+        self.address  = self.listener.address;
+
+        thread        = threading.Thread( target=self.accept );
+        thread.daemon = True;
+        thread.start();
+
+        return self.address;
+
+    def accept(self):
+        while ( self.listener != None ):
+            try:
+                conn = self.listener.accept();
+            except Exception:
+                break;
+
+            thread        = threading.Thread( target=self.handle, args=( conn, ) );
+            thread.daemon = True;
+            thread.start();
+
+    def handle(self, conn):
+        try:
+            while True:
+                request = conn.recv();
+
+                # Any error is sent to the client
+                try:
+                    par, smooth, seed = request;
+                    conn.send( ( True, self.evaluate( par, smooth, seed ) ) );
+                except Exception as e:
+                    conn.send( ( False, str( e ) ) );
+        except ( EOFError, IOError ):
+            pass;
+        finally:
+            conn.close();
+
+##############################################################################
+# A pending request
+##############################################################################
+class brokerRequest(object):
+
+    def __init__(self, par, smooth, seed):
+        self.par    = par;
+        self.smooth = smooth;
+        self.seed   = seed;
+        self.done   = threading.Event();
+
+    def complete(self, result, error):
+        self.result = result;
+        self.error  = error;
+        self.done.set();
+
+    def get(self):
+        self.done.wait();
+
+        if ( self.error != None ):
+            raise NameError("likelihoodBroker: the evaluation failed: " + str( self.error ));
+
+        return self.result;
+
+##############################################################################
+# Client for a broker served over a local socket
+##############################################################################
+class brokerClient(object):
+
+    def __init__(self, address, authkey=b'pmh-broker'):
+        self.conn = Client( address, authkey=authkey );
+
+    def evaluate(self, par, smooth, seed=None):
+        self.conn.send( ( np.array( par, dtype=float ), smooth, seed ) );
+        ok, result = self.conn.recv();
+
+        if ( not ok ):
+            raise NameError( result );
+
+        return result;
+
+    def close(self):
+        self.conn.close();
+
+##############################################################################
+# Estimator passed to stPMH that forwards the calls to a broker (or a
+# brokerClient). The seeds are drawn from the random number generator of
+# the sampler, so the estimates do not depend on the batching.
+##############################################################################
+class brokerEstimator(object):
+
+    def __init__(self, broker):
+        self.broker = broker;
+
+    def filter(self, thSys):
+        seed             = np.random.randint( 0, 2**31 - 1 );
+        self.ll, gradient = self.broker.evaluate( thSys.par, False, seed );
+
+    def smoother(self, thSys):
+        seed                  = np.random.randint( 0, 2**31 - 1 );
+        self.ll, self.gradient = self.broker.evaluate( thSys.par, True, seed );
+
+##############################################################################
+# Evaluate the log-likelihood (and gradient) for the original parameters
+# pars (nBatch,nPar) using the batched filter/smoother if available
+##############################################################################
+def evaluateBatch(sm, thSys, pars, seeds, smooth):
+    out = [];
+
+    if ( smooth ):
+        batch = getattr( sm, 'smootherBatch', None );
+    else:
+        batch = getattr( sm, 'filterBatch', None );
+
+    if ( batch != None ):
+        batch( thSys, pars );
+
+    for kk in range( pars.shape[0] ):
+        thSys.par = np.array( pars[kk,:], copy=True );
+
+        if ( batch != None ):
+            if ( smooth ):
+                # Add the gradient of the log-prior (as in the smoothers)
+                gradient = sm.gradientBatch[kk,:] + np.array( [ thSys.dprior1(nn) for nn in range( thSys.nParInference ) ] );
+                out.append( ( sm.llBatch[kk], gradient ) );
+            else:
+                out.append( ( sm.llBatch[kk], None ) );
+        else:
+            # Keep the random number generator of the caller (in-process,
+            # only safe if no other thread draws from it at the same time)
+            state = np.random.get_state();
+            np.random.seed( seeds[kk] );
+
+            if ( smooth ):
+                sm.smoother( thSys );
+                out.append( ( sm.ll, np.array( sm.gradient, copy=True ) ) );
+            else:
+                sm.filter( thSys );
+                out.append( ( sm.ll, None ) );
+
+            np.random.set_state( state );
+
+    return out;
+
+def evaluateBatchWorker(task):
+    pars, seeds, smooth = task;
+    return evaluateBatch( workerState['sm'], workerState['thSys'], pars, seeds, smooth );
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
@@ -0,0 +1,251 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy as np
+from   pmh_helpers import transformGradient
+
+##############################################################################
+# Quadratic emulator of the log-likelihood for screening the proposals in
+# stPMH (set as the attribute surrogate, i.e. delayed acceptance).
+#
+# The emulator is fitted by least squares to the log-likelihood estimates
+# (and the gradient estimates from the smoother for pPMH1 and qPMH2) that
+# the sampler computes with the filter/smoother, where the derivatives of the
+# log-prior and the log-Jacobian are removed from the gradients. It is refitted every
+# refreshInterval iterations during the burn-in and then kept fixed, so the
+# chain after the burn-in targets the exact posterior.
+#
+# The emulator is only used inside the region covered by the data (the
+# largest Mahalanobis distance from the mean of the data times regionScale)
+# and if the RMS error of the fitted log-likelihood is below maxError.
+# Elsewhere the largest log-likelihood in the data is returned, so those
+# proposals are only rejected by the filter/smoother.
+##############################################################################
+
+class quadraticEmulator(object):
+
+    refreshInterval = 100;
+    maxPoints       = 1000;
+    gradientWeight  = 1.0;
+    maxError        = 3.0;
+    regionScale     = 1.0;
+
+    def __init__(self):
+        self.th        = [];
+        self.ll        = 0.0;
+        self.llData    = [];
+        self.gradient  = None;
+        self.gradData  = [];
+        self.nextIndex = 0;
+        self.fitted    = False;
+        self.nFits     = 0;
+
+    ##########################################################################
+    # Estimate the log-likelihood (and its gradient) at the parameters
+    ##########################################################################
+    def filter(self, thSys):
+        self.ll, self.gradient = self.predict( samplerParameters( thSys ) );
+
+    def smoother(self, thSys):
+        self.ll, self.gradient = self.predict( samplerParameters( thSys ) );
+
+    ##########################################################################
+    # Add the estimates from the filter/smoother to the data and refit
+    # (called by stPMH after each iteration)
+    ##########################################################################
+    def update(self, pmh, thSys):
+
+        if ( pmh.iter > pmh.nBurnIn ):
+            return None;
+
+        useGradient = ( pmh.PMHtypeN != 0 );
+
+        for ii in range( self.nextIndex, pmh.iter + 1 ):
+
+            # The initial state or proposals evaluated by the filter/smoother
+            if ( ii == 0 ):
+                self.addPoint( pmh.th[0,:], pmh.ll[0,0], likelihoodGradient( thSys, pmh.th[0,:], pmh.gradient[0,:], useGradient ), useGradient );
+            elif ( pmh.screened[ii,0] == 0.0 ):
+                self.addPoint( pmh.thp[ii,:], pmh.llp[ii,0], likelihoodGradient( thSys, pmh.thp[ii,:], pmh.gradientp[ii,:], useGradient ), useGradient );
+
+        self.nextIndex = pmh.iter + 1;
+
+        if ( ( np.remainder( pmh.iter, self.refreshInterval ) == 0 ) or ( pmh.iter == pmh.nBurnIn ) ):
+            self.fit();
+
+            # The state of the chain is evaluated using the new fit
+            pmh.llSurrogate[ pmh.iter ] = self.predict( pmh.th[pmh.iter,:] )[0];
+
+    def addPoint(self, th, ll, gradient, useGradient):
+
+        if ( not np.isfinite( ll ) ):
+            return None;
+
+        self.th.append( np.array( th, dtype=float ) );
+        self.llData.append( float( ll ) );
+
+        if ( useGradient ):
+            self.gradData.append( np.array( gradient, dtype=float ) );
+
+        # Keep the last maxPoints points
+        if ( len( self.th ) > self.maxPoints ):
+            self.th.pop(0);
+            self.llData.pop(0);
+            if ( len( self.gradData ) > 0 ):
+                self.gradData.pop(0);
+
+    ##########################################################################
+    # Least squares fit of ll(th) = c + b'z + 0.5 z'Az with z = (th-mean)/scale
+    ##########################################################################
+    def fit(self):
+
+        th = np.array( self.th );
+        n  = th.shape[0];
+
+        if ( n < 2 ):
+            return None;
+
+        d            = th.shape[1];
+        self.mean    = np.mean( th, axis=0 );
+        self.scale   = np.std( th, axis=0 );
+        self.scale[ self.scale == 0.0 ] = 1.0;
+        z            = ( th - self.mean ) / self.scale;
+        iu           = np.triu_indices( d );
+        nCoef        = 1 + d + len( iu[0] );
+        useGradient  = ( len( self.gradData ) == n );
+
+        # Observations of the log-likelihood
+        rows   = [ self.designValue( z ) ];
+        target = [ np.array( self.llData ) ];
+
+        # Observations of the gradient (b + Az)
+        if ( useGradient ):
+            grad = np.array( self.gradData ) * self.scale;
+            for jj in range( d ):
+                rows.append( self.gradientWeight * self.designGradient( z, jj ) );
+                target.append( self.gradientWeight * grad[:,jj] );
+
+        X = np.vstack( rows );
+        y = np.hstack( target );
+
+        if ( X.shape[0] < nCoef ):
+            return None;
+
+        self.coef = np.linalg.lstsq( X, y, rcond=-1 )[0];
+        self.nFits += 1;
+
+        # Error of the fitted log-likelihood and the region covered by the data
+        residual    = np.dot( rows[0], self.coef ) - target[0];
+        self.error  = np.sqrt( np.mean( residual**2 ) );
+        self.llMax  = np.max( target[0] );
+
+        cov         = np.atleast_2d( np.cov( z.transpose() ) );
+        self.covInv = np.linalg.pinv( cov );
+        self.region = self.regionScale * np.max( np.sum( np.dot( z, self.covInv ) * z, axis=1 ) );
+        self.fitted = True;
+
+    ##########################################################################
+    # Prediction of the log-likelihood and gradient at th
+    ##########################################################################
+    def predict(self, th):
+
+        if ( not self.fitted ):
+            return 0.0, None;
+
+        z = ( np.array( th, dtype=float ).reshape(1,-1) - self.mean ) / self.scale;
+
+        if ( ( self.error > self.maxError ) or ( np.sum( np.dot( z, self.covInv ) * z ) > self.region ) ):
+            return self.llMax, None;
+
+        d        = z.shape[1];
+        gradient = np.array( [ np.dot( self.designGradient( z, jj ), self.coef )[0] for jj in range( d ) ] ) / self.scale;
+
+        return float( np.dot( self.designValue( z ), self.coef )[0] ), gradient;
+
+    ##########################################################################
+    # Helpers: rows of the design matrix for the coefficients (c, b, A)
+    ##########################################################################
+    def designValue(self, z):
+        n, d = z.shape;
+        iu   = np.triu_indices( d );
+
+        # 0.5 z'Az with the off-diagonal elements counted twice
+        quad = z[:,iu[0]] * z[:,iu[1]] * np.where( iu[0] == iu[1], 0.5, 1.0 );
+        return np.hstack( ( np.ones((n,1)), z, quad ) );
+
+    def designGradient(self, z, jj):
+        n, d = z.shape;
+        iu   = np.triu_indices( d );
+
+        # Derivative with respect to z_jj: b_jj + sum_k A_jk z_k
+        quad = np.zeros( ( n, len( iu[0] ) ) );
+        for kk in range( len( iu[0] ) ):
+            if ( iu[0][kk] == jj ):
+                quad[:,kk] = z[:,iu[1][kk]];
+            elif ( iu[1][kk] == jj ):
+                quad[:,kk] = z[:,iu[0][kk]];
+
+        lin        = np.zeros( ( n, d ) );
+        lin[:,jj]  = 1.0;
+        return np.hstack( ( np.zeros((n,1)), lin, quad ) );
+
+##############################################################################
+# The parameters used by the sampler (the emulator is fitted to these), i.e.
+# the transformed parameters if the model uses a transformation
+##############################################################################
+def samplerParameters(thSys):
+    par = np.array( thSys.par, copy=True );
+
+    thSys.invTransform();
+    out       = thSys.returnParameters();
+    thSys.par = par;
+
+    return out;
+
+##############################################################################
+# The gradient of the log-likelihood with respect to the sampler parameters
+# th from the gradient of the log-posterior computed by stPMH (which includes
+# the derivatives of the log-prior and of the log-Jacobian). transformGradient
+# is affine in the gradient, so these are given by the transformed gradient
+# of the log-prior.
+##############################################################################
+def likelihoodGradient(thSys, th, gradient, useGradient):
+
+    if ( not useGradient ):
+        return gradient;
+
+    par = np.array( thSys.par, copy=True );
+
+    thSys.par[0:thSys.nParInference] = th;
+    thSys.transform();
+
+    prior = np.array( [ thSys.dprior1( nn ) for nn in range( thSys.nParInference ) ] );
+    out   = np.array( gradient, dtype=float ) - transformGradient( thSys, prior );
+
+    thSys.par = par;
+
+    return out;
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
@@ -19,11 +19,12 @@
 ##############################################################################
 ##############################################################################
 
-import numpy as np
+import numpy        as np
 import os
+from   scipy.linalg import solve_triangular
 
 ##############################################################################
-# Print small progress reports
+# Print small progress reports (using the running statistics of the chain)
 ##############################################################################
 def progressPrint(pmh):
     print("################################################################################################ ");
@@ -36,17 +37,35 @@ def progressPrint(pmh):
     print(["%.4f" % v for v in pmh.thp[pmh.iter,:]])
     print("");
     print(" Current posterior mean estimate (untransformed): ")
-    print(["%.4f" % v for v in np.mean(pmh.tho[range(pmh.iter),:], axis=0)])
+    print(["%.4f" % v for v in pmh.runningStats.mean])
     print("");
     print(" Current acceptance rate:                         ")
-    print("%.4f" % np.mean(pmh.accept[range(pmh.iter)]) )
+    print("%.4f" % ( pmh.nAccepted / pmh.runningStats.n ) )
     if ( ( pmh.PMHtype == "qPMH2" ) & ( pmh.iter > pmh.memoryLength ) ):
         print("");
         print(" Mean no. samples for Hessian estimate:           ")
-        print("%.4f" % np.mean(pmh.nHessianSamples[range(pmh.memoryLength,pmh.iter)]) )
-#    print("");
-#    print(" Current IACT: ")
-#    print(["%.2f" % v for v in IACT(pmh.th[0:pmh.iter,:]) ])
+        print("%.4f" % ( pmh.nHessianSamplesSum / ( pmh.iter - pmh.memoryLength ) ) )
+        print("");
+        print(" No. Hessian estimates mirrored / replaced:       ")
+        print(str(pmh.nHessianMirrored) + " / " + str(pmh.nHessianReplaced))
+        print("");
+        print(" Mean no. curvature fixes (" + pmh.hessianUpdate + "):              ")
+        print("%.4f" % ( pmh.nCurvatureFixesSum / ( pmh.iter - pmh.memoryLength ) ) )
+    if ( pmh.adaptStepSize ):
+        print("");
+        print(" Current step size:                               ")
+        print("%.4f" % pmh.stepSize )
+    if ( pmh.nOutOfSupport > 0 ):
+        print("");
+        print(" Fraction of proposals outside the support:       ")
+        print("%.4f" % ( pmh.nOutOfSupport / pmh.runningStats.n ) )
+    if ( pmh.surrogate != None ):
+        print("");
+        print(" Fraction of proposals rejected by the surrogate: ")
+        print("%.4f" % ( pmh.nScreened / pmh.runningStats.n ) )
+    print("");
+    print(" Current ESS estimate (batch means):              ")
+    print(["%.1f" % v for v in pmh.runningStats.ess()])
     print("################################################################################################ ");
 
 ##############################################################################
@@ -54,40 +73,147 @@ def progressPrint(pmh):
 ##############################################################################
 def ensure_dir(f):
     d = os.path.dirname(f)
-    if not os.path.exists(d):
+    if d and not os.path.exists(d):
         os.makedirs(d)
 
 ##############################################################################
-# Calculate the Integrated Autocorrlation Time
+# Calculate the Integrated Autocorrlation Time (single chain and parameter)
 ##############################################################################
 def proto_IACT( x ):
+    return calcIACTs( x, method="cutoff" )[0];
+
+##############################################################################
+# Calculate the IACT for all parameters (and chains) at once. The samples x
+# are given as (nSamples,), (nSamples,nPars) or (nChains,nSamples,nPars).
+# The autocorrelations are computed by FFT and the methods are:
+#
+#   cutoff:     sum the autocorrelations (rounded to three decimals) up to
+#               the first lag where they are smaller than 2 / sqrt(n) or
+#               n / 10 lags (the rule used by proto_IACT previously)
+#   geyer:      initial monotone sequence estimator (Geyer, 1992)
+#   batchmeans: batch means with sqrt(n) batches
+#
+# Several chains are combined using the within and between chain variances
+# for geyer and by averaging the autocorrelations of the chains for cutoff.
+##############################################################################
+def calcIACTs( x, method="geyer" ):
+
+    x       = prepareChains( x );
+    m, n, p = x.shape;
+
+    if ( method == "batchmeans" ):
+        return iactBatchMeans( x );
+
+    # Autocovariance of all chains and parameters at once
+    acov = autocovariance( x.transpose((0,2,1)).reshape((m*p,n)) ).reshape((m,p,n));
 
-    # estimate the acf coefficient
-    # code from http://stackoverflow.com/questions/14297012/estimate-autocorrelation-using-python
-    n = len(x)
-    nmax = int(np.floor(n/10.0));
-    data = np.asarray(x)
-    mean = np.mean(data)
-    c0 = np.sum((data - mean) ** 2) / float(n)
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        if ( method == "cutoff" ):
+            rho = np.mean( acov / acov[:,:,0:1], axis=0 );
+            out = iactCutoff( rho, n );
 
-    def r(h):
-        acf_lag = ((data[:n - h] - mean) * (data[h:] - mean)).sum() / float(n) / c0
-        return round(acf_lag, 3)
-    x = np.arange(n) # Avoiding lag 0 calculation
-    acf_coeffs = map(r, x)
+        elif ( method == "geyer" ):
+            meanVar = np.mean( acov[:,:,0], axis=0 ) * n / ( n - 1.0 );
+            varPlus = meanVar * ( n - 1.0 ) / n;
+            if ( m > 1 ):
+                varPlus += np.var( np.mean( x, axis=1 ), axis=0, ddof=1 );
 
-    try:
-        cutoff = np.where( np.abs( acf_coeffs[0:int(nmax)] ) < 2.0 / np.sqrt(n) )[0][0];
-    except:
-        cutoff = n;
+            rho      = 1.0 - ( meanVar[:,np.newaxis] - np.mean( acov, axis=0 ) ) / varPlus[:,np.newaxis];
+            rho[:,0] = 1.0;
+            out      = np.maximum( iactGeyer( rho ), 1.0 / np.log10( m * n ) );
 
-    # estimate the maximum number of acf coefficients to use to calculate IACT
-    tmp  = int( min(cutoff,nmax) );
+        else:
+            raise NameError("calcIACTs: unknown method " + str(method) + ", use cutoff, geyer or batchmeans.");
 
-    # estimate the IACT
-    iact = 1.0 + 2.0 * np.sum( acf_coeffs[0:tmp] );
+    # Constant parameters are treated as independent samples
+    out[ ~np.isfinite( out ) ] = 1.0;
+    return out;
 
-    return iact;
+##############################################################################
+# Calculate the ESS for all parameters (and chains) at once
+##############################################################################
+def calcESSs( x, method="geyer" ):
+    x = prepareChains( x );
+    return x.shape[0] * x.shape[1] / calcIACTs( x, method );
+
+##############################################################################
+# Helpers for the IACT
+##############################################################################
+def prepareChains( x ):
+    x = np.asarray( x, dtype=float );
+
+    if ( x.ndim == 1 ):
+        return x[np.newaxis,:,np.newaxis];
+    if ( x.ndim == 2 ):
+        return x[np.newaxis,:,:];
+    return x;
+
+def autocovariance( x ):
+    # Autocovariance of each row of x computed by FFT
+    n    = x.shape[1];
+    nfft = int( 2**np.ceil( np.log2( 2 * n ) ) );
+    xc   = x - np.mean( x, axis=1 )[:,np.newaxis];
+    f    = np.fft.rfft( xc, n=nfft, axis=1 );
+    return np.fft.irfft( f * np.conjugate( f ), n=nfft, axis=1 )[:,0:n] / n;
+
+def iactCutoff( rho, n ):
+    rho  = np.round( rho, 3 );
+    nmax = int( np.floor( n / 10.0 ) );
+    p    = rho.shape[0];
+
+    # First lag with a small autocorrelation (otherwise n)
+    small  = np.abs( rho[:,0:nmax] ) < 2.0 / np.sqrt(n);
+    cutoff = np.where( np.any( small, axis=1 ), np.argmax( small, axis=1 ), n );
+    tmp    = np.minimum( cutoff, nmax );
+
+    sums = np.hstack( ( np.zeros((p,1)), np.cumsum( rho[:,0:nmax], axis=1 ) ) );
+    return 1.0 + 2.0 * sums[ np.arange(p), tmp ];
+
+def iactGeyer( rho ):
+    n = rho.shape[1];
+    p = rho.shape[0];
+    L = int( np.max( ( np.ceil( ( n - 2 ) / 2.0 ), 1 ) ) );
+
+    # Sums of adjacent pairs, truncated before the first non-positive pair
+    # (or the last pair if all are positive) and made monotone decreasing
+    pairs = rho[:,0:2*L:2] + rho[:,1:2*L:2];
+    stop  = pairs <= 0.0;
+    J     = np.where( np.any( stop, axis=1 ), np.argmax( stop, axis=1 ), L - 1 );
+    keep  = np.arange( L )[np.newaxis,:] < J[:,np.newaxis];
+    pairs = np.minimum.accumulate( pairs, axis=1 );
+
+    # The even lag of the truncated pair is added if it is positive
+    tail  = np.maximum( rho[ np.arange(p), 2 * J ], 0.0 );
+
+    return -1.0 + 2.0 * np.sum( pairs * keep, axis=1 ) + tail;
+
+def iactBatchMeans( x ):
+    m, n, p    = x.shape;
+    b          = int( np.floor( np.sqrt( n ) ) );
+    nb         = int( np.floor( n / b ) );
+    batchMeans = np.mean( x[:,0:nb*b,:].reshape((m,nb,b,p)), axis=2 ).reshape((m*nb,p));
+
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        out = b * np.var( batchMeans, axis=0, ddof=1 ) / np.var( x.reshape((m*n,p)), axis=0, ddof=1 );
+
+    out[ ~np.isfinite( out ) ] = 1.0;
+    return out;
+
+##############################################################################
+# Waste recycling estimates of the posterior mean and variance. Each
+# iteration contributes the proposal y and the state x it was proposed from,
+# weighted by the acceptance probability a and 1 - a respectively. This is
+# the expectation of the next state of the chain given x and y (averaging
+# over the accept/reject decision), so the rejected proposals are also used.
+##############################################################################
+def recycledMoments( x, y, aprob ):
+    a  = np.clip( np.nan_to_num( np.asarray( aprob, dtype=float ).reshape(-1) ), 0.0, 1.0 ).reshape((-1,1));
+    n  = x.shape[0];
+
+    m1 = np.mean( a * y    + ( 1.0 - a ) * x,    axis=0 );
+    m2 = np.mean( a * y**2 + ( 1.0 - a ) * x**2, axis=0 );
+
+    return m1, ( m2 - m1**2 ) * n / ( n - 1.0 );
 
 ##############################################################################
 # Calculate the log-pdf of a univariate Gaussian
@@ -99,6 +225,12 @@ def loguninormpdf(x,mu,sigma):
 # Calculate the log-pdf of a multivariate Gaussian with mean vector mu and covariance matrix S
 ##############################################################################
 def lognormpdf(x,mu,S):
+    proposal = gaussianProposal(S)
+
+    if ( proposal.positiveDefinite ):
+        return proposal.logpdf(x,mu)
+
+    # Fall back to the pseudo-inverse if S is not positive definite
     nx = len(S)
     norm_coeff = nx * np.log( 2.0 * np.pi ) + np.linalg.slogdet(S)[1]
     err = x-mu
@@ -106,6 +238,58 @@ def lognormpdf(x,mu,S):
     numerator = np.dot( np.dot(err,np.linalg.pinv(S)),err.transpose())
     return -0.5*(norm_coeff+numerator)
 
+##############################################################################
+# Gaussian proposal with covariance matrix stepSize**2 * S, the Cholesky
+# factor and log-determinant of S are computed once and cached. The
+# factorisation fails if S is not positive definite.
+##############################################################################
+class gaussianProposal(object):
+
+    def __init__(self, S):
+        self.nx = len(S);
+
+        try:
+            if ( not np.all( np.isfinite( S ) ) ):
+                raise np.linalg.LinAlgError("gaussianProposal: the covariance matrix is not finite.");
+
+            self.L                = np.linalg.cholesky( S );
+            self.logdet           = 2.0 * np.sum( np.log( np.diag( self.L ) ) );
+            self.positiveDefinite = True;
+        except np.linalg.LinAlgError:
+            self.L                = None;
+            self.logdet           = None;
+            self.positiveDefinite = False;
+
+    def sample(self, mu, stepSize=1.0):
+        return mu + stepSize * np.dot( self.L, np.random.standard_normal( self.nx ) );
+
+    def logpdf(self, x, mu, stepSize=1.0):
+        err        = solve_triangular( self.L, x - mu, lower=True ) / stepSize;
+        norm_coeff = self.nx * np.log( 2.0 * np.pi * stepSize**2 ) + self.logdet;
+        return -0.5 * ( norm_coeff + np.dot( err, err ) );
+
+##############################################################################
+# Gradient with respect to the parameters used by the sampler, models that
+# do not define transformGradient (no transformation) keep the gradient
+##############################################################################
+def transformGradient(thSys, gradient):
+    if ( hasattr( thSys, 'transformGradient' ) ):
+        return thSys.transformGradient( gradient );
+
+    return gradient;
+
+##############################################################################
+# Calculate log( sum( exp( x ) ) ) in a numerically stable manner
+##############################################################################
+def logsumexp(x):
+    x    = np.asarray( x, dtype=float );
+    xmax = np.max( x );
+
+    if ( not np.isfinite( xmax ) ):
+        return xmax;
+
+    return xmax + np.log( np.sum( np.exp( x - xmax ) ) );
+
 ##############################################################################
 # Check if a matrix is positive semi-definite but checking for negative eigenvalues
 ##############################################################################
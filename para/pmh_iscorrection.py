@@ -0,0 +1,223 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy           as     np
+import multiprocessing
+from   pmh_helpers     import logsumexp
+from   pmh_parallel    import packEstimator, initialiseWorker, evaluateWorker, evaluateEstimator
+
+##############################################################################
+# Importance sampling correction of approximate MCMC (Vihola, Helske and
+# Franks, 2020). The chain is first run with a cheap approximation of the
+# log-likelihood (e.g. the Kalman filter of kalmanMethods or a particle filter
+# with few particles), and the draws after the burn-in (every thin:th draw)
+# are then weighted by the ratio of the likelihood estimate of the particle
+# filter sm and the approximation used by the chain. The estimates of sm are
+# unbiased, so the weighted draws are consistent for the exact posterior.
+#
+# The particle filter is run once (or nEstimates times, averaging the
+# likelihoods) for each state of the thinned chain, where consecutive copies
+# of the same state (rejections) share the estimate. The filters are run in a
+# pool of nProcesses processes with one seed per state, so the result does
+# not depend on the number of processes.
+#
+# The weighted posterior mean, standard deviation and quantiles (of the
+# original parameters) are computed together with the standard errors of the
+# means (batch means of the weighted draws, which include both the
+# autocorrelation of the chain and the variation of the weights), and the
+# diagnostics of the weights: the ESS, the largest normalised weight, the
+# coefficient of variation, the standard deviation of the log-weights and
+# the Pareto k of the tail of the weights (Vehtari, Simpson, Gelman, Yao and
+# Gabry, 2024), where k > 0.7 indicates that the estimates are unreliable.
+##############################################################################
+
+class isCorrectedPMH(object):
+
+    # Use every thin:th draw after the burn-in and nEstimates estimates of
+    # the likelihood for each state
+    thin       = 1;
+    nEstimates = 1;
+
+    # Number of processes (all cores if None) and the seed
+    nProcesses = 1;
+    seed       = None;
+
+    # Quantiles of the weighted posterior
+    quantiles  = ( 0.025, 0.5, 0.975 );
+
+    ##########################################################################
+    # Run the chain using the approximation smApprox and correct the draws
+    # using the particle filter sm
+    ##########################################################################
+    def runSampler(self,pmh,smApprox,sm,sys,thSys,PMHtype):
+
+        pmh.runSampler( smApprox, sys, thSys, PMHtype );
+        self.reweight( pmh, sm, sys, thSys );
+
+    ##########################################################################
+    # Weight the draws of a completed run of the stPMH object pmh
+    ##########################################################################
+    def reweight(self,pmh,sm,sys,thSys):
+
+        self.nPars = thSys.nParInference;
+
+        # Thinned draws after the burn-in and the approximate log-likelihoods
+        # used by the chain (including the noise if the approximation is an
+        # estimate, as the weights then correct the extended target)
+        idx            = np.arange( pmh.nBurnIn, pmh.nIter, self.thin );
+        self.th        = np.array( pmh.th[idx,:], copy=True );
+        self.tho       = np.array( pmh.tho[idx,:], copy=True );
+        self.llApprox  = np.array( pmh.ll[idx,0], copy=True );
+        self.nDraws    = len( idx );
+
+        if ( self.nDraws < 2 ):
+            raise NameError("isCorrectedPMH: at least two draws after the burn-in are required.");
+
+        # Group consecutive copies of the same state
+        new            = np.ones( self.nDraws, dtype=bool );
+        new[1:]        = np.any( self.th[1:,:] != self.th[:-1,:], axis=1 ) | ( self.llApprox[1:] != self.llApprox[:-1] );
+        self.stateIdx  = np.cumsum( new ) - 1;
+        first          = np.where( new )[0];
+        self.nStates   = len( first );
+
+        # Estimate the log-likelihood of each state using the particle filter
+        rng            = np.random.RandomState( self.seed );
+        seeds          = rng.randint( 0, 2**31 - 1, size=( self.nStates, self.nEstimates ) );
+        tasks          = [ ( self.th[first[ii],:], seeds[ii,jj], False ) for ii in range( self.nStates ) for jj in range( self.nEstimates ) ];
+
+        nProcesses = self.nProcesses;
+        if ( nProcesses is None ):
+            nProcesses = multiprocessing.cpu_count();
+
+        if ( nProcesses > 1 ):
+            pool    = multiprocessing.Pool( processes=nProcesses, initializer=initialiseWorker, initargs=( packEstimator(sm), sys, thSys ) );
+            results = pool.map( evaluateWorker, tasks, chunksize=int( np.max( ( 1, np.ceil( len( tasks ) / ( 4.0 * nProcesses ) ) ) ) ) );
+            pool.close();
+            pool.join();
+        else:
+            # Keep the random number generator of the caller
+            state   = np.random.get_state();
+            results = [ evaluateEstimator( sm, thSys, sys, task[0], task[1], task[2] ) for task in tasks ];
+            np.random.set_state( state );
+
+        lls            = np.array( [ result[0] for result in results ] ).reshape( ( self.nStates, self.nEstimates ) );
+        self.llStates  = np.array( [ logsumexp( lls[ii,:] ) for ii in range( self.nStates ) ] ) - np.log( self.nEstimates );
+
+        # Log-weights of the draws (the prior and the Jacobian cancel) and
+        # the normalised weights
+        self.llExact   = self.llStates[ self.stateIdx ];
+        self.logW      = self.llExact - self.llApprox;
+
+        if ( not np.any( np.isfinite( self.logW ) ) ):
+            raise NameError("isCorrectedPMH: all the weights are zero.");
+
+        self.w         = np.exp( self.logW - np.max( self.logW ) );
+        self.w        /= np.sum( self.w );
+
+        self.calcPosteriorSummaries();
+        self.calcDiagnostics();
+
+        print("isCorrectedPMH: weighted " + str(self.nDraws) + " draws (" + str(self.nStates) + " unique states) using " + str(self.nStates*self.nEstimates) + " filter runs and " + str(nProcesses) + " processes.");
+        print(" mean:         " + str( np.round( self.mean, 4 ) ) );
+        print(" std:          " + str( np.round( np.sqrt( self.var ), 4 ) ) );
+        print(" MCSE:         " + str( np.round( self.se, 4 ) ) );
+        print(" ESS:          " + "%.1f" % self.ess + " (" + "%.3f" % ( self.ess / self.nDraws ) + " per draw)" );
+        print(" max weight:   " + "%.4f" % self.maxWeight + ", CV: " + "%.3f" % self.cv + ", std log-weight: " + "%.3f" % self.logWStd );
+        print(" Pareto k:     " + "%.3f" % self.paretoK );
+
+    ##########################################################################
+    # Weighted posterior mean, variance and quantiles and the standard errors
+    # of the means from batch means of w_i ( x_i - mean ) (in draw order)
+    ##########################################################################
+    def calcPosteriorSummaries(self):
+
+        w         = self.w.reshape( ( -1, 1 ) );
+        self.mean = np.sum( w * self.tho, axis=0 );
+        self.var  = np.sum( w * ( self.tho - self.mean )**2, axis=0 ) / ( 1.0 - np.sum( self.w**2 ) );
+
+        self.quantile = np.zeros( ( len( self.quantiles ), self.nPars ) );
+        for nn in range( self.nPars ):
+            self.quantile[:,nn] = weightedQuantiles( self.tho[:,nn], self.w, self.quantiles );
+
+        b       = int( np.floor( np.sqrt( self.nDraws ) ) );
+        nb      = int( np.floor( self.nDraws / b ) );
+        z       = ( w * ( self.tho - self.mean ) )[0:nb*b,:].reshape( ( nb, b, self.nPars ) );
+        self.se = np.sqrt( np.sum( np.sum( z, axis=1 )**2, axis=0 ) * self.nDraws / ( nb * b ) );
+
+    ##########################################################################
+    # Diagnostics of the importance weights
+    ##########################################################################
+    def calcDiagnostics(self):
+
+        self.ess       = 1.0 / np.sum( self.w**2 );
+        self.maxWeight = np.max( self.w );
+        self.cv        = np.std( self.w * self.nDraws );
+
+        finite         = np.isfinite( self.logW );
+        self.logWStd   = np.std( self.logW[ finite ] );
+        self.paretoK   = paretoShape( self.logW[ finite ] );
+
+##############################################################################
+# Quantiles of the draws x with the normalised weights w
+##############################################################################
+def weightedQuantiles(x, w, q):
+    order = np.argsort( x );
+    cw    = np.cumsum( w[order] ) - 0.5 * w[order];
+
+    return np.interp( q, cw / np.sum( w ), x[order] );
+
+##############################################################################
+# Shape of a generalised Pareto distribution fitted to the largest weights
+# (the largest min(n/5, 3 sqrt(n)) log-weights) using the method of Zhang
+# and Stephens (2009) with the weakly informative prior used in PSIS.
+# Returns nan if there are too few distinct weights in the tail.
+##############################################################################
+def paretoShape(logW):
+    n = len( logW );
+    M = int( np.ceil( np.min( ( 0.2 * n, 3.0 * np.sqrt( n ) ) ) ) );
+
+    if ( ( M < 5 ) or ( M >= n ) ):
+        return np.nan;
+
+    x = np.exp( np.sort( logW ) - np.max( logW ) );
+    x = x[n-M:] - x[n-M-1];
+
+    if ( x[-1] <= 0.0 ):
+        return np.nan;
+
+    m  = 30 + int( np.floor( np.sqrt( M ) ) );
+    bs = 1.0 - np.sqrt( m / ( np.arange( 1, m + 1 ) - 0.5 ) );
+    bs = bs / ( 3.0 * x[ int( np.floor( M / 4.0 + 0.5 ) ) - 1 ] ) + 1.0 / x[-1];
+
+    ks = np.mean( np.log1p( -bs.reshape( ( -1, 1 ) ) * x ), axis=1 );
+    L  = M * ( np.log( -bs / ks ) - ks - 1.0 );
+    wb = 1.0 / np.sum( np.exp( L.reshape( ( 1, -1 ) ) - L.reshape( ( -1, 1 ) ) ), axis=1 );
+
+    b  = np.sum( bs * wb );
+    k  = np.mean( np.log1p( -b * x ) );
+
+    return ( M * k + 10.0 * 0.5 ) / ( M + 10.0 );
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
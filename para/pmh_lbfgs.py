@@ -0,0 +1,257 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy        as     np
+from   collections  import deque
+from   scipy.linalg import solve_triangular
+
+##############################################################################
+# Compact limited-memory BFGS representation of the inverse Hessian
+#
+# Stores the curvature pairs (skk,ykk) between consecutive unique states
+# together with the inner products S'Y and Y'Y. The pairs are added and
+# evicted incrementally as the memory window slides along the chain. The
+# inverse Hessian estimate is given by (Byrd, Nocedal and Schnabel, 1994)
+#
+#   Hk = gamma * I + U' ( D + gamma * Y'Y ) U - gamma * ( U'Y + Y'U ),
+#
+# with U = inv(R) S', where R is the upper triangular part of S'Y and D is
+# its diagonal. This is the same matrix as obtained by applying the BFGS
+# updates one after another starting from Hk = gamma * I.
+##############################################################################
+
+class lbfgsMemory(object):
+
+    def __init__(self, nPars, memoryLength):
+        self.nPars    = nPars;
+        self.capacity = 2 * ( memoryLength + 1 );
+
+        # Indices (in the chain) of the states in the memory
+        self.stateIdx = deque();
+
+        # Storage for the curvature pairs and their inner products, the
+        # stored pairs are found at [first,last)
+        self.S        = np.zeros((self.capacity,nPars));
+        self.Y        = np.zeros((self.capacity,nPars));
+        self.StY      = np.zeros((self.capacity,self.capacity));
+        self.YtY      = np.zeros((self.capacity,self.capacity));
+        self.pairIdx  = deque();
+        self.first    = 0;
+        self.last     = 0;
+
+    ##########################################################################
+    # Update the memory to the unique states (idx) inside the memory length
+    ##########################################################################
+    def update(self, idx, th, gradient):
+
+        # Evict the states (and their pairs) that have left the memory
+        while ( ( len(self.stateIdx) > 0 ) and ( self.stateIdx[0] < idx[0] ) ):
+            self.stateIdx.popleft();
+
+            if ( ( len(self.pairIdx) > 0 ) and ( ( len(self.stateIdx) == 0 ) or ( self.pairIdx[0] <= self.stateIdx[0] ) ) ):
+                self.pairIdx.popleft();
+                self.first += 1;
+
+        # Rebuild the memory if it does not agree with the new states
+        nOld = len(self.stateIdx);
+
+        if ( ( nOld > len(idx) ) or ( ( nOld > 0 ) and ( ( self.stateIdx[0] != idx[0] ) or ( self.stateIdx[-1] != idx[nOld-1] ) ) ) ):
+            self.reset();
+            nOld = 0;
+
+        # Add the pairs from the new states
+        for jj in idx[nOld:]:
+            if ( len(self.stateIdx) > 0 ):
+                skk = th[jj,:]       - th[self.stateIdx[-1],:];
+                ykk = gradient[jj,:] - gradient[self.stateIdx[-1],:];
+
+                # Check if we have moved, otherwise to not add contribution to Hessian
+                if ( np.sum( skk ) != 0.0 ):
+                    self.addPair( skk, ykk );
+                    self.pairIdx.append( jj );
+
+            self.stateIdx.append( jj );
+
+    ##########################################################################
+    # Add a curvature pair at the end of the memory
+    ##########################################################################
+    def addPair(self, skk, ykk):
+
+        # Move the stored pairs to the beginning of the storage if it is full
+        if ( self.last == self.capacity ):
+            n = self.last - self.first;
+            self.S[0:n,:]     = self.S[self.first:self.last,:];
+            self.Y[0:n,:]     = self.Y[self.first:self.last,:];
+            self.StY[0:n,0:n] = self.StY[self.first:self.last,self.first:self.last].copy();
+            self.YtY[0:n,0:n] = self.YtY[self.first:self.last,self.first:self.last].copy();
+            self.first = 0;
+            self.last  = n;
+
+        kk = self.last;
+        self.S[kk,:] = skk;
+        self.Y[kk,:] = ykk;
+
+        # Update the inner products with the new pair
+        self.StY[self.first:kk+1,kk] = np.dot( self.S[self.first:kk+1,:], ykk );
+        self.StY[kk,self.first:kk]   = np.dot( self.Y[self.first:kk,:],   skk );
+        self.YtY[self.first:kk+1,kk] = np.dot( self.Y[self.first:kk+1,:], ykk );
+        self.YtY[kk,self.first:kk]   = self.YtY[self.first:kk,kk];
+
+        self.last += 1;
+
+    ##########################################################################
+    # Empty the memory
+    ##########################################################################
+    def reset(self):
+        self.stateIdx.clear();
+        self.pairIdx.clear();
+        self.first = 0;
+        self.last  = 0;
+
+    ##########################################################################
+    # Set the initial Hessian (gamma * I) and an optional leading pair that is
+    # applied before the stored pairs
+    ##########################################################################
+    def prepare(self, gamma, skk=None, ykk=None):
+
+        S   = self.S[self.first:self.last,:];
+        Y   = self.Y[self.first:self.last,:];
+        StY = self.StY[self.first:self.last,self.first:self.last];
+        YtY = self.YtY[self.first:self.last,self.first:self.last];
+
+        if ( ( skk is not None ) and ( np.sum( skk ) != 0.0 ) ):
+            n      = self.last - self.first + 1;
+            S      = np.vstack( ( skk, S ) );
+            Y      = np.vstack( ( ykk, Y ) );
+
+            StY0          = np.zeros((n,n));
+            StY0[1:,1:]   = StY;
+            StY0[0,:]     = np.dot( Y, skk );
+            StY0[1:,0]    = np.dot( S[1:,:], ykk );
+            StY           = StY0;
+
+            YtY0          = np.zeros((n,n));
+            YtY0[1:,1:]   = YtY;
+            YtY0[0,:]     = np.dot( Y, ykk );
+            YtY0[1:,0]    = YtY0[0,1:];
+            YtY           = YtY0;
+
+        self.gamma = gamma;
+        self.Sk    = S;
+        self.Yk    = Y;
+        self.StYk  = StY;
+        self.YtYk  = YtY;
+        self.rho   = 1.0 / np.diag( StY );
+
+    ##########################################################################
+    # Form the dense inverse Hessian estimate
+    ##########################################################################
+    def dense(self):
+        Hk = np.eye(self.nPars) * self.gamma;
+
+        if ( self.Sk.shape[0] > 0 ):
+            U   = solve_triangular( np.triu( self.StYk ), self.Sk );
+            UY  = np.dot( U.transpose(), self.Yk );
+            Hk += np.dot( U.transpose(), np.dot( np.diag( 1.0 / self.rho ) + self.gamma * self.YtYk, U ) );
+            Hk -= self.gamma * ( UY + UY.transpose() );
+
+        return Hk;
+
+    ##########################################################################
+    # Multiply a vector with the inverse Hessian estimate using the
+    # two-loop recursion
+    ##########################################################################
+    def multiply(self, v):
+        nk    = self.Sk.shape[0];
+        alpha = np.zeros(nk);
+        q     = np.array( v, dtype=float, copy=True );
+
+        for ii in range(nk-1,-1,-1):
+            alpha[ii] = self.rho[ii] * np.dot( self.Sk[ii,:], q );
+            q        -= alpha[ii] * self.Yk[ii,:];
+
+        r = self.gamma * q;
+
+        for ii in range(0,nk):
+            beta = self.rho[ii] * np.dot( self.Yk[ii,:], r );
+            r   += self.Sk[ii,:] * ( alpha[ii] - beta );
+
+        return r;
+
+    ##########################################################################
+    # Alternative update rules, formed by applying the updates to the pairs
+    # (skk,-ykk) one after another starting from h0 * I. As the gradients are
+    # of the log-posterior, the curvature condition is skk'ykk < 0 and the
+    # estimate of the negative inverse Hessian (the proposal covariance) is
+    # returned together with the number of pairs that were modified/skipped.
+    ##########################################################################
+
+    # Powell-damped BFGS: the pair is damped towards B*skk when the curvature
+    # skk'(-ykk) is below threshold * skk'B skk, which keeps the estimate PD
+    def denseDamped(self, h0, threshold=0.2):
+        H      = np.eye(self.nPars) * h0;
+        B      = np.eye(self.nPars) / h0;
+        nFixes = 0;
+
+        for ii in range(self.Sk.shape[0]):
+            s   = self.Sk[ii,:];
+            y   = -self.Yk[ii,:];
+            Bs  = np.dot( B, s );
+            sBs = np.dot( s, Bs );
+            sy  = np.dot( s, y );
+
+            if ( sy < threshold * sBs ):
+                theta   = ( 1.0 - threshold ) * sBs / ( sBs - sy );
+                y       = theta * y + ( 1.0 - theta ) * Bs;
+                sy      = np.dot( s, y );
+                nFixes += 1;
+
+            V  = np.eye(self.nPars) - np.outer( s, y ) / sy;
+            H  = np.dot( V, np.dot( H, V.transpose() ) ) + np.outer( s, s ) / sy;
+            B += np.outer( y, y ) / sy - np.outer( Bs, Bs ) / sBs;
+
+        return H, nFixes;
+
+    # Symmetric rank-one update, the pair is skipped if the denominator is
+    # small, i.e. |(skk - H ykk)'ykk| < threshold * |skk - H ykk| |ykk|. The
+    # estimate is not guaranteed to be PD.
+    def denseSR1(self, h0, threshold=1e-8):
+        H      = np.eye(self.nPars) * h0;
+        nFixes = 0;
+
+        for ii in range(self.Sk.shape[0]):
+            y   = -self.Yk[ii,:];
+            u   = self.Sk[ii,:] - np.dot( H, y );
+            uy  = np.dot( u, y );
+
+            if ( np.abs( uy ) <= threshold * np.linalg.norm( u ) * np.linalg.norm( y ) ):
+                nFixes += 1;
+                continue;
+
+            H += np.outer( u, u ) / uy;
+
+        return H, nFixes;
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
@@ -0,0 +1,203 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy           as     np
+import copy
+from   pmh_parallel    import parallelPMH
+
+##############################################################################
+# Runs several PMH chains in lockstep in a single process. In each iteration
+# all chains propose new parameters, the proposals inside the support of the
+# prior are sent through one call of the batched filter/smoother of sm
+# (sm.filterBatch and sm.smootherBatch, e.g. kfBatch and rtsBatch of
+# kalmanMethods) and then each chain completes its iteration. Each chain is
+# a copy of the stPMH object pmh, so the bookkeeping of the proposals (e.g.
+# the Hessian estimates and memory of qPMH2) is kept for each chain.
+#
+# If sm has no batched filter/smoother, the filter/smoother of sm is run for
+# each chain instead. The dispersed initial parameters, the diagnostics and
+# calcIACT are the same as for parallelPMH.
+##############################################################################
+
+class lockstepPMH(parallelPMH):
+
+    # Print a progress report every progressInterval iterations
+    progressInterval = 1000;
+
+    ##########################################################################
+    # Main sampling routine
+    ##########################################################################
+
+    def runSampler(self,pmh,sm,sys,thSys,PMHtype):
+
+        for name in ( "surrogate", "checkpointFile", "targetESS", "fidelitySchedule" ):
+            if ( getattr( pmh, name, None ) != None ):
+                raise NameError("lockstepPMH: " + name + " cannot be used when running chains in lockstep.");
+
+        # The settings of the chains are taken from the stPMH object pmh
+        self.PMHtype = PMHtype;
+        self.nPars   = thSys.nParInference;
+        self.nBurnIn = pmh.nBurnIn;
+        self.nIter   = pmh.nIter;
+        self.smooth  = ( PMHtype != "pPMH0" );
+
+        # Draw the seed and dispersed initial parameters
+        rng          = np.random.RandomState( self.seed );
+        self.initPar = self.disperseInitialParameters( rng, pmh, sys, thSys );
+        np.random.seed( rng.randint( 0, 2**31 - 1 ) );
+
+        # Set up the chains with their own models and estimators
+        self.chains     = [];
+        self.models     = [];
+        self.estimators = [];
+
+        for ii in range( self.nChains ):
+            chain                  = copy.deepcopy( pmh );
+            chain.initPar          = np.array( self.initPar[ii,:], copy=True );
+            chain.progressInterval = None;
+
+            # Write the output of the chains to separate files
+            if ( chain.outputFile != None ):
+                chain.outputFile = chain.outputFile + ".chain" + str(ii);
+
+            # Label the metrics of the chains
+            if ( chain.metrics != None ):
+                chain.metrics.label = ii;
+
+            self.chains.append( chain );
+            self.models.append( copy.deepcopy( thSys ) );
+            self.estimators.append( batchEstimator( sm ) );
+
+        self.nBatchCalls = 0;
+
+        #=====================================================================
+        # Initialise the chains at the initial parameters
+        #=====================================================================
+        for ii in range( self.nChains ):
+            self.models[ii].storeParameters( self.initPar[ii,:], sys );
+
+        self.evaluate( sm, range( self.nChains ) );
+
+        for ii in range( self.nChains ):
+            self.chains[ii].startSampler( self.estimators[ii], sys, self.models[ii], PMHtype );
+
+        #=====================================================================
+        # Main MCMC-loop
+        #=====================================================================
+        for kk in range( 1, self.nIter ):
+
+            # Propose parameters for all chains
+            for ii in range( self.nChains ):
+                self.chains[ii].proposeStep( sys, self.models[ii] );
+
+            # Run the filter/smoother for the proposals inside the support
+            idx = [ ii for ii in range( self.nChains ) if ( self.models[ii].priorUniform() != 0.0 ) ];
+            self.evaluate( sm, idx );
+
+            # Accept/reject and update the state of the chains
+            for ii in range( self.nChains ):
+                self.chains[ii].calculateAcceptanceProbability( self.estimators[ii], self.models[ii] );
+                self.chains[ii].completeStep( self.estimators[ii], self.models[ii] );
+
+            if ( ( self.progressInterval != None ) and ( np.remainder( kk, self.progressInterval ) == 0 ) ):
+                print("lockstepPMH: iteration " + str(kk) + " of " + str(self.nIter) + ", acceptance rates: " + str( [ "%.3f" % ( chain.nAccepted / chain.runningStats.n ) for chain in self.chains ] ) );
+
+        for chain in self.chains:
+            chain.finishSampler();
+
+        # Pool the output after burn-in and compute convergence diagnostics
+        self.thChains = np.array( [ chain.th[self.nBurnIn:self.nIter,:] for chain in self.chains ] );
+        self.th       = self.thChains.reshape( ( -1, self.nPars ) );
+        self.calcDiagnostics();
+
+        print("lockstepPMH: completed " + str(self.nChains) + " chains of " + PMHtype + " using " + str(self.nBatchCalls) + " batched filter/smoother calls.");
+        print(" split-Rhat: " + str( ["%.3f" % v for v in self.Rhat] ) );
+        print(" bulk-ESS:   " + str( ["%.1f" % v for v in self.essBulk] ) );
+        print(" tail-ESS:   " + str( ["%.1f" % v for v in self.essTail] ) );
+
+    ##########################################################################
+    # Run the batched filter/smoother for the chains idx (the models hold
+    # the original parameters of the proposals)
+    ##########################################################################
+    def evaluate(self, sm, idx):
+
+        for estimator in self.estimators:
+            estimator.reset();
+
+        idx = list( idx );
+        if ( len( idx ) == 0 ):
+            return None;
+
+        if ( self.smooth ):
+            batch = getattr( sm, 'smootherBatch', None );
+        else:
+            batch = getattr( sm, 'filterBatch', None );
+
+        # Run the filter/smoother of each chain instead
+        if ( batch is None ):
+            return None;
+
+        par = np.array( [ self.models[ii].par for ii in idx ] );
+        batch( self.models[idx[0]], par );
+        self.nBatchCalls += 1;
+
+        for jj, ii in enumerate( idx ):
+            self.estimators[ii].llBatch = sm.llBatch[jj];
+
+            if ( self.smooth ):
+                self.estimators[ii].gradientBatch = sm.gradientBatch[jj,:];
+
+##############################################################################
+# Estimator passed to the stPMH object of a chain, returns the estimates
+# from the batched call (or runs the filter/smoother sm if not available)
+##############################################################################
+class batchEstimator(object):
+
+    def __init__(self, sm):
+        self.sm = sm;
+        self.reset();
+
+    def reset(self):
+        self.llBatch       = None;
+        self.gradientBatch = None;
+
+    def filter(self, thSys):
+        if ( self.llBatch is None ):
+            self.sm.filter( thSys );
+            self.ll = self.sm.ll;
+        else:
+            self.ll = self.llBatch;
+
+    def smoother(self, thSys):
+        if ( self.gradientBatch is None ):
+            self.sm.smoother( thSys );
+            self.ll       = self.sm.ll;
+            self.gradient = np.array( self.sm.gradient, copy=True );
+        else:
+            # Add the gradient of the log-prior (as in the smoothers)
+            self.ll       = self.llBatch;
+            self.gradient = self.gradientBatch + np.array( [ thSys.dprior1(nn) for nn in range( thSys.nParInference ) ] );
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
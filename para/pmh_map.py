@@ -0,0 +1,285 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy           as     np
+from   pmh_helpers     import transformGradient
+
+##############################################################################
+# Estimate the posterior mode (in the parameters used by the sampler, i.e.
+# including the log-Jacobian if the parameters are transformed) and the
+# curvature at the mode, to be used as the initial parameters and the
+# preconditioner of the PMH algorithms instead of a pilot run.
+#
+# method = "newton": quasi-Newton ascent with a backtracking line search
+# for exact gradients (e.g. the RTS smoother), stopped when the Newton
+# decrement g' P g is below tolerance.
+#
+# method = "sa": stochastic approximation for noisy gradients (e.g. the
+# fixed-lag particle smoother), with the step size saGain / (k+1)^saDecay
+# and the average of the iterates in the last half of the iterations
+# (Polyak-Ruppert averaging) as the estimate. It is reported as converged
+# if 0.5 g' P g < saTolerance for the average g of the gradients in the
+# last half of the iterations.
+#
+# The Hessian is estimated by central differences of the gradient with step
+# fdStep, using the same random numbers for both points and averaging over
+# fdRepeats repetitions. Its negative inverse (with the eigenvalues
+# mirrored if it is not negative definite) is the preconditioner, which is
+# also used for the steps of both methods (estimated at initPar first and
+# then updated by BFGS or estimated again in the stochastic approximation).
+##############################################################################
+
+class posteriorMode(object):
+
+    method      = "newton";
+    maxIter     = 100;
+    tolerance   = 1e-8;
+
+    # Settings for the stochastic approximation, the length of each step
+    # (in the metric of the preconditioner) is at most saMaxStep and the
+    # preconditioner is estimated again every saCurvatureInterval
+    # iterations before the averaging starts
+    saGain              = 1.0;
+    saDecay             = 0.602;
+    saMaxStep           = 5.0;
+    saCurvatureInterval = 10;
+    saTolerance         = 0.1;
+
+    # Settings for the finite differences of the gradient
+    fdStep      = 1e-4;
+    fdRepeats   = 1;
+
+    ##########################################################################
+    # Main routine
+    ##########################################################################
+
+    def findMode(self,sm,sys,thSys,initPar):
+
+        self.nPars        = thSys.nParInference;
+        self.nEvaluations = 0;
+        self.nMirrored    = 0;
+        self.converged    = False;
+
+        # Start from initPar (given for the original parameters)
+        thSys.storeParameters( initPar, sys );
+
+        if ( thSys.priorUniform() == 0.0 ):
+            raise NameError("posteriorMode: the initial parameters are outside the support of the prior.");
+
+        thSys.invTransform();
+        th = thSys.returnParameters();
+
+        # Preconditioner from the curvature at the initial parameters
+        P = self.estimateCurvature( sm, sys, thSys, th )[1];
+
+        if ( self.method == "newton" ):
+            th = self.newtonAscent( sm, sys, thSys, th, P );
+        elif ( self.method == "sa" ):
+            th = self.stochasticApproximation( sm, sys, thSys, th, P );
+        else:
+            raise NameError("posteriorMode: unknown method " + str( self.method ) + ".");
+
+        # Curvature at the mode
+        self.thMode                     = th;
+        self.hessian, self.invHessian   = self.estimateCurvature( sm, sys, thSys, th );
+        self.logPosterior, self.gradient = self.evaluate( sm, sys, thSys, th );
+
+        thSys.storeParameters( th, sys );
+        thSys.transform();
+        self.thModeOriginal = thSys.returnParameters();
+
+        print("posteriorMode: " + self.method + " finished after " + str(self.nIter) + " iterations using " + str(self.nEvaluations) + " filter/smoother runs (converged: " + str(self.converged) + ").");
+        print(" mode:          " + str( np.round( self.thModeOriginal, 4 ) ) );
+        print(" log-posterior: " + "%.4f" % self.logPosterior );
+        print(" std:           " + str( np.round( np.sqrt( np.diag( self.invHessian ) ), 4 ) ) );
+
+        return self.thModeOriginal, self.invHessian;
+
+    ##########################################################################
+    # Set the initial parameters, the preconditioner and the initial Hessian
+    # of qPMH2 (epsilon, from the smallest variance) of the stPMH object pmh
+    ##########################################################################
+    def configure(self,pmh):
+
+        pmh.initPar    = np.array( self.thModeOriginal, copy=True );
+        pmh.invHessian = np.array( self.invHessian, copy=True );
+        pmh.epsilon    = 1.0 / np.min( np.linalg.eigvalsh( self.invHessian ) );
+
+    ##########################################################################
+    # Quasi-Newton ascent with backtracking line search (BFGS updates of the
+    # preconditioner, pairs violating the curvature condition are skipped)
+    ##########################################################################
+    def newtonAscent(self,sm,sys,thSys,th,P):
+
+        f, g = self.evaluate( sm, sys, thSys, th );
+
+        for kk in range( self.maxIter ):
+            self.nIter = kk;
+
+            d   = np.dot( P, g );
+            dec = np.dot( g, d );
+
+            if ( dec < self.tolerance ):
+                self.converged = True;
+                break;
+
+            # Backtracking line search (Armijo condition)
+            step = 1.0;
+            while True:
+                thn    = th + step * d;
+                fn, gn = self.evaluate( sm, sys, thSys, thn );
+
+                if ( fn >= f + 1e-4 * step * dec ):
+                    break;
+
+                step *= 0.5;
+
+                if ( step < 1e-10 ):
+                    self.nIter = kk + 1;
+                    return th;
+
+            # BFGS update of the negative inverse Hessian
+            s  = thn - th;
+            y  = g - gn;
+            sy = np.dot( s, y );
+
+            if ( sy > 0.0 ):
+                V = np.eye( self.nPars ) - np.outer( s, y ) / sy;
+                P = np.dot( V, np.dot( P, V.transpose() ) ) + np.outer( s, s ) / sy;
+
+            th, f, g = thn, fn, gn;
+            self.nIter = kk + 1;
+
+        return th;
+
+    ##########################################################################
+    # Stochastic approximation with Polyak-Ruppert averaging
+    ##########################################################################
+    def stochasticApproximation(self,sm,sys,thSys,th,P):
+
+        thPrev  = th;
+        thSum   = np.zeros( self.nPars );
+        gSum    = np.zeros( self.nPars );
+        nSum    = 0;
+
+        for kk in range( self.maxIter ):
+            f, g = self.evaluate( sm, sys, thSys, th );
+
+            # Go back to the last parameters if outside the support
+            if ( g is None ):
+                th = thPrev;
+                f, g = self.evaluate( sm, sys, thSys, th );
+
+            # Update the preconditioner before the averaging
+            if ( ( kk > 0 ) and ( kk < self.maxIter / 2 ) and ( np.remainder( kk, self.saCurvatureInterval ) == 0 ) ):
+                P = self.estimateCurvature( sm, sys, thSys, th )[1];
+
+            d    = np.dot( P, g );
+            step = self.saGain / ( kk + 1.0 )**self.saDecay;
+            n    = step * np.sqrt( np.dot( g, d ) );
+
+            if ( n > self.saMaxStep ):
+                step *= self.saMaxStep / n;
+
+            thPrev = th;
+            th     = th + step * d;
+
+            if ( kk >= self.maxIter / 2 ):
+                thSum += th;
+                gSum  += g;
+                nSum  += 1;
+
+        gMean          = gSum / nSum;
+        self.nIter     = self.maxIter;
+        self.converged = ( 0.5 * np.dot( gMean, np.dot( P, gMean ) ) < self.saTolerance );
+
+        return thSum / nSum;
+
+    ##########################################################################
+    # Estimate the Hessian by central differences of the gradient and return
+    # it together with the (regularised) negative inverse
+    ##########################################################################
+    def estimateCurvature(self,sm,sys,thSys,th):
+
+        H = np.zeros( ( self.nPars, self.nPars ) );
+
+        for rr in range( self.fdRepeats ):
+            for jj in range( self.nPars ):
+                h        = self.fdStep * np.max( ( 1.0, np.abs( th[jj] ) ) );
+                e        = np.zeros( self.nPars );
+                e[jj]    = h;
+
+                # Use the same random numbers for both points
+                seed     = np.random.randint( 0, 2**31 - 1 );
+                fp, gp   = self.evaluate( sm, sys, thSys, th + e, seed );
+                fm, gm   = self.evaluate( sm, sys, thSys, th - e, seed );
+
+                # Skip the parameter if both points are outside the support
+                if ( ( gp is None ) and ( gm is None ) ):
+                    continue;
+
+                if ( ( gp is None ) or ( gm is None ) ):
+                    # One-sided difference at the boundary of the support
+                    f0, g0 = self.evaluate( sm, sys, thSys, th, seed );
+
+                    if ( gp is None ):
+                        gp, h = g0, 0.5 * h;
+                    else:
+                        gm, h = g0, 0.5 * h;
+
+                H[:,jj] += ( gp - gm ) / ( 2.0 * h * self.fdRepeats );
+
+        H = 0.5 * ( H + H.transpose() );
+
+        # Mirror the eigenvalues if the Hessian is not negative definite
+        eigv, U = np.linalg.eigh( -H );
+
+        if ( np.min( eigv ) <= 0.0 ):
+            self.nMirrored += 1;
+            eigv = np.maximum( np.abs( eigv ), 1e-8 * np.max( np.abs( eigv ) ) );
+
+        return H, np.dot( U / eigv, U.transpose() );
+
+    ##########################################################################
+    # Helper: log-posterior and its gradient (None outside the support) in
+    # the parameters th used by the sampler, the seed is used if given
+    ##########################################################################
+    def evaluate(self,sm,sys,thSys,th,seed=None):
+
+        thSys.storeParameters( th, sys );
+        thSys.transform();
+
+        if ( thSys.priorUniform() == 0.0 ):
+            return -np.inf, None;
+
+        if ( seed != None ):
+            np.random.seed( seed );
+
+        sm.smoother( thSys );
+        self.nEvaluations += 1;
+
+        return sm.ll + thSys.prior() + thSys.Jacobian(), transformGradient( thSys, sm.gradient );
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
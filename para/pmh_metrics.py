@@ -0,0 +1,225 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy as np
+import json
+import time
+import sys
+
+##############################################################################
+# Running mean and variance (Welford) of the states of the chain together
+# with a batch means estimate of the ESS. The batch size is doubled (by
+# merging pairs of batches) when 2 * nBatches batches are full, so each
+# update costs O(1) and the memory is O(nBatches).
+##############################################################################
+
+class runningStatistics(object):
+
+    def __init__(self, nPars, nBatches=32):
+        self.n         = 0;
+        self.mean      = np.zeros(nPars);
+        self.M2        = np.zeros(nPars);
+
+        self.nBatches  = nBatches;
+        self.batchSize = 1;
+        self.nFull     = 0;
+        self.sums      = np.zeros((2*nBatches,nPars));
+        self.current   = np.zeros(nPars);
+        self.nCurrent  = 0;
+
+    ##########################################################################
+    # Add a new state
+    ##########################################################################
+    def push(self, x):
+
+        # Welford update of the mean and the sum of squares
+        self.n     += 1;
+        delta       = x - self.mean;
+        self.mean  += delta / self.n;
+        self.M2    += delta * ( x - self.mean );
+
+        # Add the state to the current batch
+        self.current  += x;
+        self.nCurrent += 1;
+
+        if ( self.nCurrent == self.batchSize ):
+            self.sums[self.nFull,:] = self.current;
+            self.nFull             += 1;
+            self.current[:]         = 0.0;
+            self.nCurrent           = 0;
+
+            # Merge pairs of batches when the storage is full
+            if ( self.nFull == 2 * self.nBatches ):
+                self.sums[0:self.nBatches,:] = self.sums[0::2,:] + self.sums[1::2,:];
+                self.sums[self.nBatches:,:]  = 0.0;
+                self.nFull                   = self.nBatches;
+                self.batchSize              *= 2;
+
+    ##########################################################################
+    # Variance and ESS estimates
+    ##########################################################################
+    def var(self):
+        if ( self.n < 2 ):
+            return np.zeros( len( self.mean ) ) * np.nan;
+        return self.M2 / ( self.n - 1.0 );
+
+    def ess(self):
+        if ( self.nFull < 2 ):
+            return np.zeros( len( self.mean ) ) * np.nan;
+
+        batchMeans = self.sums[0:self.nFull,:] / self.batchSize;
+        varBatch   = np.var( batchMeans, axis=0, ddof=1 );
+        nSamples   = self.nFull * self.batchSize;
+
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            return np.minimum( nSamples * self.var() / ( self.batchSize * varBatch ), nSamples );
+
+##############################################################################
+# Running mean and covariance of the states of the chain (Welford), each
+# update is a rank-one update costing O(d^2)
+##############################################################################
+
+class runningCovariance(object):
+
+    def __init__(self, nPars):
+        self.n    = 0;
+        self.mean = np.zeros(nPars);
+        self.C    = np.zeros((nPars,nPars));
+
+    def push(self, x):
+        self.n    += 1;
+        delta      = x - self.mean;
+        self.mean += delta / self.n;
+        self.C    += np.outer( delta, x - self.mean );
+
+    def cov(self):
+        return self.C / ( self.n - 1.0 );
+
+##############################################################################
+# Metrics sink: writes a JSON record per line with the progress of a chain
+# to a file (appending) or to stdout. Records are written at most once every
+# minInterval seconds. Other destinations are supported by overriding write.
+##############################################################################
+
+class metricsSink(object):
+
+    def __init__(self, fileName=None, minInterval=5.0, label=None):
+        self.fileName    = fileName;
+        self.minInterval = minInterval;
+        self.label       = label;
+        self.lastTime    = None;
+        self.lastIter    = None;
+        self.fileOut     = None;
+
+    # The open file is not copied to other processes or to checkpoints
+    def __getstate__(self):
+        state            = self.__dict__.copy();
+        state['fileOut'] = None;
+        return state;
+
+    ##########################################################################
+    # Write a record if minInterval seconds have passed since the last one
+    ##########################################################################
+    def update(self, pmh, force=False):
+        now = time.time();
+
+        if ( self.lastTime is None ):
+            self.lastTime = now;
+            self.lastIter = pmh.iter;
+
+            if ( not force ):
+                return None;
+
+        if ( ( not force ) and ( now - self.lastTime < self.minInterval ) ):
+            return None;
+
+        self.write( self.record( pmh, now ) );
+        self.lastTime = now;
+        self.lastIter = pmh.iter;
+
+    ##########################################################################
+    # Compile the record from the running statistics of the sampler
+    ##########################################################################
+    def record(self, pmh, now):
+        stats = pmh.runningStats;
+        rate  = np.nan;
+
+        if ( now > self.lastTime ):
+            rate = ( pmh.iter - self.lastIter ) / ( now - self.lastTime );
+
+        out = {
+            'label':               self.label,
+            'time':                now,
+            'iteration':           pmh.iter + 1,
+            'nIter':               pmh.nIter,
+            'iterationsPerSecond': toJSON( rate ),
+            'acceptanceRate':      toJSON( pmh.nAccepted / stats.n ),
+            'posteriorMean':       toJSON( stats.mean ),
+            'posteriorStd':        toJSON( np.sqrt( stats.var() ) ),
+            'ess':                 toJSON( stats.ess() ),
+            'stepSize':            toJSON( pmh.stepSize ),
+        };
+
+        if ( pmh.PMHtype == "qPMH2" ):
+            out['hessianMirrored'] = pmh.nHessianMirrored;
+            out['hessianReplaced'] = pmh.nHessianReplaced;
+            out['curvatureFixes']  = pmh.nCurvatureFixesSum;
+
+        out['outOfSupportFraction'] = toJSON( pmh.nOutOfSupport / stats.n );
+
+        if ( pmh.surrogate != None ):
+            out['screenedFraction'] = toJSON( pmh.nScreened / stats.n );
+
+        return out;
+
+    ##########################################################################
+    # Write the record as a line of JSON
+    ##########################################################################
+    def write(self, record):
+        line = json.dumps( record, sort_keys=True ) + "\n";
+
+        if ( self.fileName is None ):
+            sys.stdout.write( line );
+            sys.stdout.flush();
+        else:
+            if ( self.fileOut is None ):
+                self.fileOut = open( self.fileName, 'a' );
+            self.fileOut.write( line );
+            self.fileOut.flush();
+
+##############################################################################
+# Convert floats and arrays to JSON (non-finite values are written as null)
+##############################################################################
+def toJSON(x):
+    x = np.asarray( x, dtype=float );
+
+    if ( x.ndim == 0 ):
+        if ( np.isfinite( x ) ):
+            return float( x );
+        return None;
+
+    return [ toJSON( v ) for v in x ];
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
@@ -0,0 +1,232 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy           as     np
+import multiprocessing
+from   pmh             import stPMH
+from   pmh_helpers     import logsumexp, transformGradient
+from   pmh_parallel    import packEstimator, initialiseWorker, evaluateWorker, evaluateEstimator
+
+##############################################################################
+# Multiple-try PMH (Liu, Liang and Wong, 2000): nTries candidates are drawn
+# from the pPMH0, pPMH1 or qPMH2 proposal and their log-likelihoods (and
+# gradients) are estimated concurrently in a pool of processes. One candidate
+# is selected with probability proportional to its weight
+#
+#   w(y,x) = p(y) q(x|y),
+#
+# and accepted using a reference set drawn from the proposal at the selected
+# candidate. Each iteration runs the filter/smoother 2 * nTries - 1 times.
+##############################################################################
+
+class mtmPMH(stPMH):
+
+    # Number of candidates in each iteration and number of processes
+    # (default: one per candidate)
+    nTries     = 4;
+    nProcesses = None;
+
+    ##########################################################################
+    # Main sampling routine
+    ##########################################################################
+
+    def runSampler(self,sm,sys,thSys,PMHtype):
+
+        if ( self.surrogate != None ):
+            raise NameError("mtmPMH: delayed acceptance cannot be used together with multiple tries.");
+
+        # The workers keep copies of sm, so the candidates would not use the
+        # filters/smoothers of the fidelity schedule
+        if ( self.fidelitySchedule != None ):
+            raise NameError("mtmPMH: fidelitySchedule cannot be used together with multiple tries.");
+
+        self.sys          = sys;
+        self.candidates   = np.zeros( ( self.nTries, thSys.nParInference ) );
+        self.nFilterCalls = 0;
+
+        nProcesses = self.nProcesses;
+        if ( nProcesses is None ):
+            nProcesses = np.min( ( self.nTries, multiprocessing.cpu_count() ) );
+
+        self.pool = None;
+        if ( nProcesses > 1 ):
+            self.pool = multiprocessing.Pool( processes=nProcesses, initializer=initialiseWorker, initargs=( packEstimator(sm), sys, thSys ) );
+
+        try:
+            stPMH.runSampler( self, sm, sys, thSys, PMHtype );
+        finally:
+            if ( self.pool != None ):
+                self.pool.close();
+                self.pool.join();
+                self.pool = None;
+
+    ##########################################################################
+    # Sample the candidates
+    ##########################################################################
+    def sampleProposal(self,):
+
+        jj = self.proposalIndex( self.iter );
+
+        for kk in range( self.nTries ):
+            self.candidates[kk,:] = self.drawProposal( self.iter, jj );
+
+        self.thp[self.iter,:] = self.candidates[0,:];
+
+    ##########################################################################
+    # Calculate Acceptance Probability
+    ##########################################################################
+    def calculateAcceptanceProbability(self, sm,  thSys, ):
+
+        ii    = self.iter;
+        jj    = self.proposalIndex( ii );
+        K     = self.nTries;
+        drift = ( self.PMHtype == "pPMH1" ) | ( ( self.PMHtype == "qPMH2" ) & ( ii > self.memoryLength ) );
+
+        # The proposal from the current state and from new states (the
+        # Hessian estimate in qPMH2 only depends on the history of the chain)
+        if ( self.PMHtypeN == 2 ):
+            self.hessianp[ ii,:,: ] = self.lbfgs_hessian_update( );
+            self.checkHessian();
+            proposalX = self.proposal[jj];
+            proposalY = self.proposalp[ii];
+        else:
+            proposalX = self.proposalFixed;
+            proposalY = self.proposalFixed;
+
+        #=====================================================================
+        # Evaluate and select the candidates
+        #=====================================================================
+        llY, gradY, ngradY, priorY, logJY = self.evaluatePoints( sm, thSys, self.candidates );
+
+        logwY = np.zeros( K );
+        for kk in range( K ):
+            logwY[kk] = llY[kk] + priorY[kk] + logJY[kk] + self.logProposal( self.th[jj,:], self.candidates[kk,:], ngradY[kk,:], proposalY, drift );
+
+        logwY[ np.isnan( logwY ) ] = -np.inf;
+        sumY = logsumexp( logwY );
+
+        if ( not np.isfinite( sumY ) ):
+            self.aprob[ ii ] = 0.0;
+            return None;
+
+        J = np.random.choice( K, p=np.exp( logwY - sumY ) );
+        y = self.candidates[J,:];
+
+        #=====================================================================
+        # Evaluate the reference set (the last member is the current state)
+        #=====================================================================
+        ref = np.zeros( ( K-1, self.nPars ) );
+        for kk in range( K-1 ):
+            ref[kk,:] = self.sampleFrom( y, ngradY[J,:], proposalY, drift );
+
+        llX, gradX, ngradX, priorX, logJX = self.evaluatePoints( sm, thSys, ref );
+
+        logwX = np.zeros( K );
+        for kk in range( K-1 ):
+            logwX[kk] = llX[kk] + priorX[kk] + logJX[kk] + self.logProposal( y, ref[kk,:], ngradX[kk,:], proposalY, drift );
+
+        logwX[K-1] = self.ll[jj,0] + self.prior[jj,0] + self.J[jj,0] + self.logProposal( y, self.th[jj,:], self.ngradient[jj,:], proposalX, drift );
+        logwX[ np.isnan( logwX ) ] = -np.inf;
+
+        # Compute the acceptance probability
+        self.aprob[ ii ] = np.exp( sumY - logsumexp( logwX ) );
+
+        #=====================================================================
+        # Store the selected candidate
+        #=====================================================================
+        self.thp[ ii,: ]        = y;
+        self.llp[ ii ]          = llY[J];
+        self.gradientp[ ii,: ]  = gradY[J,:];
+        self.ngradientp[ ii,: ] = ngradY[J,:];
+        self.priorp[ ii ]       = priorY[J];
+        self.Jp[ ii ]           = logJY[J];
+        self.llDiff[ ii ]       = llY[J] - self.ll[jj,0];
+        thSys.storeParameters( y, self.sys );
+        thSys.transform();
+        self.thpo[ ii,: ]       = thSys.returnParameters();
+
+    ##########################################################################
+    # Estimate the log-likelihood, gradient and log-prior at the points th
+    ##########################################################################
+    def evaluatePoints(self, sm, thSys, th):
+
+        n      = th.shape[0];
+        smooth = ( self.PMHtypeN != 0 );
+        seeds  = np.random.randint( 0, 2**31 - 1, size=n );
+        tasks  = [ ( th[kk,:], seeds[kk], smooth ) for kk in range(n) ];
+
+        if ( self.pool != None ):
+            results = self.pool.map( evaluateWorker, tasks );
+        else:
+            state   = np.random.get_state();
+            results = [ evaluateEstimator( sm, thSys, self.sys, task[0], task[1], task[2] ) for task in tasks ];
+            np.random.set_state( state );
+
+        ll    = np.zeros( n );
+        grad  = np.zeros( ( n, self.nPars ) );
+        ngrad = np.zeros( ( n, self.nPars ) );
+        prior = np.zeros( n );
+        logJ  = np.zeros( n );
+
+        for kk in range( n ):
+            thSys.storeParameters( th[kk,:], self.sys );
+            thSys.transform();
+
+            # The filter/smoother is not run outside the support of the prior
+            if ( thSys.priorUniform() == 0.0 ):
+                ll[kk] = -np.inf;
+                continue;
+
+            self.nFilterCalls += 1;
+            ll[kk]    = results[kk][0];
+            prior[kk] = thSys.prior();
+            logJ[kk]  = thSys.Jacobian();
+
+            if ( smooth ):
+                grad[kk,:] = transformGradient( thSys, results[kk][1] );
+
+            if ( self.PMHtypeN == 1 ):
+                ngrad[kk,:] = np.dot( self.invHessian, grad[kk,:] );
+            elif ( self.PMHtypeN == 2 ):
+                ngrad[kk,:] = np.dot( grad[kk,:], self.hessianp[ self.iter,:,: ] );
+
+        ll[ np.isnan( ll ) ] = -np.inf;
+
+        return ll, grad, ngrad, prior, logJ;
+
+    ##########################################################################
+    # Helpers: density of and sample from the proposal at thFrom
+    ##########################################################################
+    def logProposal(self, thTo, thFrom, ngradFrom, proposal, drift):
+        if ( drift ):
+            thFrom = thFrom + 0.5 * self.stepSize**2 * ngradFrom;
+        return proposal.logpdf( thTo, thFrom, self.stepSize );
+
+    def sampleFrom(self, thFrom, ngradFrom, proposal, drift):
+        if ( drift ):
+            thFrom = thFrom + 0.5 * self.stepSize**2 * ngradFrom;
+        return proposal.sample( thFrom, self.stepSize );
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
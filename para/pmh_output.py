@@ -0,0 +1,196 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy       as     np
+import json
+import os
+import threading
+import pandas
+from   pmh_helpers import ensure_dir
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+##############################################################################
+# Binary chain files: a JSON header (padded with spaces to headerSize bytes)
+# with the column labels and the number of rows, followed by the rows of
+# the chain as little-endian float64. The file can be appended to and
+# memory-mapped when loading.
+##############################################################################
+
+headerSize = 4096;
+dataType   = '<f8';
+
+def writeHeader(f, columns, nRows):
+    header = json.dumps( { 'format': 'pmh-chain', 'version': 1, 'columns': list(columns), 'dtype': dataType, 'nRows': int(nRows), 'headerSize': headerSize } );
+
+    if ( len( header ) + 1 > headerSize ):
+        raise NameError("writeHeader: too many columns to fit in the header.");
+
+    f.seek( 0 );
+    f.write( ( header + " " * ( headerSize - len( header ) - 1 ) + "\n" ).encode('ascii') );
+
+def readHeader(f):
+    f.seek( 0 );
+    header = json.loads( f.read( headerSize ).decode('ascii') );
+
+    if ( header.get( 'format' ) != 'pmh-chain' ):
+        raise NameError("readHeader: the file is not a binary chain file.");
+
+    return header;
+
+##############################################################################
+# Writer that appends blocks of rows from a background thread
+##############################################################################
+
+class chainWriter(object):
+
+    def __init__(self, fileName, columns, resume=False, maxPending=4):
+        self.fileName = fileName;
+        self.columns  = list(columns);
+        self.nRows    = 0;
+        self.error    = None;
+
+        if ( resume and os.path.exists( fileName ) ):
+            # Continue writing to an existing file
+            self.fileOut = open( fileName, 'r+b' );
+            header       = readHeader( self.fileOut );
+
+            if ( header['columns'] != self.columns ):
+                self.fileOut.close();
+                raise NameError("chainWriter: the columns do not match the existing file " + fileName + ".");
+
+            self.nRows = header['nRows'];
+        else:
+            ensure_dir( fileName );
+            self.fileOut = open( fileName, 'w+b' );
+            writeHeader( self.fileOut, self.columns, 0 );
+
+        # The blocks are written in the order they are submitted, at most
+        # maxPending blocks are waiting at any time
+        self.pending = queue.Queue( maxsize=maxPending );
+        self.thread  = threading.Thread( target=self.run );
+        self.thread.daemon = True;
+        self.thread.start();
+
+    ##########################################################################
+    # Submit the rows block (copied) to be written starting at startRow
+    ##########################################################################
+    def write(self, startRow, block):
+        self.checkError();
+        self.pending.put( ( startRow, np.array( block, dtype=dataType ) ) );
+
+    ##########################################################################
+    # Wait for the pending blocks and close the file
+    ##########################################################################
+    def close(self):
+        self.pending.put( None );
+        self.thread.join();
+        self.fileOut.close();
+        self.checkError();
+
+    def checkError(self):
+        if ( self.error != None ):
+            raise NameError("chainWriter: writing to " + self.fileName + " failed: " + str( self.error ));
+
+    ##########################################################################
+    # Background thread
+    ##########################################################################
+    def run(self):
+        while True:
+            task = self.pending.get();
+
+            if ( task is None ):
+                break;
+
+            if ( self.error != None ):
+                continue;
+
+            startRow, block = task;
+
+            try:
+                if ( block.shape[1] != len( self.columns ) ):
+                    raise ValueError("wrong number of columns.");
+
+                self.fileOut.seek( headerSize + startRow * len( self.columns ) * block.itemsize );
+                self.fileOut.write( np.ascontiguousarray( block ).tobytes() );
+
+                # Update the number of rows when the data is written
+                self.nRows = startRow + block.shape[0];
+                self.fileOut.flush();
+                writeHeader( self.fileOut, self.columns, self.nRows );
+                self.fileOut.flush();
+            except Exception as e:
+                self.error = e;
+
+##############################################################################
+# Write the rows out to fileName
+##############################################################################
+def writeChain(fileName, columns, out):
+    writer = chainWriter( fileName, columns );
+    writer.write( 0, out );
+    writer.close();
+
+##############################################################################
+# Load a binary chain file, the rows are memory-mapped
+##############################################################################
+def loadChain(fileName):
+    f = open( fileName, 'rb' );
+    try:
+        header = readHeader( f );
+    finally:
+        f.close();
+
+    return chainData( fileName, header );
+
+class chainData(object):
+
+    def __init__(self, fileName, header):
+        self.columns = header['columns'];
+        shape        = ( header['nRows'], len( self.columns ) );
+
+        if ( header['nRows'] > 0 ):
+            self.data = np.memmap( fileName, dtype=header['dtype'], mode='r', offset=header['headerSize'], shape=shape );
+        else:
+            self.data = np.zeros( shape );
+
+    # The column with label name
+    def __getitem__(self, name):
+        return self.data[ :, self.columns.index( name ) ];
+
+    def __len__(self):
+        return self.data.shape[0];
+
+    def toDataFrame(self):
+        return pandas.DataFrame( np.asarray( self.data ), columns=self.columns );
+
+    # Export to CSV in the same format as writeToFile
+    def toCSV(self, fileName):
+        ensure_dir( fileName );
+        self.toDataFrame().to_csv( fileName );
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
@@ -0,0 +1,279 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy           as     np
+import multiprocessing
+import copy
+from   scipy.stats     import norm, rankdata
+from   pmh_helpers     import calcIACTs, calcESSs
+
+##############################################################################
+# Main class: runs independent PMH chains in a pool of processes
+##############################################################################
+
+class parallelPMH(object):
+
+    # Number of chains and number of processes (default: one per chain)
+    nChains    = 4;
+    nProcesses = None;
+
+    # Seed for the master random number generator
+    seed       = None;
+
+    # Covariance for dispersing the initial parameters of the chains
+    # (defaults to invHessian or the initial Hessian of the template)
+    initCov    = None;
+
+    ##########################################################################
+    # Main sampling routine
+    ##########################################################################
+
+    def runSampler(self,pmh,sm,sys,thSys,PMHtype):
+
+        # The settings of the chains are taken from the stPMH object pmh
+        self.PMHtype = PMHtype;
+        self.nPars   = thSys.nParInference;
+        self.nBurnIn = pmh.nBurnIn;
+        self.nIter   = pmh.nIter;
+
+        # Draw independent seeds and dispersed initial parameters
+        rng          = np.random.RandomState( self.seed );
+        self.seeds   = rng.randint( 0, 2**31 - 1, size=self.nChains );
+        self.initPar = self.disperseInitialParameters( rng, pmh, sys, thSys );
+
+        # Construct the tasks, bound methods of the estimator are
+        # passed by name as they cannot be pickled
+        smPacked = packEstimator(sm);
+        tasks    = [ ( pmh, smPacked, sys, thSys, PMHtype, self.seeds[ii], self.initPar[ii,:], ii ) for ii in range(self.nChains) ];
+
+        nProcesses = self.nProcesses;
+        if ( nProcesses is None ):
+            nProcesses = np.min( ( self.nChains, multiprocessing.cpu_count() ) );
+
+        if ( nProcesses > 1 ):
+            pool        = multiprocessing.Pool( processes=nProcesses );
+            self.chains = pool.map( runChain, tasks );
+            pool.close();
+            pool.join();
+        else:
+            self.chains = [ runChain( task ) for task in tasks ];
+
+        # Pool the output after burn-in and compute convergence diagnostics
+        self.thChains = np.array( [ chain.th[self.nBurnIn:self.nIter,:] for chain in self.chains ] );
+        self.th       = self.thChains.reshape( ( -1, self.nPars ) );
+        self.calcDiagnostics();
+
+        print("parallelPMH: completed " + str(self.nChains) + " chains of " + PMHtype + " using " + str(nProcesses) + " processes.");
+        print(" split-Rhat: " + str( ["%.3f" % v for v in self.Rhat] ) );
+        print(" bulk-ESS:   " + str( ["%.1f" % v for v in self.essBulk] ) );
+        print(" tail-ESS:   " + str( ["%.1f" % v for v in self.essTail] ) );
+
+    ##########################################################################
+    # Draw initial parameters around pmh.initPar inside the support
+    ##########################################################################
+
+    def disperseInitialParameters(self, rng, pmh, sys, thSys):
+
+        initCov = self.initCov;
+        if ( initCov is None ):
+            if ( hasattr( pmh, 'invHessian' ) ):
+                initCov = pmh.invHessian;
+            else:
+                initCov = np.eye( self.nPars ) / pmh.epsilon;
+
+        out = np.zeros( ( self.nChains, self.nPars ) );
+
+        for ii in range( self.nChains ):
+            while True:
+                out[ii,:] = rng.multivariate_normal( pmh.initPar, initCov );
+                thSys.storeParameters( out[ii,:], sys );
+
+                if ( thSys.priorUniform() == 1.0 ):
+                    break;
+
+        thSys.storeParameters( pmh.initPar, sys );
+        return out;
+
+    ##########################################################################
+    # Compute split-Rhat, bulk-ESS and tail-ESS for each parameter
+    ##########################################################################
+
+    def calcDiagnostics(self):
+        self.Rhat    = np.zeros( self.nPars );
+        self.essBulk = np.zeros( self.nPars );
+        self.essTail = np.zeros( self.nPars );
+
+        for ii in range( self.nPars ):
+            self.Rhat[ii]    = splitRhat( self.thChains[:,:,ii] );
+            self.essBulk[ii] = essBulk( self.thChains[:,:,ii] );
+            self.essTail[ii] = essTail( self.thChains[:,:,ii] );
+
+        return self.Rhat, self.essBulk, self.essTail;
+
+    ##########################################################################
+    # Compute the IACT for each parameter using all the chains
+    ##########################################################################
+
+    def calcIACT(self, method="geyer"):
+        return calcIACTs( self.thChains, method );
+
+##############################################################################
+# Run a single chain (executed in the worker processes)
+##############################################################################
+def runChain(task):
+    pmh, smPacked, sys, thSys, PMHtype, seed, initPar, chain = task;
+
+    pmh         = copy.deepcopy( pmh );
+    pmh.initPar = np.array( initPar, copy=True );
+
+    # Write the checkpoints of the chains to separate files
+    if ( getattr( pmh, 'checkpointFile', None ) != None ):
+        pmh.checkpointFile = pmh.checkpointFile + ".chain" + str(chain);
+
+    # Write the output of the chains to separate files
+    if ( getattr( pmh, 'outputFile', None ) != None ):
+        pmh.outputFile = pmh.outputFile + ".chain" + str(chain);
+
+    # Label the metrics of the chains
+    if ( getattr( pmh, 'metrics', None ) != None ):
+        pmh.metrics.label = chain;
+    sm          = unpackEstimator( smPacked );
+
+    np.random.seed( seed );
+    pmh.runSampler( sm, sys, thSys, PMHtype );
+
+    return pmh;
+
+##############################################################################
+# Pack and unpack a filter/smoother object for sending it to another
+# process, the filter and smoother (and the batched filter/smoother if set)
+# are stored by name
+##############################################################################
+def packEstimator(sm):
+    state   = dict( ( key, value ) for ( key, value ) in sm.__dict__.items() if not callable( value ) );
+    batched = dict( ( key, getattr( sm, key ).__name__ ) for key in ( 'filterBatch', 'smootherBatch' ) if ( getattr( sm, key, None ) != None ) );
+    return ( sm.__class__, state, sm.filter.__name__, sm.smoother.__name__, batched );
+
+def unpackEstimator(packed):
+    return restoreEstimator( packed[0](), packed );
+
+def restoreEstimator(sm, packed):
+    smClass, state, filterName, smootherName = packed[0:4];
+
+    if ( not isinstance( sm, smClass ) ):
+        raise NameError("restoreEstimator: the filter/smoother is not of the same class as the stored one.");
+
+    sm.__dict__.update( copy.deepcopy( state ) );
+    sm.filter   = getattr( sm, filterName );
+    sm.smoother = getattr( sm, smootherName );
+
+    # Older checkpoints do not store the batched filter/smoother
+    if ( len( packed ) > 4 ):
+        for key, name in packed[4].items():
+            setattr( sm, key, getattr( sm, name ) );
+
+    return sm;
+
+##############################################################################
+# Run the filter (or smoother if smooth is True) at the parameters thp using
+# the seed and return the log-likelihood and gradient estimates
+##############################################################################
+def evaluateEstimator(sm, thSys, sys, thp, seed, smooth):
+    thSys.storeParameters( thp, sys );
+    thSys.transform();
+
+    # The filter/smoother is not run outside the support of the prior
+    if ( thSys.priorUniform() == 0.0 ):
+        return ( -np.inf, None );
+
+    np.random.seed( seed );
+
+    if ( smooth ):
+        sm.smoother(thSys);
+        return ( sm.ll, np.array( sm.gradient, copy=True ) );
+    else:
+        sm.filter(thSys);
+        return ( sm.ll, None );
+
+##############################################################################
+# Worker processes: keep a copy of the estimator and the model
+##############################################################################
+workerState = {};
+
+def initialiseWorker(smPacked, sys, thSys):
+    workerState['sm']    = unpackEstimator( smPacked );
+    workerState['sys']   = sys;
+    workerState['thSys'] = thSys;
+
+def evaluateWorker(task):
+    thp, seed, smooth = task;
+    return evaluateEstimator( workerState['sm'], workerState['thSys'], workerState['sys'], thp, seed, smooth );
+
+##############################################################################
+# Convergence diagnostics for x (nChains, nSamples) following
+# Vehtari, Gelman, Simpson, Carpenter and Burkner (2021)
+##############################################################################
+def splitChains(x):
+    n = int( np.floor( x.shape[1] / 2.0 ) );
+    return np.vstack( ( x[:,0:n], x[:,(x.shape[1]-n):] ) );
+
+def rankNormalise(x):
+    r = rankdata( x.ravel() ).reshape( x.shape );
+    return norm.ppf( ( r - 0.375 ) / ( x.size + 0.25 ) );
+
+def rhat(x):
+    n   = x.shape[1];
+    B   = n * np.var( np.mean( x, axis=1 ), ddof=1 );
+    W   = np.mean( np.var( x, axis=1, ddof=1 ) );
+    return np.sqrt( ( ( n - 1.0 ) / n * W + B / n ) / W );
+
+def splitRhat(x):
+    x      = splitChains( np.asarray( x, dtype=float ) );
+    folded = np.abs( x - np.median( x ) );
+    return np.max( ( rhat( rankNormalise( x ) ), rhat( rankNormalise( folded ) ) ) );
+
+def essBulk(x):
+    return ess( rankNormalise( splitChains( np.asarray( x, dtype=float ) ) ) );
+
+def essTail(x):
+    x   = splitChains( np.asarray( x, dtype=float ) );
+    q05 = ess( ( x <= np.percentile( x, 5.0 ) ).astype(float) );
+    q95 = ess( ( x <= np.percentile( x, 95.0 ) ).astype(float) );
+    return np.min( ( q05, q95 ) );
+
+##############################################################################
+# Multi-chain ESS using Geyer's initial monotone sequence estimator (the
+# same estimator as calcESSs with method geyer)
+##############################################################################
+def ess(x):
+    m, n = x.shape;
+
+    # A constant chain is treated as independent samples
+    if ( np.max( x ) - np.min( x ) < np.finfo(float).resolution ):
+        return float( m * n );
+
+    return calcESSs( x[:,:,np.newaxis], method="geyer" )[0];
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
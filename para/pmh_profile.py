@@ -0,0 +1,219 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy as np
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None;
+
+# Use the high resolution clock if available
+timer = getattr( time, 'perf_counter', time.time );
+
+##############################################################################
+# Profiler for the phases of a PMH iteration. The hooks of the sampler, the
+# filter/smoother and the model are replaced by timed wrappers (as instance
+# attributes) when the profiler is attached and restored when detached, so
+# nothing is added to the sampler when the profiler is not used.
+#
+# The times are inclusive, e.g. the time of sm.smoother includes the calls
+# to sm.filter and sm.resampleSystematic that are made by the smoother.
+# Hooks that are aliases of another method (e.g. km.filter = km.kf) are
+# labelled by the name of the method, so sm.kf counts the calls through
+# km.filter together with the calls made by km.rts.
+##############################################################################
+
+class profiler(object):
+
+    # Hooks to wrap on the sampler, the filter/smoother (also used for the
+    # surrogate) and the model (the ones that do not exist are skipped)
+    hooksSampler   = ( "sampleProposal", "calculateAcceptanceProbability", "lbfgs_hessian_update", "extractUniqueElements", "checkHessian" );
+    hooksEstimator = ( "filter", "smoother", "pf", "flPS", "resampleSystematic", "kf", "rts" );
+    hooksModel     = ( "prior", );
+
+    def __init__(self, memory=False):
+
+        # Record the peak memory allocated during the calls (tracemalloc)
+        self.memory = memory;
+
+        if ( self.memory and ( ( tracemalloc is None ) or ( not hasattr( tracemalloc, 'reset_peak' ) ) ) ):
+            raise NameError("profiler: tracing the memory requires tracemalloc with reset_peak (Python 3.9 or later).");
+
+        self.calls    = {};
+        self.peaks    = {};
+        self.order    = [];
+        self.wrapped  = [];
+        self.stack    = [];
+        self.runTime  = 0.0;
+
+    ##########################################################################
+    # Wrap the hooks of the sampler pmh, the filter/smoother sm and the
+    # model thSys
+    ##########################################################################
+    def attach(self, pmh, sm, thSys):
+
+        for name in self.hooksSampler:
+            self.wrap( pmh, name, name );
+
+        for name in self.hooksEstimator:
+            self.wrap( sm, name, "sm." + methodName( sm, name ) );
+
+        if ( pmh.surrogate != None ):
+            for name in self.hooksEstimator:
+                self.wrap( pmh.surrogate, name, "surrogate." + methodName( pmh.surrogate, name ) );
+
+        for name in self.hooksModel:
+            self.wrap( thSys, name, "thSys." + name );
+
+        self.startedTracing = False;
+        if ( self.memory and ( not tracemalloc.is_tracing() ) ):
+            tracemalloc.start();
+            self.startedTracing = True;
+
+        self.startTime = timer();
+
+    def wrap(self, obj, name, label):
+        if ( not hasattr( obj, name ) ):
+            return None;
+
+        # Keep the instance attribute (if any) to restore it when detaching
+        old = obj.__dict__.get( name, None );
+        self.wrapped.append( ( obj, name, old ) );
+        setattr( obj, name, timedCall( self, label, getattr( obj, name ) ) );
+
+        if ( label not in self.calls ):
+            self.calls[label] = [];
+            self.peaks[label] = 0;
+            self.order.append( label );
+
+    ##########################################################################
+    # Restore the hooks
+    ##########################################################################
+    def detach(self):
+        self.runTime += timer() - self.startTime;
+
+        for ( obj, name, old ) in reversed( self.wrapped ):
+            if ( old is None ):
+                delattr( obj, name );
+            else:
+                setattr( obj, name, old );
+
+        self.wrapped = [];
+
+        if ( self.startedTracing ):
+            tracemalloc.stop();
+
+    ##########################################################################
+    # Record a call (called by the wrappers)
+    ##########################################################################
+    def call(self, label, func, args, kwargs):
+
+        if ( self.memory ):
+            current = tracemalloc.get_traced_memory()[0];
+            tracemalloc.reset_peak();
+            self.stack.append( 0 );
+
+        start = timer();
+        try:
+            return func( *args, **kwargs );
+        finally:
+            self.calls[label].append( timer() - start );
+
+            if ( self.memory ):
+                # The peaks of nested calls are included as reset_peak
+                # discards the peak before the nested call started
+                peak = np.max( ( tracemalloc.get_traced_memory()[1], self.stack.pop() ) );
+                self.peaks[label] = np.max( ( self.peaks[label], peak - current ) );
+
+                if ( len( self.stack ) > 0 ):
+                    self.stack[-1] = np.max( ( self.stack[-1], peak ) );
+
+    ##########################################################################
+    # Compile and print the summary
+    ##########################################################################
+    def summary(self):
+        out = [];
+
+        for label in self.order:
+            times = np.array( self.calls[label] );
+
+            if ( len( times ) == 0 ):
+                continue;
+
+            p50, p90, p99 = np.percentile( times, ( 50.0, 90.0, 99.0 ) );
+            out.append( { 'hook': label, 'calls': len( times ), 'total': np.sum( times ),
+                          'fraction': np.sum( times ) / self.runTime, 'mean': np.mean( times ),
+                          'p50': p50, 'p90': p90, 'p99': p99, 'peak': self.peaks[label] } );
+
+        return out;
+
+    def printSummary(self):
+        header = "%-32s %8s %10s %7s %10s %10s %10s %10s" % ( "hook", "calls", "total [s]", "% run", "mean [ms]", "p50 [ms]", "p90 [ms]", "p99 [ms]" );
+        if ( self.memory ):
+            header += " %12s" % "peak [kB]";
+
+        print("################################################################################################ ");
+        print(" Profile of the sampler (inclusive times), total run time: " + "%.2f" % self.runTime + " s");
+        print("");
+        print(header);
+
+        for row in self.summary():
+            line = "%-32s %8d %10.3f %7.1f %10.3f %10.3f %10.3f %10.3f" % ( row['hook'], row['calls'], row['total'], 100.0 * row['fraction'], 1e3 * row['mean'], 1e3 * row['p50'], 1e3 * row['p90'], 1e3 * row['p99'] );
+            if ( self.memory ):
+                line += " %12.1f" % ( row['peak'] / 1024.0 );
+            print(line);
+
+        print("################################################################################################ ");
+
+##############################################################################
+# Name of the method that the attribute name of obj refers to, so that the
+# calls through an alias (e.g. km.filter = km.kf) are recorded together
+# with the direct calls of the method (e.g. from km.rts)
+##############################################################################
+def methodName(obj, name):
+    method = getattr( obj, name, None );
+
+    if ( getattr( method, '__self__', None ) is obj ):
+        return getattr( method.__func__, '__name__', name );
+
+    return name;
+
+##############################################################################
+# Wrapper that forwards the call to the profiler
+##############################################################################
+class timedCall(object):
+
+    def __init__(self, prof, label, func):
+        self.prof     = prof;
+        self.label    = label;
+        self.func     = func;
+        self.__name__ = getattr( func, '__name__', label );
+
+    def __call__(self, *args, **kwargs):
+        return self.prof.call( self.label, self.func, args, kwargs );
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
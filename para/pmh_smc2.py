@@ -0,0 +1,460 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy           as     np
+import multiprocessing
+import copy
+from   pmh_helpers     import logsumexp, lognormpdf
+from   pmh_parallel    import packEstimator, initialiseWorker, workerState
+from   state.smc       import resampleSystematic
+
+##############################################################################
+# SMC^2 (Chopin, Jacob and Papaspiliopoulos, 2013) using the particle filter
+# sm (an smcSampler with filter bPF or faPF). A population of nParticles
+# parameters is weighted by the log-likelihood increments of their own
+# particle filters as the observations are processed one at a time (using
+# pfStep). When the ESS drops below essThreshold * nParticles, the parameters
+# are resampled and moved by nMoves iterations of the PMH kernel PMHtype
+# (pPMH0, pPMH1 or qPMH2) with the settings of the stPMH object pmh,
+# targeting the posterior given the observations so far. If the acceptance
+# rate of the moves is below acceptanceThreshold, the number of particles in
+# the filters is doubled (up to maxPart) and the parameters are reweighted
+# by the new log-likelihood estimates (the exchange step).
+#
+# The initial parameters are drawn from a Gaussian (in the transformed
+# parameters) around pmh.initPar with covariance initCov (pmh.invHessian if
+# None) and weighted by the prior. The covariance of the population is used
+# as invHessian in the moves (if useParticleCovariance), and the log-
+# likelihood estimate of the current parameters is kept in the moves while
+# the gradient (for pPMH1 and qPMH2) is estimated again. The filters and
+# the moves of the parameters are run in a pool of nProcesses processes.
+#
+# For qPMH2, the quasi-Newton proposal is only used after memoryLength
+# iterations of each move, so memoryLength (pmh.memoryLength if None) must
+# be smaller than nMoves, i.e. the qPMH2 moves need a longer inner chain
+# (or a shorter memory) than the settings used for a full run. The BFGS
+# update also needs more than two unique states in the memory, e.g.
+# memoryLength = 8 and nMoves = 20. The covariance of the population is
+# used as the initial Hessian estimate (initialHessian and epsilon) of the
+# moves, which is also the proposal before the BFGS update is available.
+#
+# The marginal likelihood estimates and the posterior means/variances (of
+# the original parameters) after each observation are stored, and new
+# observations can be processed by calling processObservation (after
+# adding them to the data of sys and thSys).
+##############################################################################
+
+class smc2Sampler(object):
+
+    # Number of parameters and the settings of the resample-move steps
+    nParticles            = 100;
+    essThreshold          = 0.5;
+    nMoves                = 5;
+    useParticleCovariance = True;
+    initCov               = None;
+
+    # Memory length of the qPMH2 moves (pmh.memoryLength if None)
+    memoryLength          = None;
+
+    # Adapt the number of particles in the filters
+    adaptNPart            = True;
+    acceptanceThreshold   = 0.2;
+    maxPart               = 2000;
+
+    # Number of processes (all cores if None) and the seed
+    nProcesses            = 1;
+    seed                  = None;
+
+    # Print a progress report every progressInterval observations (and at
+    # each resample-move step), not used if None
+    progressInterval      = 50;
+
+    ##########################################################################
+    # Main sampling routine
+    ##########################################################################
+
+    def runSampler(self,pmh,sm,sys,thSys,PMHtype):
+
+        self.initialiseSampler( pmh, sm, sys, thSys, PMHtype );
+
+        for tt in range( 1, sys.T ):
+            self.processObservation( tt );
+
+        self.finishSampler();
+
+    ##########################################################################
+    # Draw the initial parameters and run the filters on the first observation
+    ##########################################################################
+    def initialiseSampler(self,pmh,sm,sys,thSys,PMHtype):
+
+        if ( not hasattr( sm, 'pfStep' ) ):
+            raise NameError("smc2Sampler: the filter/smoother must be a particle filter (smcSampler) with pfStep.");
+
+        self.sys     = sys;
+        self.thSys   = thSys;
+        self.PMHtype = PMHtype;
+        self.nPars   = thSys.nParInference;
+        self.nPart   = sm.nPart;
+        self.rng     = np.random.RandomState( self.seed );
+        self.sm      = sm;
+        self.pool    = None;
+
+        if ( self.nProcesses is None ):
+            self.nProcesses = multiprocessing.cpu_count();
+
+        if ( self.nProcesses > 1 ):
+            self.pool = multiprocessing.Pool( processes=self.nProcesses, initializer=initialiseWorker, initargs=( packEstimator(sm), sys, thSys ) );
+
+        # The settings of the moves are taken from the stPMH object pmh
+        self.chain = copy.deepcopy( pmh );
+        self.chain.nIter            = self.nMoves + 1;
+        self.chain.nBurnIn          = self.nMoves + 1;
+        self.chain.progressInterval = None;
+
+        for name in ( "surrogate", "checkpointFile", "targetESS", "metrics", "profiler", "outputFile", "fidelitySchedule" ):
+            setattr( self.chain, name, None );
+
+        self.chain.adaptStepSize    = False;
+        self.chain.adaptProposal    = False;
+
+        if ( PMHtype == "qPMH2" ):
+            if ( self.memoryLength != None ):
+                self.chain.memoryLength = self.memoryLength;
+
+            if ( self.chain.memoryLength >= self.nMoves ):
+                raise NameError("smc2Sampler: the qPMH2 moves require nMoves > memoryLength (the quasi-Newton proposal is used after memoryLength iterations), got nMoves = " + str(self.nMoves) + " and memoryLength = " + str(self.chain.memoryLength) + ".");
+
+        # Draw the initial parameters (in the transformed parameters)
+        initCov = self.initCov;
+        if ( initCov is None ):
+            initCov = pmh.invHessian;
+
+        thSys.storeParameters( pmh.initPar, sys );
+        thSys.invTransform();
+        initMean = thSys.returnParameters();
+
+        self.th = self.rng.multivariate_normal( initMean, initCov, size=self.nParticles );
+        self.logW = np.zeros( self.nParticles );
+
+        for ii in range( self.nParticles ):
+            thSys.storeParameters( self.th[ii,:], sys );
+            thSys.transform();
+
+            # Importance weights for the prior
+            if ( thSys.priorUniform() == 0.0 ):
+                self.logW[ii] = -np.inf;
+            else:
+                self.logW[ii] = thSys.prior() + thSys.Jacobian() - lognormpdf( self.th[ii,:], initMean, initCov );
+
+        # Storage for the output after each observation
+        self.logEvidence           = np.zeros( sys.T );
+        self.logMarginalLikelihood = np.zeros( sys.T );
+        self.thMean                = np.zeros( ( sys.T, self.nPars ) );
+        self.thVar                 = np.zeros( ( sys.T, self.nPars ) );
+        self.ess                   = np.zeros( sys.T );
+        self.nPartHistory          = np.zeros( sys.T );
+        self.resampled             = np.zeros( sys.T );
+        self.moveTimes             = [];
+        self.acceptRate            = [];
+
+        # Normalising constant of the weights at the last resampling
+        self.logZ = np.log( np.mean( np.exp( self.logW - np.max( self.logW ) ) ) ) + np.max( self.logW );
+        self.logW = self.logW - self.logZ;
+
+        # Run the filters on the first observation
+        out = self.mapParticles( filterParticle, [ ( self.th[ii,:], 0, self.rng.randint( 0, 2**31 - 1 ), self.nPart ) for ii in range( self.nParticles ) ] );
+
+        self.ll     = np.array( [ ll for ( ll, state ) in out ] );
+        self.states = [ state for ( ll, state ) in out ];
+
+        self.updateWeights( 0, self.ll );
+
+    ##########################################################################
+    # Process observation tt
+    ##########################################################################
+    def processObservation(self,tt):
+
+        out = self.mapParticles( stepParticle, [ ( self.th[ii,:], self.states[ii], tt, self.rng.randint( 0, 2**31 - 1 ), self.nPart ) for ii in range( self.nParticles ) ] );
+
+        self.states = [ state for ( state, llInc ) in out ];
+        llInc       = np.array( [ llInc for ( state, llInc ) in out ] );
+        self.ll    += llInc;
+
+        self.updateWeights( tt, llInc );
+
+    ##########################################################################
+    # Add the log-likelihood increments to the weights, store the output and
+    # run a resample-move step if the ESS is too small
+    ##########################################################################
+    def updateWeights(self,tt,llInc):
+
+        # Incremental marginal likelihood p(y_tt | y_0,...,y_tt-1)
+        logWp                = self.logW + llInc;
+        self.logEvidence[tt] = logsumexp( logWp ) - logsumexp( self.logW );
+        self.logW            = logWp;
+
+        self.logMarginalLikelihood[tt] = self.logZ + logsumexp( self.logW ) - np.log( self.nParticles );
+        self.ess[tt]                   = self.calcESS();
+        self.nPartHistory[tt]          = self.nPart;
+
+        if ( self.ess[tt] < self.essThreshold * self.nParticles ):
+            self.resampleMove( tt );
+            self.resampled[tt] = 1.0;
+
+        self.thMean[tt,:], self.thVar[tt,:] = self.calcPosteriorMoments();
+
+        if ( ( self.progressInterval != None ) and ( np.remainder( tt, self.progressInterval ) == 0 ) ):
+            print("smc2Sampler: observation " + str(tt) + " of " + str(self.sys.T) + ", ESS: " + "%.1f" % self.ess[tt] + ", log-marginal likelihood: " + "%.2f" % self.logMarginalLikelihood[tt] + ", posterior mean: " + str( np.round( self.thMean[tt,:], 3 ) ) );
+
+    ##########################################################################
+    # Resample the parameters and move them using the PMH kernel
+    ##########################################################################
+    def resampleMove(self,tt):
+
+        w   = self.weights();
+        idx = resampleSystematic( w, u=self.rng.uniform() );
+
+        # Covariance of the population for the proposal
+        if ( self.useParticleCovariance ):
+            mu = np.dot( w, self.th );
+            self.chain.invHessian = np.dot( ( self.th - mu ).transpose() * w, self.th - mu );
+
+            if ( self.PMHtype == "qPMH2" ):
+                self.chain.initialHessian = self.chain.invHessian;
+                self.chain.epsilon        = 1.0 / np.min( np.linalg.eigvalsh( self.chain.invHessian ) );
+
+        # Keep the marginal likelihood estimate and reset the weights
+        self.logZ   = self.logZ + logsumexp( self.logW ) - np.log( self.nParticles );
+        self.logW   = np.zeros( self.nParticles );
+        self.th     = self.th[idx,:];
+        self.ll     = self.ll[idx];
+        self.states = [ self.states[ii] for ii in idx ];
+
+        # Move the parameters
+        out = self.mapParticles( moveParticle, [ ( self.chain, self.PMHtype, self.th[ii,:], self.ll[ii], self.states[ii], tt, self.rng.randint( 0, 2**31 - 1 ), self.nPart ) for ii in range( self.nParticles ) ] );
+
+        self.th     = np.array( [ o[0] for o in out ] );
+        self.ll     = np.array( [ o[1] for o in out ] );
+        self.states = [ o[2] for o in out ];
+        rate        = np.mean( [ o[3] for o in out ] );
+
+        self.moveTimes.append( tt );
+        self.acceptRate.append( rate );
+
+        if ( self.progressInterval != None ):
+            print("smc2Sampler: resample-move at observation " + str(tt) + ", acceptance rate: " + "%.3f" % rate + ", no. particles: " + str(self.nPart) );
+
+        # Double the number of particles and reweight (exchange step)
+        if ( ( self.adaptNPart ) and ( rate < self.acceptanceThreshold ) and ( 2 * self.nPart <= self.maxPart ) ):
+            self.nPart = 2 * self.nPart;
+
+            out = self.mapParticles( filterParticle, [ ( self.th[ii,:], tt, self.rng.randint( 0, 2**31 - 1 ), self.nPart ) for ii in range( self.nParticles ) ] );
+            ll  = np.array( [ o[0] for o in out ] );
+
+            self.logW   = self.logW + ll - self.ll;
+            self.ll     = ll;
+            self.states = [ o[1] for o in out ];
+
+            if ( self.progressInterval != None ):
+                print("smc2Sampler: increased the number of particles to " + str(self.nPart) + ", ESS: " + "%.1f" % self.calcESS() );
+
+    ##########################################################################
+    # Stop the pool and print a summary
+    ##########################################################################
+    def finishSampler(self):
+
+        if ( self.pool != None ):
+            self.pool.close();
+            self.pool.join();
+            self.pool = None;
+
+        self.tho = self.originalParameters();
+        self.w   = self.weights();
+
+        print("smc2Sampler: processed " + str(self.sys.T) + " observations with " + str(self.nParticles) + " parameters of " + self.PMHtype + " moves.");
+        print(" resample-move steps:      " + str( len( self.moveTimes ) ) );
+
+        if ( len( self.acceptRate ) > 0 ):
+            print(" mean acceptance rate:     " + "%.3f" % np.mean( self.acceptRate ) );
+        print(" no. particles:            " + str(self.nPart) );
+        print(" log-marginal likelihood:  " + "%.2f" % self.logMarginalLikelihood[-1] );
+        print(" posterior mean:           " + str( np.round( self.thMean[-1,:], 4 ) ) );
+        print(" posterior std:            " + str( np.round( np.sqrt( self.thVar[-1,:] ), 4 ) ) );
+
+    ##########################################################################
+    # Helpers: weights, ESS and moments of the original parameters
+    ##########################################################################
+    def weights(self):
+        w = np.exp( self.logW - np.max( self.logW ) );
+        return w / np.sum( w );
+
+    def calcESS(self):
+        w = self.weights();
+        return 1.0 / np.sum( w**2 );
+
+    def originalParameters(self):
+        out = np.zeros( ( self.nParticles, self.nPars ) );
+
+        for ii in range( self.nParticles ):
+            self.thSys.storeParameters( self.th[ii,:], self.sys );
+            self.thSys.transform();
+            out[ii,:] = self.thSys.returnParameters();
+
+        return out;
+
+    def calcPosteriorMoments(self):
+        w  = self.weights();
+        th = self.originalParameters();
+        m1 = np.dot( w, th );
+
+        return m1, np.dot( w, ( th - m1 )**2 );
+
+    ##########################################################################
+    # Helper: apply function to the tasks (in the pool if available)
+    ##########################################################################
+    def mapParticles(self,function,tasks):
+
+        if ( self.pool is None ):
+            return [ function( self.sm, self.sys, self.thSys, task ) for task in tasks ];
+
+        chunks  = [ ( function, tasks[ii::self.nProcesses] ) for ii in range( self.nProcesses ) ];
+        results = self.pool.map( particleWorker, chunks );
+
+        out = [None] * len( tasks );
+        for ii in range( self.nProcesses ):
+            out[ii::self.nProcesses] = results[ii];
+
+        return out;
+
+##############################################################################
+# Estimator passed to the stPMH object in the moves, returns the current
+# log-likelihood estimate in the first call and records the state of the
+# filter for each iteration of the chain
+##############################################################################
+class moveEstimator(object):
+
+    def __init__(self, sm, ll, state):
+        self.sm     = sm;
+        self.llInit = ll;
+        self.state  = state;
+        self.chain  = None;
+        self.states = {};
+
+    def filter(self, thSys):
+        if ( self.chain.iter == 0 ):
+            self.ll = self.llInit;
+            self.states[0] = self.state;
+        else:
+            self.sm.filter( thSys );
+            self.ll = self.sm.ll;
+            self.states[ self.chain.iter ] = self.sm.pfState();
+
+    def smoother(self, thSys):
+        self.sm.smoother( thSys );
+        self.gradient = np.array( self.sm.gradient, copy=True );
+
+        if ( self.chain.iter == 0 ):
+            self.ll = self.llInit;
+            self.states[0] = self.state;
+        else:
+            self.ll = self.sm.ll;
+            self.states[ self.chain.iter ] = self.sm.pfState();
+
+##############################################################################
+# Tasks for the parameters, run in the pool or in the main process
+##############################################################################
+
+# Run the filter on the observations up to tt, returns ( ll, state )
+def filterParticle(sm, sys, thSys, task):
+    th, tt, seed, nPart = task;
+
+    np.random.seed( seed );
+    sm.nPart = nPart;
+
+    thSys.storeParameters( th, sys );
+    thSys.transform();
+
+    if ( thSys.priorUniform() == 0.0 ):
+        return ( -np.inf, None );
+
+    T = thSys.T;
+    thSys.T = tt + 1;
+    try:
+        sm.filter( thSys );
+    finally:
+        thSys.T = T;
+
+    return ( sm.ll, sm.pfState() );
+
+# Process observation tt, returns ( state, llInc )
+def stepParticle(sm, sys, thSys, task):
+    th, state, tt, seed, nPart = task;
+
+    if ( state is None ):
+        return ( None, -np.inf );
+
+    np.random.seed( seed );
+    sm.nPart = nPart;
+
+    thSys.storeParameters( th, sys );
+    thSys.transform();
+
+    return sm.pfStep( thSys, state, tt );
+
+# Run the PMH kernel targeting the posterior given the observations up to
+# tt, returns ( th, ll, state, acceptance rate )
+def moveParticle(sm, sys, thSys, task):
+    chain, PMHtype, th, ll, state, tt, seed, nPart = task;
+
+    np.random.seed( seed );
+    sm.nPart = nPart;
+
+    thSys.storeParameters( th, sys );
+    thSys.transform();
+
+    chain         = copy.deepcopy( chain );
+    chain.initPar = thSys.returnParameters();
+    estimator     = moveEstimator( sm, ll, state );
+    estimator.chain = chain;
+
+    T = thSys.T;
+    thSys.T = tt + 1;
+    try:
+        chain.runSampler( estimator, sys, thSys, PMHtype );
+    finally:
+        thSys.T = T;
+
+    # Find the iteration where the last state of the chain was accepted
+    kk = chain.nIter - 1;
+    while ( chain.accept[kk,0] == 0.0 ):
+        kk = chain.proposalIndex( kk );
+
+    return ( chain.th[-1,:], chain.ll[-1,0], estimator.states[kk], np.mean( chain.accept[1:,0] ) );
+
+def particleWorker(job):
+    function, tasks = job;
+    return [ function( workerState['sm'], workerState['sys'], workerState['thSys'], task ) for task in tasks ];
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
@@ -0,0 +1,178 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import numpy           as     np
+import multiprocessing
+from   pmh             import stPMH
+from   pmh_parallel    import packEstimator, initialiseWorker, evaluateWorker, evaluateEstimator
+
+##############################################################################
+# Speculative PMH: the filter/smoother for the proposals of the coming
+# iterations is run in a pool of processes assuming that the proposals in
+# between are rejected. Each iteration uses its own seeds for the proposal
+# (and accept/reject) and for the filter, so a prefetched estimate is exactly
+# the one that would be computed when the iteration is reached. The chain is
+# therefore identical to running this sampler with nProcesses = 1.
+##############################################################################
+
+class speculativePMH(stPMH):
+
+    # Number of processes and number of iterations to look ahead (default:
+    # one iteration per process)
+    nProcesses = None;
+    lookAhead  = None;
+
+    ##########################################################################
+    # Main sampling routine
+    ##########################################################################
+
+    def runSampler(self,sm,sys,thSys,PMHtype):
+
+        # The workers keep copies of sm, so the prefetched estimates would
+        # not use the filters/smoothers of the fidelity schedule
+        if ( self.fidelitySchedule != None ):
+            raise NameError("speculativePMH: fidelitySchedule cannot be used together with speculative evaluation.");
+
+        # Draw the seeds for each iteration: proposal/accept and filter
+        self.iterationSeeds = np.random.randint( 0, 2**31 - 1, size=(self.nIter,2) );
+
+        nProcesses = self.nProcesses;
+        if ( nProcesses is None ):
+            nProcesses = multiprocessing.cpu_count();
+
+        lookAhead = self.lookAhead;
+        if ( lookAhead is None ):
+            lookAhead = nProcesses;
+
+        self.nLookAhead     = 0;
+        self.pool           = None;
+        self.pending        = {};
+        self.nPrefetchHits  = 0;
+        self.nPrefetchCalls = 0;
+
+        if ( nProcesses > 1 ):
+            self.nLookAhead = lookAhead;
+            self.pool       = multiprocessing.Pool( processes=nProcesses, initializer=initialiseWorker, initargs=( packEstimator(sm), sys, thSys ) );
+
+        self.sys = sys;
+
+        try:
+            stPMH.runSampler( self, prefetchEstimator( self, sm ), sys, thSys, PMHtype );
+        finally:
+            if ( self.pool != None ):
+                self.pool.terminate();
+                self.pool.join();
+                self.pool = None;
+
+        print("speculativePMH: used " + str(self.nPrefetchHits) + " prefetched estimates out of " + str(self.nPrefetchCalls) + " computed in parallel.");
+
+    ##########################################################################
+    # Sample the proposal using the seed for this iteration
+    ##########################################################################
+    def sampleProposal(self,):
+
+        # Launch the filters for the coming iterations
+        if ( self.pool != None ):
+            self.prefetch();
+
+        np.random.seed( self.iterationSeeds[self.iter,0] );
+        stPMH.sampleProposal(self);
+
+    ##########################################################################
+    # Submit the proposals along the all-reject path to the pool
+    ##########################################################################
+    def prefetch(self):
+
+        # Drop the results for the iterations that did not use them (e.g.
+        # proposals outside the support of the prior)
+        for ii in [ ii for ii in self.pending if ii < self.iter ]:
+            del self.pending[ii];
+
+        for ii in range( self.iter, np.min( ( self.iter + self.nLookAhead, self.nIter ) ) ):
+
+            # Find the state that the proposal is centred around if all the
+            # proposals from the current iteration are rejected
+            jj = self.proposalIndex( ii );
+            while ( jj >= self.iter ):
+                jj = self.proposalIndex( jj );
+
+            np.random.seed( self.iterationSeeds[ii,0] );
+            thp = self.drawProposal( ii, jj );
+
+            # Keep the result if it was computed for the same proposal
+            if ( ( ii in self.pending ) and np.array_equal( self.pending[ii][0], thp ) ):
+                continue;
+
+            task = ( thp, self.iterationSeeds[ii,1], self.PMHtypeN != 0 );
+            self.pending[ii] = ( thp, self.pool.apply_async( evaluateWorker, ( task, ) ) );
+            self.nPrefetchCalls += 1;
+
+    ##########################################################################
+    # Run the filter/smoother or collect the prefetched result
+    ##########################################################################
+    def runEstimator(self,sm,thSys,smooth):
+
+        # The proposal (thSys holds the original parameters if transformed)
+        th = self.thp[self.iter,:];
+
+        if ( self.iter in self.pending ):
+            thPending, result = self.pending.pop( self.iter );
+
+            if ( np.array_equal( thPending, th ) ):
+                self.nPrefetchHits += 1;
+                return result.get();
+
+        # Not prefetched, run locally using the seed for the filter
+        state = np.random.get_state();
+        out   = evaluateEstimator( sm, thSys, self.sys, th, self.iterationSeeds[self.iter,1], smooth );
+        np.random.set_state( state );
+
+        return out;
+
+    ##########################################################################
+    # Checkpoints store the underlying filter/smoother
+    ##########################################################################
+    def saveCheckpoint(self,sm):
+        stPMH.saveCheckpoint( self, sm.sm );
+
+    def restoreCheckpoint(self,sm,sys,thSys):
+        stPMH.restoreCheckpoint( self, sm.sm, sys, thSys );
+
+##############################################################################
+# Estimator passed to stPMH that forwards the calls to speculativePMH
+##############################################################################
+class prefetchEstimator(object):
+
+    def __init__(self, pmh, sm):
+        self.pmh = pmh;
+        self.sm  = sm;
+
+    def filter(self, thSys):
+        self.ll, self.gradient = self.pmh.runEstimator( self.sm, thSys, False );
+
+    def smoother(self, thSys):
+        self.ll, self.gradient = self.pmh.runEstimator( self.sm, thSys, True );
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
@@ -186,6 +186,156 @@ class kalmanMethods(object):
         self.gradient  = gradient0[0:sys.nParInference];
         self.gradient1 = gradient[0:sys.nParInference,:];
 
+    ##########################################################################
+    # Batched Kalman filter: runs the filter for M parameter vectors at once
+    # (par is (M,nPar) with the original parameters), the recursions are
+    # broadcast over the parameters. Returns the log-likelihoods in llBatch.
+    ##########################################################################
+    def kfBatch(self,sys,par):
+
+        # Check settings and apply defaults otherwise
+        self.xo = 0.0;
+        self.Po = 1e-5;
+
+        self.filterType = "kfBatch";
+
+        par     = np.atleast_2d( par );
+        nBatch  = par.shape[0];
+        y       = np.asarray( sys.y, dtype=float ).reshape(-1);
+        u       = np.asarray( sys.u, dtype=float ).reshape(-1);
+
+        # Initialise variables for the filter (time along the first axis)
+        K       = np.zeros((sys.T,nBatch));
+        xhatp   = np.zeros((sys.T+1,nBatch));
+        xhatf   = np.zeros((sys.T,nBatch));
+        Pf      = np.zeros((sys.T,nBatch));
+        Pp      = np.zeros((sys.T+1,nBatch));
+        ll      = np.zeros(nBatch);
+
+        m       = par[:,0];
+        A       = par[:,1];
+        Q       = par[:,2]**2;
+        R       = par[:,3]**2;
+
+        # Set initial covariance and state
+        Pp[0]     = self.Po;
+        xhatp[0]  = self.xo;
+
+        #=====================================================================
+        # Run main loop
+        #=====================================================================
+
+        for tt in range(0, sys.T):
+
+            # Calculate the Kalman Gain (C = 1)
+            S     = Pp[tt] + R;
+            K[tt] = Pp[tt] / S;
+
+            # Compute the state estimate
+            e           = y[tt] - xhatp[tt];
+            xhatf[tt]   = xhatp[tt] + K[tt] * e;
+            xhatp[tt+1] = A * xhatf[tt] + m * ( 1.0 - A ) + u[tt];
+
+            # Update covariance
+            Pf[tt]      = Pp[tt] - K[tt] * S * K[tt];
+            Pp[tt+1]    = A * Pf[tt] * A + Q;
+
+            # Estimate loglikelihood
+            ll         += -0.5 * np.log(2.0 * np.pi * S) - 0.5 * e * e / S;
+
+        #=====================================================================
+        # Compile output
+        #=====================================================================
+
+        self.parBatch   = par;
+        self.llBatch    = ll;
+        self.xhatfBatch = xhatf;
+        self.xhatpBatch = xhatp;
+        self.KBatch     = K;
+        self.PpBatch    = Pp;
+        self.PfBatch    = Pf;
+
+    ##########################################################################
+    # Batched RTS smoother: as rts for M parameter vectors at once. Returns
+    # the log-likelihoods in llBatch and the gradients of the log-likelihood
+    # (without the log-prior, as the prior is defined by the model object)
+    # in gradientBatch (M,nParInference).
+    ##########################################################################
+    def rtsBatch(self,sys,par):
+
+        self.smootherType    = "rtsBatch"
+
+        # Run the preliminary Kalman filter
+        self.kfBatch(sys,par);
+
+        par     = self.parBatch;
+        nBatch  = par.shape[0];
+        y       = np.asarray( sys.y, dtype=float ).reshape(-1);
+        u       = np.asarray( sys.u, dtype=float ).reshape(-1);
+
+        m       = par[:,0];
+        A       = par[:,1];
+        q       = par[:,2];
+        r       = par[:,3];
+
+        Pf      = self.PfBatch;
+        Pp      = self.PpBatch;
+        xhatf   = self.xhatfBatch;
+        xhatp   = self.xhatpBatch;
+
+        # Initalise variables
+        J       = np.zeros((sys.T,nBatch));
+        M       = np.zeros((sys.T,nBatch));
+        xhats   = np.zeros((sys.T,nBatch));
+        Ps      = np.zeros((sys.T,nBatch));
+
+        # Set last smoothing covariance and state estimate to the filter solutions
+        Ps[sys.T-1]     = Pf[sys.T-1];
+        xhats[sys.T-1]  = xhatf[sys.T-1];
+
+        #=====================================================================
+        # Run main loop
+        #=====================================================================
+
+        for tt in range((sys.T-2),0,-1):
+            J[tt]       = Pf[tt] * A / Pp[tt+1]
+            xhats[tt]   = xhatf[tt] + J[tt] * ( xhats[tt+1] - xhatp[tt+1] )
+            Ps[tt]      = Pf[tt] + J[tt] * ( Ps[tt+1] - Pp[tt+1] ) * J[tt];
+
+        #=====================================================================
+        # Calculate the M-matrix (Smoothing covariance between states at t and t+1)
+        #=====================================================================
+
+        M[sys.T-1]  = ( 1 - self.KBatch[sys.T-1] ) * A * Pf[sys.T-1];
+        for tt in range((sys.T-2),0,-1):
+            M[tt]   = Pf[tt] * J[tt-1] + J[tt-1] * ( M[tt+1] - A * Pf[tt] ) * J[tt-1];
+
+        #=====================================================================
+        # Gradient estimation (vectorised over time)
+        #=====================================================================
+
+        x1    = xhats[1:];
+        x0    = xhats[0:-1];
+        kappa = x1 * y[1:].reshape((-1,1));
+        eta   = x1 * x1 + Ps[1:];
+        eta1  = x0 * x0 + Ps[0:-1];
+        psi   = x0 * x1 + M[1:];
+        px    = x1 - m - A * ( x0 - m ) + u[1:].reshape((-1,1));
+
+        gradient       = np.zeros((4,nBatch));
+        gradient[0,:]  = np.sum( q**(-2) * px * ( 1.0 - A ), axis=0 );
+        gradient[1,:]  = np.sum( q**(-2) * ( psi - m * x0 * ( 1.0 - A ) - A * eta1 ) - q**(-2) * m * px, axis=0 );
+        gradient[2,:]  = np.sum( q**(-3) * ( eta - 2.0 * A * psi + A**2 * eta1 - 2.0*(x1-A*x0)*m*(1.0-A) + m**2 * (1.0-A)**2 ) - q**(-1), axis=0 );
+        gradient[3,:]  = np.sum( r**(-3) * ( y[1:].reshape((-1,1))**2 - 2 * kappa + eta ) - r**(-1), axis=0 );
+
+        #=====================================================================
+        # Compile output
+        #=====================================================================
+
+        self.xhatsBatch    = xhats;
+        self.PsBatch       = Ps;
+        self.gradientBatch = gradient[0:sys.nParInference,:].transpose();
+
 ##############################################################################
 ##############################################################################
 # End of file
@@ -132,6 +132,59 @@ class smcSampler(object):
         self.p     = p;
         self.pt    = pt;
 
+    ##########################################################################
+    # Particle filtering: one observation at a time (used by SMC^2)
+    ##########################################################################
+
+    # State of the filter after the last call of pf: the particles, their
+    # normalised weights and the time s that the next observation is
+    # processed from (for the fully adapted filter, the particles at the
+    # last time are not propagated by pf)
+    def pfState(self):
+        if ( self.filterTypeInternal == "fullyadapted" ):
+            s = np.max( ( self.T - 2, 0 ) );
+        else:
+            s = self.T - 1;
+
+        return ( np.array( self.p[:,s], copy=True ), np.array( self.w[:,s], copy=True ), s );
+
+    # Continue the filter from state to observation tt and return the new
+    # state and the log-likelihood increment, this is the same algorithm as
+    # in pf so the sum of the increments is distributed as the estimate from
+    # pf using the observations up to tt
+    def pfStep(self,sys,state,tt):
+        p, w, s = state;
+
+        if ( ( self.filterTypeInternal == "bootstrap" ) or ( s < tt - 1 ) ):
+            # Resample and propagate the particles
+            nIdx = self.resampleSystematic( w );
+            nIdx = np.transpose( nIdx.astype(int) );
+
+            if ( self.filterTypeInternal == "bootstrap" ):
+                p = np.ravel( sys.generateState   ( p[nIdx], tt-1 ) );
+            else:
+                p = np.ravel( sys.generateStateFA ( p[nIdx], tt-2 ) );
+
+            s = s + 1;
+
+        # Weight particles
+        if ( self.filterTypeInternal == "bootstrap" ):
+            w = sys.evaluateObservation   ( p, tt );
+        else:
+            w = sys.evaluateObservationFA ( p, tt-1 );
+
+        # Rescale log-weights and estimate the log-likelihood increment
+        wmax = np.max( w );
+        w    = np.exp( w - wmax );
+        ll   = wmax + np.log(np.sum(w)) - np.log(self.nPart);
+        w   /= np.sum(w);
+
+        # The filter weights are (1/N) for the fully adapted filter
+        if ( self.filterTypeInternal == "fullyadapted" ):
+            w = np.ones(self.nPart) / self.nPart;
+
+        return ( p, w, s ), ll;
+
     ##########################################################################
     # Particle smoothing: fixed-lag smoother
     ##########################################################################
@@ -192,29 +245,39 @@ class smcSampler(object):
     ##############################################################################
 
     def resampleSystematic( self, w, N=0 ):
-        code = \
-        """ py::list ret;
-    	int jj = 0;
-            for(int kk = 0; kk < N; kk++)
-            {
-                double uu  = ( u + kk ) / N;
+        return resampleSystematic( w, N );
 
-                while( ww(jj) < uu && jj < H - 1)
-                {
-                    jj++;
-                }
-                ret.append(jj);
+##############################################################################
+# Systematic resampling of the (unnormalised) weights w, returns N indices
+# (len(w) if N=0) using the uniform u (drawn from np.random if None)
+##############################################################################
+def resampleSystematic( w, N=0, u=None ):
+    code = \
+    """ py::list ret;
+	int jj = 0;
+        for(int kk = 0; kk < N; kk++)
+        {
+            double uu  = ( u + kk ) / N;
+
+            while( ww(jj) < uu && jj < H - 1)
+            {
+                jj++;
             }
-    	return_val = ret;
-        """
-        H = len(w);
-        if N==0:
-            N = H;
-
-        u   = float( np.random.uniform() );
-        ww  = ( np.cumsum(w) / np.sum(w) ).astype(float);
-        idx = weave.inline(code,['u','H','ww','N'], type_converters=weave.converters.blitz )
-        return np.array( idx ).astype(int);
+            ret.append(jj);
+        }
+	return_val = ret;
+    """
+    H = len(w);
+    if N==0:
+        N = H;
+
+    if ( u is None ):
+        u = np.random.uniform();
+
+    u   = float( u );
+    ww  = ( np.cumsum(w) / np.sum(w) ).astype(float);
+    idx = weave.inline(code,['u','H','ww','N'], type_converters=weave.converters.blitz )
+    return np.array( idx ).astype(int);
 
 ##############################################################################
 ##############################################################################
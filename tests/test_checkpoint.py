@@ -0,0 +1,122 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy           as     np
+
+root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' );
+sys.path.insert( 0, root );
+sys.path.insert( 0, os.path.join( root, 'para' ) );
+sys.path.insert( 0, os.path.join( root, 'models' ) );
+
+from   state           import kalman
+from   models          import lgss_4parameters
+import pmh
+
+def setupChain(PMHtype):
+    sys            = lgss_4parameters.ssm();
+    sys.par        = np.zeros( ( sys.nPar, 1 ) );
+    sys.par[0]     = 0.20;
+    sys.par[1]     = 0.80;
+    sys.par[2]     = 1.00;
+    sys.par[3]     = 0.10;
+    sys.T          = 250;
+    sys.xo         = 0.0;
+    sys.generateData( fileName=os.path.join( root, 'data', 'lgssT250_smallR.csv' ), order="xy" );
+
+    th               = lgss_4parameters.ssm();
+    th.nParInference = 3;
+    th.nQInference   = 0;
+    th.copyData( sys );
+
+    km          = kalman.kalmanMethods();
+    km.filter   = km.kf;
+    km.smoother = km.rts;
+
+    chain                  = pmh.stPMH();
+    chain.nIter            = 300;
+    chain.nBurnIn          = 100;
+    chain.initPar          = th.returnParameters();
+    chain.invHessian       = np.diag( ( 3e-02, 1e-03, 2e-03 ) );
+    chain.stepSize         = 0.8;
+    chain.memoryLength     = 0;
+    chain.progressInterval = None;
+
+    if ( PMHtype == "qPMH2" ):
+        chain.stepSize             = 1.0;
+        chain.epsilon              = 1000;
+        chain.memoryLength         = 20;
+        chain.PSDmethodhybridSamps = 50;
+        chain.adaptStepSize        = True;
+
+    return chain, km, sys, th;
+
+##############################################################################
+# Tests
+##############################################################################
+class testCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp();
+
+    def tearDown(self):
+        shutil.rmtree( self.dir );
+
+    def compareResumed(self, PMHtype):
+        fileName = os.path.join( self.dir, PMHtype + ".pkl" );
+
+        # Complete run that writes checkpoints (the last one at iteration 200)
+        chain, km, sys, th       = setupChain( PMHtype );
+        chain.checkpointFile     = fileName;
+        chain.checkpointInterval = 100;
+
+        np.random.seed( 87655678 );
+        chain.runSampler( km, sys, th, PMHtype );
+
+        # Resume from the checkpoint using a different seed and a different
+        # configuration of the filter/smoother (both are restored)
+        resumed, km, sys, th = setupChain( PMHtype );
+        km.smoother          = km.kf;
+
+        np.random.seed( 1 );
+        resumed.resume( km, sys, th, fileName );
+
+        for attr in ( "th", "thp", "ll", "llp", "gradient", "aprob", "accept", "stepSizeHistory" ):
+            self.assertTrue( np.array_equal( getattr( chain, attr ), getattr( resumed, attr ) ), attr );
+
+    def testResumePPMH1(self):
+        self.compareResumed( "pPMH1" );
+
+    def testResumeQPMH2(self):
+        self.compareResumed( "qPMH2" );
+
+if __name__ == '__main__':
+    unittest.main();
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
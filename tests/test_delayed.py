@@ -0,0 +1,118 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import os
+import sys
+import unittest
+import numpy           as     np
+
+root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' );
+sys.path.insert( 0, root );
+sys.path.insert( 0, os.path.join( root, 'para' ) );
+sys.path.insert( 0, os.path.join( root, 'models' ) );
+
+from   state           import kalman
+from   models          import lgss_4parameters
+import pmh
+
+##############################################################################
+# Kalman filter/smoother that counts the number of runs
+##############################################################################
+class countingKalman(kalman.kalmanMethods):
+
+    nRuns = 0;
+
+    def countedFilter(self, sys):
+        self.nRuns += 1;
+        self.kf( sys );
+
+    def countedSmoother(self, sys):
+        self.nRuns += 1;
+        self.rts( sys );
+
+def runChain(surrogate):
+    sys            = lgss_4parameters.ssm();
+    sys.par        = np.zeros( ( sys.nPar, 1 ) );
+    sys.par[0]     = 0.20;
+    sys.par[1]     = 0.80;
+    sys.par[2]     = 1.00;
+    sys.par[3]     = 0.10;
+    sys.T          = 250;
+    sys.xo         = 0.0;
+    sys.generateData( fileName=os.path.join( root, 'data', 'lgssT250_smallR.csv' ), order="xy" );
+
+    th               = lgss_4parameters.ssm();
+    th.nParInference = 3;
+    th.nQInference   = 0;
+    th.copyData( sys );
+
+    km          = countingKalman();
+    km.filter   = km.countedFilter;
+    km.smoother = km.countedSmoother;
+
+    chain                  = pmh.stPMH();
+    chain.nIter            = 500;
+    chain.nBurnIn          = 100;
+    chain.initPar          = th.returnParameters();
+    chain.invHessian       = np.diag( ( 3e-02, 1e-03, 2e-03 ) );
+    chain.stepSize         = 2.562 / np.sqrt( 3 );
+    chain.memoryLength     = 0;
+    chain.progressInterval = None;
+    chain.surrogate        = surrogate;
+
+    np.random.seed( 87655678 );
+    chain.runSampler( km, sys, th, "pPMH0" );
+
+    return chain, km;
+
+##############################################################################
+# Tests
+##############################################################################
+class testDelayedAcceptance(unittest.TestCase):
+
+    def testExactSurrogate(self):
+        surrogate        = countingKalman();
+        surrogate.filter = surrogate.countedFilter;
+
+        chain, km        = runChain( surrogate );
+        passed           = np.where( chain.aprob[1:,0] > 0.0 )[0] + 1;
+        nScreened        = int( np.sum( chain.screened ) );
+
+        # The surrogate is run for every proposal inside the support and
+        # the filter only for the proposals that pass the first stage
+        self.assertGreater( nScreened, 0 );
+        self.assertEqual( surrogate.nRuns, chain.nIter - chain.nOutOfSupport );
+        self.assertEqual( km.nRuns, chain.nIter - chain.nOutOfSupport - nScreened );
+        self.assertEqual( len( passed ), km.nRuns - 1 );
+
+        # The second stage accepts every proposal that passes the first
+        # stage when the surrogate is exact
+        self.assertLess( np.max( np.abs( chain.aprob[passed,0] - 1.0 ) ), 1e-10 );
+        self.assertTrue( np.all( chain.accept[passed,0] == 1.0 ) );
+
+if __name__ == '__main__':
+    unittest.main();
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
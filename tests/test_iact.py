@@ -0,0 +1,131 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import os
+import sys
+import unittest
+import numpy           as     np
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..', 'para' ) );
+
+from   pmh_helpers     import autocovariance, calcESSs
+from   pmh_parallel    import ess
+
+##############################################################################
+# Reference implementation of the multi-chain ESS using Geyer's initial
+# monotone sequence estimator (one lag at a time, as in Stan)
+##############################################################################
+def essReference(x):
+    m, n = x.shape;
+    acov = autocovariance(x);
+
+    meanVar = np.mean( acov[:,0] ) * n / ( n - 1.0 );
+    varPlus = meanVar * ( n - 1.0 ) / n;
+    if ( m > 1 ):
+        varPlus += np.var( np.mean( x, axis=1 ), ddof=1 );
+
+    rho    = 1.0 - ( meanVar - np.mean( acov, axis=0 ) ) / varPlus;
+    rho[0] = 1.0;
+
+    rhoHat    = np.zeros( n );
+    rhoHat[0] = 1.0;
+    rhoHat[1] = rho[1];
+    rhoEven   = 1.0;
+    rhoOdd    = rho[1];
+    tt        = 1;
+
+    while ( ( tt < n - 3 ) and ( rhoEven + rhoOdd > 0.0 ) ):
+        rhoEven = rho[tt+1];
+        rhoOdd  = rho[tt+2];
+        if ( rhoEven + rhoOdd >= 0.0 ):
+            rhoHat[tt+1] = rhoEven;
+            rhoHat[tt+2] = rhoOdd;
+        tt += 2;
+
+    maxT = tt - 2;
+    if ( rhoEven > 0.0 ):
+        rhoHat[maxT+1] = rhoEven;
+
+    tt = 1;
+    while ( tt <= maxT - 2 ):
+        if ( rhoHat[tt+1] + rhoHat[tt+2] > rhoHat[tt-1] + rhoHat[tt] ):
+            rhoHat[tt+1] = 0.5 * ( rhoHat[tt-1] + rhoHat[tt] );
+            rhoHat[tt+2] = rhoHat[tt+1];
+        tt += 2;
+
+    tau = -1.0 + 2.0 * np.sum( rhoHat[0:maxT+1] ) + np.sum( rhoHat[maxT+1:maxT+2] );
+    tau = np.max( ( tau, 1.0 / np.log10( m * n ) ) );
+
+    return m * n / tau;
+
+def simulateAR1(rng, phi, m, n):
+    x = np.zeros( ( m, n ) );
+    e = rng.normal( size=( m, n ) );
+
+    for tt in range( 1, n ):
+        x[:,tt] = phi * x[:,tt-1] + e[:,tt];
+
+    return x;
+
+##############################################################################
+# Tests
+##############################################################################
+class testGeyerESS(unittest.TestCase):
+
+    def compare(self, phis):
+        rng = np.random.RandomState( 0 );
+
+        for phi in phis:
+            for m in ( 1, 2, 4 ):
+                for n in ( 2, 3, 4, 5, 50, 301, 1000 ):
+                    x   = simulateAR1( rng, phi, m, n );
+                    ref = essReference( x );
+
+                    self.assertAlmostEqual( calcESSs( x[:,:,np.newaxis], method="geyer" )[0] / ref, 1.0, places=10 );
+                    self.assertAlmostEqual( ess( x ) / ref, 1.0, places=10 );
+
+    def testPositivelyCorrelated(self):
+        self.compare( ( 0.0, 0.3, 0.7, 0.9, 0.99 ) );
+
+    def testNegativelyCorrelated(self):
+        self.compare( ( -0.3, -0.7, -0.95 ) );
+
+    def testParametersAtOnce(self):
+        rng = np.random.RandomState( 1 );
+        x   = np.dstack( [ simulateAR1( rng, phi, 3, 500 ) for phi in ( -0.5, 0.2, 0.9 ) ] );
+        out = calcESSs( x, method="geyer" );
+
+        for ii in range( 3 ):
+            self.assertAlmostEqual( out[ii] / essReference( x[:,:,ii] ), 1.0, places=10 );
+
+    def testConstantChain(self):
+        x = np.ones( ( 2, 100 ) );
+        self.assertEqual( ess( x ), 200.0 );
+        self.assertEqual( calcESSs( x[:,:,np.newaxis], method="geyer" )[0], 200.0 );
+
+if __name__ == '__main__':
+    unittest.main();
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
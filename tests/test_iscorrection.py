@@ -0,0 +1,114 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import os
+import sys
+import unittest
+import numpy           as     np
+
+root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' );
+sys.path.insert( 0, root );
+sys.path.insert( 0, os.path.join( root, 'para' ) );
+sys.path.insert( 0, os.path.join( root, 'models' ) );
+
+from   state           import kalman
+from   models          import lgss_4parameters
+from   pmh_iscorrection import isCorrectedPMH, weightedQuantiles, paretoShape
+import pmh
+
+##############################################################################
+# Tests
+##############################################################################
+class testISCorrection(unittest.TestCase):
+
+    def testExactApproximation(self):
+        # The weights are constant if the approximation is the estimator
+        sys            = lgss_4parameters.ssm();
+        sys.par        = np.zeros( ( sys.nPar, 1 ) );
+        sys.par[0]     = 0.20;
+        sys.par[1]     = 0.80;
+        sys.par[2]     = 1.00;
+        sys.par[3]     = 0.10;
+        sys.T          = 250;
+        sys.xo         = 0.0;
+        sys.generateData( fileName=os.path.join( root, 'data', 'lgssT250_smallR.csv' ), order="xy" );
+
+        th               = lgss_4parameters.ssm();
+        th.nParInference = 3;
+        th.nQInference   = 0;
+        th.copyData( sys );
+
+        km          = kalman.kalmanMethods();
+        km.filter   = km.kf;
+        km.smoother = km.rts;
+
+        chain                  = pmh.stPMH();
+        chain.nIter            = 400;
+        chain.nBurnIn          = 100;
+        chain.initPar          = th.returnParameters();
+        chain.invHessian       = np.diag( ( 3e-02, 1e-03, 2e-03 ) );
+        chain.stepSize         = 2.562 / np.sqrt( 3 );
+        chain.memoryLength     = 0;
+        chain.progressInterval = None;
+
+        corrected            = isCorrectedPMH();
+        corrected.thin       = 2;
+        corrected.nProcesses = 1;
+        corrected.seed       = 1;
+
+        np.random.seed( 87655678 );
+        corrected.runSampler( chain, km, km, sys, th, "pPMH0" );
+
+        n = corrected.nDraws;
+
+        self.assertEqual( n, 150 );
+        self.assertLess( corrected.nStates, n );
+        self.assertLess( np.max( np.abs( corrected.logW ) ), 1e-10 );
+        self.assertLess( np.max( np.abs( corrected.w * n - 1.0 ) ), 1e-8 );
+        self.assertAlmostEqual( corrected.ess / n, 1.0, places=8 );
+        self.assertLess( np.max( np.abs( corrected.mean - np.mean( corrected.tho, axis=0 ) ) ), 1e-10 );
+        self.assertLess( np.max( np.abs( corrected.var - np.var( corrected.tho, axis=0, ddof=1 ) ) ), 1e-10 );
+
+    def testWeightedQuantiles(self):
+        x = np.array( ( 3.0, 1.0, 2.0, 4.0 ) );
+        w = np.ones( 4 ) / 4.0;
+
+        self.assertAlmostEqual( weightedQuantiles( x, w, 0.5 ), 2.5 );
+        self.assertTrue( np.all( np.diff( weightedQuantiles( x, w, ( 0.1, 0.5, 0.9 ) ) ) > 0.0 ) );
+
+    def testParetoShape(self):
+        # Log-weights with generalised Pareto tails with shape k
+        rng = np.random.RandomState( 0 );
+
+        for k in ( 0.3, 0.8 ):
+            x = ( rng.uniform( size=200000 )**( -k ) - 1.0 ) / k;
+            self.assertAlmostEqual( paretoShape( np.log( x ) ), k, delta=0.1 );
+
+        self.assertTrue( np.isnan( paretoShape( np.zeros( 100 ) ) ) );
+
+if __name__ == '__main__':
+    unittest.main();
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
@@ -0,0 +1,92 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import os
+import sys
+import unittest
+import numpy           as     np
+
+root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' );
+sys.path.insert( 0, root );
+sys.path.insert( 0, os.path.join( root, 'models' ) );
+
+from   state           import kalman
+from   models          import lgss_4parameters
+
+##############################################################################
+# Tests
+##############################################################################
+class testKalmanBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.sys        = lgss_4parameters.ssm();
+        self.sys.par    = np.zeros( ( self.sys.nPar, 1 ) );
+        self.sys.par[0] = 0.20;
+        self.sys.par[1] = 0.80;
+        self.sys.par[2] = 1.00;
+        self.sys.par[3] = 0.10;
+        self.sys.T      = 250;
+        self.sys.xo     = 0.0;
+        self.sys.generateData( fileName=os.path.join( root, 'data', 'lgssT250_smallR.csv' ), order="xy" );
+
+        self.th               = lgss_4parameters.ssm();
+        self.th.nParInference = 3;
+        self.th.nQInference   = 0;
+        self.th.copyData( self.sys );
+
+        # Parameter vectors (mu, phi, sigmav, sigmae) evaluated at once
+        self.par = np.array( ( ( 0.20,  0.80, 1.00, 0.10 ),
+                               ( -0.10, 0.95, 0.70, 0.10 ),
+                               ( 0.50,  0.30, 1.50, 0.10 ),
+                               ( 0.00, -0.50, 0.20, 0.10 ) ) );
+
+    def testFilter(self):
+        km = kalman.kalmanMethods();
+        km.kfBatch( self.th, self.par );
+
+        for kk in range( self.par.shape[0] ):
+            self.th.storeParameters( self.par[kk,:], self.sys );
+            km.kf( self.th );
+
+            self.assertAlmostEqual( km.llBatch[kk] / km.ll, 1.0, places=12 );
+
+    def testSmoother(self):
+        km = kalman.kalmanMethods();
+        km.rtsBatch( self.th, self.par );
+
+        for kk in range( self.par.shape[0] ):
+            self.th.storeParameters( self.par[kk,:], self.sys );
+            km.rts( self.th );
+
+            # The gradient of rts includes the gradient of the log-prior
+            prior = np.array( [ self.th.dprior1( nn ) for nn in range( self.th.nParInference ) ] );
+
+            self.assertAlmostEqual( km.llBatch[kk] / km.ll, 1.0, places=12 );
+            self.assertLess( np.max( np.abs( km.gradientBatch[kk,:] + prior - km.gradient ) ), 1e-10 * np.max( np.abs( km.gradient ) ) );
+
+if __name__ == '__main__':
+    unittest.main();
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
@@ -0,0 +1,114 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import os
+import sys
+import unittest
+import numpy           as     np
+
+root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' );
+sys.path.insert( 0, root );
+sys.path.insert( 0, os.path.join( root, 'para' ) );
+sys.path.insert( 0, os.path.join( root, 'models' ) );
+
+from   state           import kalman
+from   models          import lgss_4parameters
+from   pmh_map         import posteriorMode
+import pmh
+
+##############################################################################
+# Tests
+##############################################################################
+class testPosteriorMode(unittest.TestCase):
+
+    def setUp(self):
+        self.sys        = lgss_4parameters.ssm();
+        self.sys.par    = np.zeros( ( self.sys.nPar, 1 ) );
+        self.sys.par[0] = 0.20;
+        self.sys.par[1] = 0.80;
+        self.sys.par[2] = 1.00;
+        self.sys.par[3] = 0.10;
+        self.sys.T      = 250;
+        self.sys.xo     = 0.0;
+        self.sys.generateData( fileName=os.path.join( root, 'data', 'lgssT250_smallR.csv' ), order="xy" );
+
+        self.th               = lgss_4parameters.ssm();
+        self.th.nParInference = 3;
+        self.th.nQInference   = 0;
+        self.th.copyData( self.sys );
+
+        self.km          = kalman.kalmanMethods();
+        self.km.filter   = self.km.kf;
+        self.km.smoother = self.km.rts;
+
+        self.initPar     = np.array( ( 0.0, 0.5, 0.5 ) );
+
+    def findMode(self, version):
+        self.th.version = version;
+
+        mode        = posteriorMode();
+        mode.method = "newton";
+        mode.findMode( self.km, self.sys, self.th, self.initPar );
+
+        return mode;
+
+    def testNewton(self):
+        mode = self.findMode( "standard" );
+
+        self.assertTrue( mode.converged );
+        self.assertLess( np.dot( mode.gradient, np.dot( mode.invHessian, mode.gradient ) ), mode.tolerance );
+        self.assertTrue( np.all( np.linalg.eigvalsh( mode.invHessian ) > 0.0 ) );
+
+        # The log-posterior is smaller at perturbations of the mode along
+        # the principal axes of the curvature
+        eigv, U = np.linalg.eigh( mode.invHessian );
+        for ii in range( 3 ):
+            for sign in ( -1.0, 1.0 ):
+                th = mode.thMode + sign * 0.1 * np.sqrt( eigv[ii] ) * U[:,ii];
+                self.assertLess( mode.evaluate( self.km, self.sys, self.th, th )[0], mode.logPosterior );
+
+    def testTransformedMode(self):
+        # The mode of the transformed parameters includes the log-Jacobian,
+        # so check the stationarity of that target
+        mode = self.findMode( "logitlog" );
+
+        self.assertTrue( mode.converged );
+        self.assertLess( np.max( np.abs( mode.gradient ) ), 1e-3 );
+        self.assertTrue( np.all( np.abs( mode.thModeOriginal[1] ) < 1.0 ) );
+        self.assertTrue( np.all( mode.thModeOriginal[2] > 0.0 ) );
+
+    def testConfigure(self):
+        mode  = self.findMode( "standard" );
+        chain = pmh.stPMH();
+        mode.configure( chain );
+
+        self.assertTrue( np.array_equal( chain.initPar, mode.thModeOriginal ) );
+        self.assertTrue( np.array_equal( chain.invHessian, mode.invHessian ) );
+        self.assertAlmostEqual( chain.epsilon * np.min( np.linalg.eigvalsh( mode.invHessian ) ), 1.0, places=12 );
+
+if __name__ == '__main__':
+    unittest.main();
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
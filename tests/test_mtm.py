@@ -0,0 +1,112 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import os
+import sys
+import unittest
+import numpy           as     np
+
+root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' );
+sys.path.insert( 0, root );
+sys.path.insert( 0, os.path.join( root, 'para' ) );
+sys.path.insert( 0, os.path.join( root, 'models' ) );
+
+from   state           import kalman
+from   models          import lgss_4parameters
+from   pmh_mtm         import mtmPMH
+
+def runChain(nTries, nProcesses):
+    sys            = lgss_4parameters.ssm();
+    sys.par        = np.zeros( ( sys.nPar, 1 ) );
+    sys.par[0]     = 0.20;
+    sys.par[1]     = 0.80;
+    sys.par[2]     = 1.00;
+    sys.par[3]     = 0.10;
+    sys.T          = 250;
+    sys.xo         = 0.0;
+    sys.generateData( fileName=os.path.join( root, 'data', 'lgssT250_smallR.csv' ), order="xy" );
+
+    th               = lgss_4parameters.ssm();
+    th.nParInference = 3;
+    th.nQInference   = 0;
+    th.copyData( sys );
+
+    km          = kalman.kalmanMethods();
+    km.filter   = km.kf;
+    km.smoother = km.rts;
+
+    chain                  = mtmPMH();
+    chain.nIter            = 100;
+    chain.nBurnIn          = 20;
+    chain.nTries           = nTries;
+    chain.nProcesses       = nProcesses;
+    chain.initPar          = th.returnParameters();
+    chain.invHessian       = np.diag( ( 3e-02, 1e-03, 2e-03 ) );
+    chain.stepSize         = 1.125 * np.sqrt( 3**( -1.0 / 3.0 ) );
+    chain.memoryLength     = 0;
+    chain.progressInterval = None;
+
+    np.random.seed( 87655678 );
+    chain.runSampler( km, sys, th, "pPMH1" );
+
+    return chain;
+
+##############################################################################
+# Tests
+##############################################################################
+class testMultipleTry(unittest.TestCase):
+
+    def testSingleTry(self):
+        # With one candidate the acceptance probability is the one of pPMH1
+        chain = runChain( 1, 1 );
+        drift = 0.5 * chain.stepSize**2;
+
+        for ii in range( 1, chain.nIter ):
+            if ( not np.isfinite( chain.llp[ii,0] ) ):
+                continue;
+
+            logQf = chain.proposalFixed.logpdf( chain.thp[ii,:], chain.th[ii-1,:] + drift * chain.ngradient[ii-1,:], chain.stepSize );
+            logQb = chain.proposalFixed.logpdf( chain.th[ii-1,:], chain.thp[ii,:] + drift * chain.ngradientp[ii,:], chain.stepSize );
+            logR  = chain.llp[ii,0] + chain.priorp[ii,0] + chain.Jp[ii,0] + logQb - chain.ll[ii-1,0] - chain.prior[ii-1,0] - chain.J[ii-1,0] - logQf;
+
+            self.assertAlmostEqual( chain.aprob[ii,0] / np.exp( logR ), 1.0, places=10 );
+
+        # One filter/smoother run per iteration (inside the support)
+        self.assertEqual( chain.nFilterCalls, np.sum( np.isfinite( chain.llp[1:,0] ) ) );
+
+    def testProcesses(self):
+        # The candidates use one seed each, so the chain does not depend on
+        # the number of processes
+        chain1 = runChain( 3, 1 );
+        chain2 = runChain( 3, 2 );
+
+        self.assertTrue( np.array_equal( chain1.th, chain2.th ) );
+        self.assertTrue( np.array_equal( chain1.aprob, chain2.aprob ) );
+        self.assertGreater( np.mean( chain1.accept[1:,0] ), 0.0 );
+
+if __name__ == '__main__':
+    unittest.main();
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
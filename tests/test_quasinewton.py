@@ -0,0 +1,180 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import os
+import sys
+import unittest
+import numpy           as     np
+
+root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' );
+sys.path.insert( 0, root );
+sys.path.insert( 0, os.path.join( root, 'para' ) );
+sys.path.insert( 0, os.path.join( root, 'models' ) );
+
+from   state           import kalman
+from   models          import lgss_4parameters
+import pmh
+
+##############################################################################
+# Reference implementation of the unique states in qPMH2 using np.unique
+# over the log-likelihoods (the states inside the memory length and the ones
+# used for the curvature pairs)
+##############################################################################
+def uniqueReference(chain):
+    kk   = chain.iter;
+    idx  = np.sort( np.unique( chain.ll[0:kk,0], return_index=True )[1] );
+    idx  = idx[ idx >= kk - chain.memoryLength ];
+
+    return idx, idx[ idx < kk - 1 ];
+
+##############################################################################
+# Reference implementation of the Hessian estimate in qPMH2 using the dense
+# BFGS recursion
+##############################################################################
+def hessianReference(chain):
+    kk        = chain.iter;
+    d         = chain.nPars;
+    I         = np.eye( d );
+    Hk        = np.eye( d ) / chain.epsilon;
+    idx, idxU = uniqueReference( chain );
+
+    if ( len( idxU ) - 1 > 2 ):
+        if ( kk - idx[-1] < chain.memoryLength ):
+            skk = chain.th[kk,:]       - chain.th[idx[-1],:];
+            ykk = chain.gradient[kk,:] - chain.gradient[idx[-1],:];
+            Hk  = np.eye( d ) * np.dot( skk, ykk ) / np.dot( ykk, ykk );
+
+        thU       = chain.th[idxU,:];
+        gradientU = chain.gradient[idxU,:];
+
+        for ii in range( len( idxU ) ):
+            ykk = gradientU[ii,:] - gradientU[ii-1,:];
+            skk = thU[ii,:]       - thU[ii-1,:];
+
+            if ( np.sum( skk ) != 0.0 ):
+                rhok = 1.0 / np.dot( ykk, skk );
+                A1   = I - np.outer( skk, ykk ) * rhok;
+                A2   = I - np.outer( ykk, skk ) * rhok;
+                Hk   = np.dot( A1, np.dot( Hk, A2 ) ) + rhok * np.outer( skk, skk );
+
+        Hk = -Hk;
+
+    return Hk;
+
+##############################################################################
+# qPMH2 sampler that compares the unique states and each Hessian estimate
+# with the references
+##############################################################################
+class checkedPMH(pmh.stPMH):
+
+    def extractUniqueElements(self):
+        pmh.stPMH.extractUniqueElements( self );
+
+        self.sameIndex = self.sameIndex and ( list( self.idxU ) == list( uniqueReference( self )[1] ) );
+        self.nIndexChecked += 1;
+
+    def lbfgs_hessian_update(self):
+        Hk = pmh.stPMH.lbfgs_hessian_update( self );
+
+        if ( self.iter > self.memoryLength ):
+            ref           = hessianReference( self );
+            self.maxError = np.max( ( self.maxError, np.max( np.abs( Hk - ref ) ) / np.max( np.abs( ref ) ) ) );
+            self.nChecked += 1;
+
+        return Hk;
+
+def runChain():
+    sys            = lgss_4parameters.ssm();
+    sys.par        = np.zeros( ( sys.nPar, 1 ) );
+    sys.par[0]     = 0.20;
+    sys.par[1]     = 0.80;
+    sys.par[2]     = 1.00;
+    sys.par[3]     = 0.10;
+    sys.T          = 250;
+    sys.xo         = 0.0;
+    sys.generateData( fileName=os.path.join( root, 'data', 'lgssT250_smallR.csv' ), order="xy" );
+
+    th               = lgss_4parameters.ssm();
+    th.nParInference = 3;
+    th.nQInference   = 0;
+    th.copyData( sys );
+
+    km          = kalman.kalmanMethods();
+    km.filter   = km.kf;
+    km.smoother = km.rts;
+
+    chain                      = checkedPMH();
+    chain.nIter                = 300;
+    chain.nBurnIn              = 100;
+    chain.initPar              = th.returnParameters();
+    chain.stepSize             = 1.0;
+    chain.epsilon              = 1000;
+    chain.memoryLength         = 20;
+    chain.PSDmethodhybridSamps = 50;
+    chain.progressInterval     = None;
+
+    chain.sameIndex     = True;
+    chain.nIndexChecked = 0;
+    chain.maxError      = 0.0;
+    chain.nChecked      = 0;
+
+    np.random.seed( 87655678 );
+    chain.runSampler( km, sys, th, "qPMH2" );
+
+    return chain;
+
+##############################################################################
+# Tests
+##############################################################################
+class testQuasiNewton(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.chain = runChain();
+
+    def testUniqueStates(self):
+        chain = self.chain;
+
+        self.assertGreater( chain.nIndexChecked, 0.9 * ( chain.nIter - chain.memoryLength ) );
+        self.assertTrue( chain.sameIndex );
+
+    def testHessianEstimates(self):
+        chain = self.chain;
+
+        self.assertGreater( chain.nChecked, 0.9 * ( chain.nIter - chain.memoryLength ) );
+        self.assertLess( chain.maxError, 1e-10 );
+
+    def testNaturalGradient(self):
+        chain = self.chain;
+        idx   = np.where( chain.hessianFallback[chain.memoryLength+1:,0] == 0.0 )[0] + chain.memoryLength + 1;
+
+        for kk in idx:
+            ref = np.dot( chain.gradientp[kk,:], chain.hessianp[kk,:,:] );
+            self.assertLess( np.max( np.abs( chain.ngradientp[kk,:] - ref ) ), 1e-10 * np.max( ( 1.0, np.max( np.abs( ref ) ) ) ) );
+
+if __name__ == '__main__':
+    unittest.main();
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
@@ -0,0 +1,126 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import os
+import sys
+import unittest
+import numpy           as     np
+
+root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' );
+sys.path.insert( 0, root );
+sys.path.insert( 0, os.path.join( root, 'para' ) );
+sys.path.insert( 0, os.path.join( root, 'models' ) );
+
+# The particle filter requires scipy.weave
+try:
+    from   state       import smc
+    from   pmh_smc2    import smc2Sampler
+    hasWeave = True;
+except ImportError:
+    hasWeave = False;
+
+from   models          import lgss_4parameters
+import pmh
+
+def runSampler(nProcesses):
+    sys            = lgss_4parameters.ssm();
+    sys.par        = np.zeros( ( sys.nPar, 1 ) );
+    sys.par[0]     = 0.20;
+    sys.par[1]     = 0.80;
+    sys.par[2]     = 1.00;
+    sys.par[3]     = 0.10;
+    sys.T          = 60;
+    sys.xo         = 0.0;
+    sys.generateData( fileName=os.path.join( root, 'data', 'lgssT250_smallR.csv' ), order="xy" );
+
+    th               = lgss_4parameters.ssm();
+    th.nParInference = 3;
+    th.nQInference   = 0;
+    th.copyData( sys );
+
+    sm                 = smc.smcSampler();
+    sm.filter          = sm.faPF;
+    sm.smoother        = sm.flPS;
+    sm.nPart           = 50;
+    sm.fixedLag        = 12;
+    sm.genInitialState = True;
+
+    chain              = pmh.stPMH();
+    chain.initPar      = th.returnParameters();
+    chain.invHessian   = np.diag( ( 3e-02, 1e-03, 2e-03 ) );
+    chain.stepSize     = 2.38 / np.sqrt( 3 );
+    chain.memoryLength = 0;
+
+    sampler                  = smc2Sampler();
+    sampler.nParticles       = 40;
+    sampler.nMoves           = 2;
+    sampler.nProcesses       = nProcesses;
+    sampler.seed             = 87655678;
+    sampler.adaptNPart       = False;
+    sampler.progressInterval = None;
+    sampler.initCov          = np.diag( ( 0.04, 0.004, 0.02 ) );
+
+    sampler.runSampler( chain, sm, sys, th, "pPMH0" );
+
+    return sampler;
+
+##############################################################################
+# Tests
+##############################################################################
+@unittest.skipIf( not hasWeave, "the particle filter requires scipy.weave" )
+class testSMC2(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sampler = runSampler( 1 );
+
+    def testMarginalLikelihood(self):
+        # Without exchange steps, the log-marginal likelihood is the sum of
+        # the incremental log-evidence (also over the resample-move steps)
+        s = self.sampler;
+
+        self.assertGreater( len( s.moveTimes ), 0 );
+        self.assertLess( np.max( np.abs( np.diff( s.logMarginalLikelihood ) - s.logEvidence[1:] ) ), 1e-8 );
+
+    def testWeights(self):
+        s = self.sampler;
+
+        self.assertAlmostEqual( np.sum( s.w ), 1.0, places=12 );
+        self.assertTrue( np.all( s.ess[1:] >= 1.0 - 1e-10 ) );
+        self.assertTrue( np.all( s.ess[1:] <= s.nParticles + 1e-10 ) );
+
+    def testProcesses(self):
+        # The parameters use one seed each, so the output does not depend on
+        # the number of processes
+        s = runSampler( 2 );
+
+        self.assertTrue( np.array_equal( s.tho, self.sampler.tho ) );
+        self.assertTrue( np.array_equal( s.w, self.sampler.w ) );
+        self.assertTrue( np.array_equal( s.logMarginalLikelihood, self.sampler.logMarginalLikelihood ) );
+
+if __name__ == '__main__':
+    unittest.main();
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################
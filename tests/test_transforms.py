@@ -0,0 +1,145 @@
+##############################################################################
+##############################################################################
+# Example code for
+# quasi-Newton particle Metropolis-Hastings
+# for a linear Gaussian state space model
+#
+# Please cite:
+#
+# J. Dahlin, F. Lindsten, T. B. Sch\"{o}n
+# "Quasi-Newton particle Metropolis-Hastings"
+# Proceedings of the 17th IFAC Symposium on System Identification,
+# Beijing, China, October 2015.
+#
+# (c) 2015 Johan Dahlin
+# johan.dahlin (at) liu.se
+#
+# Distributed under the MIT license.
+#
+##############################################################################
+##############################################################################
+
+import os
+import sys
+import unittest
+import numpy           as     np
+
+root = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' );
+sys.path.insert( 0, root );
+sys.path.insert( 0, os.path.join( root, 'para' ) );
+sys.path.insert( 0, os.path.join( root, 'models' ) );
+
+from   state           import kalman
+from   models          import lgss_4parameters
+import pmh
+
+def setupModel(version):
+    sys            = lgss_4parameters.ssm();
+    sys.par        = np.zeros( ( sys.nPar, 1 ) );
+    sys.par[0]     = 0.20;
+    sys.par[1]     = 0.80;
+    sys.par[2]     = 1.00;
+    sys.par[3]     = 0.10;
+    sys.T          = 250;
+    sys.xo         = 0.0;
+    sys.generateData( fileName=os.path.join( root, 'data', 'lgssT250_smallR.csv' ), order="xy" );
+
+    th               = lgss_4parameters.ssm();
+    th.version       = version;
+    th.nParInference = 3;
+    th.nQInference   = 0;
+    th.copyData( sys );
+
+    return sys, th;
+
+##############################################################################
+# Kalman smoother that counts the number of runs
+##############################################################################
+class countingKalman(kalman.kalmanMethods):
+
+    nRuns = 0;
+
+    def countedSmoother(self, sys):
+        self.nRuns += 1;
+        self.rts( sys );
+
+##############################################################################
+# Tests
+##############################################################################
+class testTransforms(unittest.TestCase):
+
+    def setUp(self):
+        self.sys, self.th = setupModel( "logitlog" );
+        self.z            = np.array( ( 0.1, 2.0 * np.arctanh( 0.85 ), np.log( 1.1 ) ) );
+
+    # Original parameters at the transformed parameters z
+    def original(self, z):
+        self.th.storeParameters( z, self.sys );
+        self.th.transform();
+        return self.th.returnParameters();
+
+    def testInverse(self):
+        self.original( self.z );
+        self.th.invTransform();
+
+        self.assertLess( np.max( np.abs( self.th.returnParameters() - self.z ) ), 1e-12 );
+
+    def testJacobian(self):
+        h  = 1e-6;
+        dp = np.array( [ ( self.original( self.z + h * e ) - self.original( self.z - h * e ) ) / ( 2.0 * h ) for e in np.eye( 3 ) ] );
+
+        self.original( self.z );
+        self.assertAlmostEqual( self.th.Jacobian(), np.log( np.abs( np.linalg.det( dp ) ) ), places=8 );
+
+    def testGradient(self):
+        km = kalman.kalmanMethods();
+
+        # Log-posterior of the transformed parameters
+        def logPosterior(z):
+            self.original( z );
+            km.kf( self.th );
+            return km.ll + self.th.prior() + self.th.Jacobian();
+
+        self.original( self.z );
+        km.rts( self.th );
+        gradient = self.th.transformGradient( km.gradient );
+
+        h = 1e-5;
+        for ii in range( 3 ):
+            e  = h * np.eye( 3 )[ii,:];
+            fd = ( logPosterior( self.z + e ) - logPosterior( self.z - e ) ) / ( 2.0 * h );
+            self.assertAlmostEqual( gradient[ii] / fd, 1.0, places=5 );
+
+    def testOutOfSupport(self):
+        # Proposals outside the support of the prior are rejected without
+        # running the smoother
+        sys, th     = setupModel( "standard" );
+        km          = countingKalman();
+        km.filter   = km.kf;
+        km.smoother = km.countedSmoother;
+
+        chain                  = pmh.stPMH();
+        chain.nIter            = 200;
+        chain.nBurnIn          = 50;
+        chain.initPar          = th.returnParameters();
+        chain.invHessian       = np.diag( ( 3e-02, 1e-02, 2e-02 ) );
+        chain.stepSize         = 2.0;
+        chain.memoryLength     = 0;
+        chain.progressInterval = None;
+
+        np.random.seed( 87655678 );
+        chain.runSampler( km, sys, th, "pPMH1" );
+
+        self.assertGreater( chain.nOutOfSupport, 0 );
+        self.assertEqual( km.nRuns, chain.nIter - chain.nOutOfSupport );
+        self.assertTrue( np.all( np.abs( chain.tho[:,1] ) <= 1.0 ) );
+        self.assertTrue( np.all( chain.tho[:,2] >= 0.0 ) );
+
+if __name__ == '__main__':
+    unittest.main();
+
+##############################################################################
+##############################################################################
+# End of file
+##############################################################################
+##############################################################################